@@ -19,7 +19,7 @@ const ModelResultsDisplay = ({ results }) => {
     if (results.model_url) {
       const link = document.createElement("a")
       link.href = results.model_url
-      link.download = `model_${results.task}_${results.model_type}.pkl`
+      link.download = `model_${results.task}_${results.model_type}.skmodel`
       document.body.appendChild(link)
       link.click()
       document.body.removeChild(link)
@@ -36,6 +36,7 @@ const MODEL_MAP = {
     gradient_boosting: "GradientBoostingRegressor",
     svr: "SVR",
     knn: "KNeighborsRegressor",
+    knn_index: "KNeighborsRegressor (prebuilt index)",
   },
   Classification: {
     logistic_regression: "LogisticRegression",
@@ -44,6 +45,7 @@ const MODEL_MAP = {
     gradient_boosting: "GradientBoostingClassifier",
     svc: "SVC",
     knn: "KNeighborsClassifier",
+    knn_index: "KNeighborsClassifier (prebuilt index)",
   },
   Clustering: {
     kmeans: "KMeans",
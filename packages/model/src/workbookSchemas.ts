@@ -61,6 +61,13 @@ const workbookConfigSchema = z.object({
     columns: z.array(PreProcessingColumnConfigSchema),
     global_params: z.record(z.string(), z.any()),
     global_preprocessing: z.array(GlobalPreprocessingOptionSchema),
+    // How the per-column transformers are run (see packages/python/column_parallel.py)
+    parallel: z.optional(
+      z.object({
+        strategy: z.enum(["auto", "serial", "threads", "processes"]),
+        n_jobs: z.number().int().nullish(),
+      }),
+    ),
   }),
 });
 
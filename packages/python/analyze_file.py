@@ -2,10 +2,10 @@ import pandas as pd
 import numpy as np
 import sys
 import json
-import io
 from scipy import stats
 from dateutil.parser import parse
 import re
+from dataset_store import ingest_content, load_dataset, read_table
 
 def determine_encoding(series, max_categories_for_ordinal=10, ordinal_threshold=0.9):
     n_unique = series.nunique()
@@ -42,7 +42,7 @@ def is_date(string):
 def detect_date_columns(df, threshold=0.8):
     date_columns = []
     for col in df.columns:
-        if df[col].dtype == 'object':
+        if pd.api.types.is_string_dtype(df[col].dtype):
             # Check if the column contains only string values
             if df[col].apply(lambda x: isinstance(x, str)).all():
                 # Sample the column to improve performance
@@ -150,7 +150,7 @@ def generate_preprocessing_config(df, target_column=None, task=None):
                     column_config["preprocessing"]["outlier_treatment"] = "winsorize"
                     column_config["params"]["winsorize_limits"] = (0.05, 0.95)
         
-        elif pd.api.types.is_object_dtype(df[column]) or pd.api.types.is_categorical_dtype(df[column]):
+        elif pd.api.types.is_string_dtype(df[column].dtype) or isinstance(df[column].dtype, pd.CategoricalDtype):
             column_config["type"] = "categorical"
             
             # Handle missing values
@@ -184,18 +184,18 @@ def generate_preprocessing_config(df, target_column=None, task=None):
 
     return preprocessing_config
 
-# Main execution
-if __name__ == "__main__":
-    # Read input parameters from stdin
-    input_json = sys.stdin.read()
-    input_params = json.loads(input_json)
-
-    file_content = input_params['fileContent']
+def analyze_input(input_params):
+    """Build the preprocessing config for an ingested dataset, a CSV file or CSV content."""
     task_type = input_params['taskType']
     target_column = input_params['targetColumn']
 
-    # Read the CSV content directly from the string
-    df = pd.read_csv(io.StringIO(file_content))
+    # Parsed columns come from the dataset store, so the CSV is only parsed on first sight
+    if input_params.get('datasetKey'):
+        df = load_dataset(input_params['datasetKey'])
+    elif input_params.get('filePath'):
+        df = read_table(input_params['filePath'])
+    else:
+        df = load_dataset(ingest_content(input_params['fileContent'])['dataset_key'])
 
     # Normalize column names in the dataframe
     df.columns = df.columns.str.strip()
@@ -206,9 +206,17 @@ if __name__ == "__main__":
     preprocessing_config = generate_preprocessing_config(df, target_column, task_type)
 
     # Prepare the result
-    result = {
+    return {
         "preProcessingConfig": preprocessing_config,
     }
 
+# Main execution
+if __name__ == "__main__":
+    # Read input parameters from stdin
+    input_json = sys.stdin.read()
+    input_params = json.loads(input_json)
+
+    result = analyze_input(input_params)
+
     # Print the result as JSON
-    print(json.dumps(result))
\ No newline at end of file
+    print(json.dumps(result))
@@ -0,0 +1,318 @@
+"""Scaling benchmark for the analyze, preprocess, train and predict stages.
+
+Every case generates a seeded synthetic dataset (see synthetic.py) and times
+generate_preprocessing_config, preprocess_data, train_pipeline and predict.predict on it,
+recording wall time, peak resident memory and output size per stage:
+
+    python3 benchmarks/pipeline.py --history pipeline_history.jsonl
+
+By default the rows are swept from 10k to 10M at --base-columns and the columns from 10 to
+1000 at --base-rows; --grid runs every combination instead. Cases larger than --max-cells
+are recorded as skipped. Every case runs --repeats times and each stage reports its median
+time. With --history each result is appended to a JSON-lines file and compared against the
+median of the last --baseline-runs results of the same case and stage that were measured
+in the same environment (CPU, Python and library versions); the script exits with status 1
+when a stage got slower than that baseline by more than --max-regression.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+
+import numpy as np
+import pandas as pd
+import sklearn
+
+import dataset_store
+from analyze_file import generate_preprocessing_config
+from preprocessing import preprocess_data
+from create_model import train_pipeline
+from predict import predict
+from model_artifact import load_model_file
+from memory_planner import PeakMemory, budget_bytes
+from synthetic import dataset_spec, spec_id, generate_dataset, TARGET_COLUMN
+
+STAGES = ['analyze', 'preprocess', 'train', 'predict']
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000, 10_000_000]
+DEFAULT_COLUMNS = [10, 100, 1000]
+DEFAULT_MODELS = {'regression': 'ridge', 'classification': 'logistic_regression', 'clustering': 'kmeans'}
+# Environment fields that must match for two timings to be compared; the commit may differ
+COMPARABLE_ENVIRONMENT = ('python', 'numpy', 'pandas', 'sklearn', 'cpus', 'cpu_model', 'machine')
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PYTHON_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    cpu_model = platform.processor() or None
+    try:
+        with open('/proc/cpuinfo') as cpuinfo:
+            cpu_model = next((line.split(':', 1)[1].strip() for line in cpuinfo if line.startswith('model name')),
+                             cpu_model)
+    except OSError:
+        pass
+    return {
+        'commit': commit,
+        'python': sys.version.split()[0],
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'sklearn': sklearn.__version__,
+        'cpus': os.cpu_count(),
+        'cpu_model': cpu_model,
+        'machine': platform.machine()
+    }
+
+
+def environment_id(env):
+    return spec_id({key: env.get(key) for key in COMPARABLE_ENVIRONMENT})
+
+
+def sweep_cases(rows, columns, base_rows, base_columns, grid):
+    if grid:
+        return [(n_rows, n_columns) for n_rows in rows for n_columns in columns]
+    cases = [(n_rows, base_columns) for n_rows in rows]
+    cases += [(base_rows, n_columns) for n_columns in columns if (base_rows, n_columns) not in cases]
+    return cases
+
+
+def measure(function, *args, **kwargs):
+    """Run function once and return its result, wall time and peak resident memory."""
+    with PeakMemory() as peak:
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    return result, {'time_ms': elapsed_ms, 'peak_rss_bytes': peak.peak_bytes,
+                    'baseline_rss_bytes': peak.baseline_bytes}
+
+
+def run_predictions(pipeline, rows):
+    """Score rows one at a time through predict.predict, as the prediction endpoint does."""
+    latencies = []
+    predictions = []
+    for row in rows:
+        start = time.perf_counter()
+        predictions.append(predict(pipeline, {'inputData': row}))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return predictions, latencies
+
+
+def run_case(spec, work_dir, model_type, predict_rows, memory_budget_mb):
+    """Run every stage on one dataset; a failing stage is recorded and skips the stages after it."""
+    task = spec['task']
+    target = TARGET_COLUMN if task != 'clustering' else None
+    df = generate_dataset(spec)
+    data_path = os.path.join(work_dir, 'data.csv')
+    df.to_csv(data_path, index=False)
+
+    # Date columns are passed through untouched by the training pipeline, so it is fed
+    # the remaining columns; generation and this copy are not timed
+    date_columns = [column for column in df.columns if column.startswith('dat_')]
+    train_path = os.path.join(work_dir, 'train.csv')
+    df.drop(columns=date_columns).to_csv(train_path, index=False)
+    features = df.drop(columns=date_columns + ([target] if target else []))
+
+    results = {}
+    config = None
+    try:
+        config, results['analyze'] = measure(generate_preprocessing_config, df, target, task)
+        results['analyze']['output_bytes'] = len(json.dumps(config, default=str))
+
+        (output_csv, _, plan), results['preprocess'] = measure(preprocess_data, data_path, task, target, config,
+                                                               budget_bytes(memory_budget_mb))
+        results['preprocess']['output_bytes'] = os.path.getsize(output_csv)
+        results['preprocess']['memory_plan'] = plan['mode']
+
+        train_config = {**config, 'columns': [column for column in config['columns']
+                                              if column['name'] not in date_columns]}
+        params = {
+            'task': task,
+            'model_type': model_type or DEFAULT_MODELS[task],
+            'model_params': {},
+            'y_column': target,
+            'preprocessing_config': train_config,
+            'artifact_path': os.path.join(work_dir, 'model.skmodel'),
+            'memory_budget_mb': memory_budget_mb
+        }
+        trained, results['train'] = measure(train_pipeline, train_path, params)
+        results['train']['output_bytes'] = os.path.getsize(params['artifact_path'])
+        results['train']['memory_plan'] = trained['memory']['mode']
+
+        pipeline = load_model_file(params['artifact_path'])
+        sample = features.sample(min(predict_rows, len(features)), random_state=spec['seed'])
+        rows = [{key: (None if pd.isna(value) else value) for key, value in row.items()}
+                for row in sample.to_dict(orient='records')]
+        (predictions, latencies), results['predict'] = measure(run_predictions, pipeline, rows)
+        results['predict']['output_bytes'] = len(json.dumps(predictions, default=str))
+        results['predict']['scored_rows'] = len(rows)
+        results['predict']['median_row_ms'] = statistics.median(latencies)
+    except Exception as e:
+        failed = next(stage for stage in STAGES if stage not in results)
+        results[failed] = {'status': 'error', 'error': str(e)[:500]}
+
+    for stage in STAGES:
+        results.setdefault(stage, {'status': 'not_run'})
+        results[stage].setdefault('status', 'ok')
+    return results
+
+
+def run_repeated(spec, work_dir, model_type, predict_rows, memory_budget_mb, repeats):
+    """Run a case repeats times; each stage reports the median time and the largest peak memory."""
+    runs = [run_case(spec, work_dir, model_type, predict_rows, memory_budget_mb) for _ in range(repeats)]
+    results = {}
+    for stage in STAGES:
+        stage_runs = [run[stage] for run in runs]
+        failed = next((result for result in stage_runs if result['status'] != 'ok'), None)
+        if failed is not None:
+            results[stage] = failed
+            continue
+        times = [result['time_ms'] for result in stage_runs]
+        median_run = min(stage_runs, key=lambda result: abs(result['time_ms'] - statistics.median(times)))
+        results[stage] = {**median_run, 'time_ms': statistics.median(times), 'time_ms_runs': times,
+                          'peak_rss_bytes': max(result['peak_rss_bytes'] for result in stage_runs),
+                          'repeats': repeats}
+    return results
+
+
+def compare_with_history(records, history_path, max_regression, baseline_runs, min_baseline_runs):
+    """Append records to the history and return the stages that regressed against it.
+
+    The baseline of a stage is the median time of its last baseline_runs successful results
+    for the same case in a comparable environment; with fewer than min_baseline_runs of
+    them the change is recorded but not flagged.
+    """
+    previous = {}
+    if os.path.exists(history_path):
+        with open(history_path) as file:
+            for line in file:
+                if line.strip():
+                    entry = json.loads(line)
+                    if entry.get('status') == 'ok' and 'environment_id' in entry:
+                        key = (entry['case_id'], entry['stage'], entry['environment_id'])
+                        previous.setdefault(key, []).append(entry['time_ms'])
+
+    regressions = []
+    for record in records:
+        history = previous.get((record['case_id'], record['stage'], record['environment_id']))
+        if record['status'] != 'ok' or not history:
+            continue
+        baseline = statistics.median(history[-baseline_runs:])
+        record['baseline_ms'] = baseline
+        record['baseline_runs'] = len(history[-baseline_runs:])
+        record['change_vs_baseline'] = record['time_ms'] / baseline - 1
+        if record['change_vs_baseline'] > max_regression and record['baseline_runs'] >= min_baseline_runs:
+            regressions.append(record)
+
+    with open(history_path, 'a') as file:
+        for record in records:
+            file.write(json.dumps(record) + '\n')
+    return regressions
+
+
+def parse_sizes(value):
+    return [int(float(size)) for size in value.split(',') if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark analyze, preprocess, train and predict on synthetic data")
+    parser.add_argument('--rows', type=parse_sizes, default=DEFAULT_ROWS, help="Comma-separated row counts")
+    parser.add_argument('--columns', type=parse_sizes, default=DEFAULT_COLUMNS, help="Comma-separated column counts")
+    parser.add_argument('--base-rows', type=int, default=DEFAULT_ROWS[0])
+    parser.add_argument('--base-columns', type=int, default=DEFAULT_COLUMNS[0])
+    parser.add_argument('--grid', action='store_true', help="Run every rows x columns combination")
+    parser.add_argument('--max-cells', type=float, default=2e8, help="Skip cases with more rows x columns")
+    parser.add_argument('--categorical-share', type=float)
+    parser.add_argument('--cardinality', type=int)
+    parser.add_argument('--missing-rate', type=float)
+    parser.add_argument('--date-columns', type=int)
+    parser.add_argument('--skew', type=float)
+    parser.add_argument('--task', choices=['regression', 'classification', 'clustering'])
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--model-type', help="Model trained in the train stage; defaults to a linear model")
+    parser.add_argument('--predict-rows', type=int, default=200, help="Rows scored one by one in the predict stage")
+    parser.add_argument('--memory-budget-mb', type=float, help="Budget passed to the memory planner")
+    parser.add_argument('--repeats', type=int, default=3, help="Runs per case; stages report their median time")
+    parser.add_argument('--output', help="JSON-lines file the results are written to")
+    parser.add_argument('--history', help="JSON-lines file the results are appended to and compared against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Allowed relative growth of a stage's time against the baseline")
+    parser.add_argument('--baseline-runs', type=int, default=5,
+                        help="Previous comparable results whose median is the baseline")
+    parser.add_argument('--min-baseline-runs', type=int, default=3,
+                        help="Comparable results needed before a regression fails the run")
+    args = parser.parse_args()
+
+    # The job modules log at DEBUG level, which would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+
+    env = environment()
+    env_id = environment_id(env)
+    records = []
+    for n_rows, n_columns in sweep_cases(args.rows, args.columns, args.base_rows, args.base_columns, args.grid):
+        spec = dataset_spec(n_rows, n_columns, categorical_share=args.categorical_share,
+                            cardinality=args.cardinality, missing_rate=args.missing_rate,
+                            date_columns=args.date_columns, skew=args.skew, task=args.task, seed=args.seed)
+        case = {'dataset': spec, 'model_type': args.model_type or DEFAULT_MODELS[spec['task']],
+                'predict_rows': args.predict_rows, 'memory_budget_mb': args.memory_budget_mb}
+        case_id = spec_id(case)
+
+        if n_rows * n_columns > args.max_cells:
+            results = {stage: {'status': 'skipped'} for stage in STAGES}
+        else:
+            work_dir = tempfile.mkdtemp(prefix='soupknit-bench-')
+            # A fresh dataset store per case, so preprocess and train include parsing the CSV
+            dataset_store.DEFAULT_STORE_DIR = os.path.join(work_dir, 'store')
+            try:
+                results = run_repeated(spec, work_dir, args.model_type, args.predict_rows, args.memory_budget_mb,
+                                       max(1, args.repeats))
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+        for stage in STAGES:
+            record = {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'case_id': case_id,
+                'stage': stage,
+                'rows': n_rows,
+                'columns': n_columns,
+                **results[stage],
+                'case': case,
+                'environment': env,
+                'environment_id': env_id
+            }
+            records.append(record)
+            print(f"{stage:>10} {n_rows:>10} rows {n_columns:>5} cols  {record['status']:>7}  "
+                  f"{record.get('time_ms', 0):>10.1f} ms  {(record.get('peak_rss_bytes') or 0) / 1e6:>8.1f} MB",
+                  file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record) + '\n')
+
+    regressions = []
+    if args.history:
+        regressions = compare_with_history(records, args.history, args.max_regression, max(1, args.baseline_runs),
+                                           args.min_baseline_runs)
+
+    for record in regressions:
+        print(f"Regression: {record['stage']} at {record['rows']} rows x {record['columns']} columns "
+              f"got {record['change_vs_baseline']:.0%} slower than the median of {record['baseline_runs']} "
+              f"previous runs", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
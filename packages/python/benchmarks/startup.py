@@ -0,0 +1,120 @@
+"""Cold-start benchmark for predict.py.
+
+Each run starts a fresh interpreter, so the numbers include interpreter startup, module
+imports and model loading - what every spawned prediction pays before scoring a row.
+
+    python3 benchmarks/startup.py --model path/to/model.skmodel --history startup_history.jsonl
+
+With --history every run appends its summary to a JSON-lines file and is compared against
+the previous entry; the script exits with status 1 when the median end-to-end time grew by
+more than --max-regression.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+
+from model_artifact import is_artifact, read_artifact_header
+
+
+def sample_row(model_path):
+    """Build one input row from the defaults stored in the artifact's input schema."""
+    if not is_artifact(model_path):
+        raise ValueError("Pass --row for legacy pickle models; only artifacts carry an input schema")
+    schema = read_artifact_header(model_path)['metadata'].get('input_schema')
+    if not schema:
+        raise ValueError("Model artifact has no input schema; pass --row")
+    return {column: schema['defaults'].get(column) for column in schema['columns']}
+
+
+def time_command(command, stdin_data=None):
+    start = time.perf_counter()
+    completed = subprocess.run(command, input=stdin_data, cwd=PYTHON_DIR, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - start) * 1000
+    if completed.returncode != 0:
+        raise RuntimeError(f"{' '.join(command)} failed:\n{completed.stderr[-2000:]}")
+    return elapsed
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        'median_ms': statistics.median(ordered),
+        'p90_ms': ordered[min(len(ordered) - 1, int(round(0.9 * (len(ordered) - 1))))],
+        'min_ms': ordered[0]
+    }
+
+
+def run_benchmark(model_path, row, runs):
+    payload = json.dumps({'model_path': os.path.abspath(model_path), 'feature_data': {'inputData': row}})
+    interpreter = [sys.executable, '-c', 'pass']
+    import_only = [sys.executable, '-c', 'import predict']
+    end_to_end = [sys.executable, 'predict.py']
+
+    # One untimed round warms the OS page cache for the interpreter, libraries and model file
+    time_command(end_to_end, payload)
+
+    samples = {'interpreter': [], 'import': [], 'predict': []}
+    for _ in range(runs):
+        samples['interpreter'].append(time_command(interpreter))
+        samples['import'].append(time_command(import_only))
+        samples['predict'].append(time_command(end_to_end, payload))
+
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'model': os.path.basename(model_path),
+        'runs': runs,
+        'python': sys.version.split()[0],
+        **{name: summarize(values) for name, values in samples.items()}
+    }
+
+
+def compare_with_history(result, history_path, max_regression):
+    previous = None
+    if os.path.exists(history_path):
+        with open(history_path) as file:
+            entries = [json.loads(line) for line in file if line.strip()]
+        entries = [entry for entry in entries if entry.get('model') == result['model']]
+        previous = entries[-1] if entries else None
+
+    with open(history_path, 'a') as file:
+        file.write(json.dumps(result) + '\n')
+
+    if previous is None:
+        return True
+    change = result['predict']['median_ms'] / previous['predict']['median_ms'] - 1
+    result['change_vs_previous'] = change
+    return change <= max_regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure predict.py cold-start time")
+    parser.add_argument('--model', required=True, help="Model artifact (or legacy pickle with --row)")
+    parser.add_argument('--row', help="JSON object with one input row; defaults to the schema defaults")
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--history', help="JSON-lines file the result is appended to and compared against")
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help="Allowed relative growth of the median end-to-end time")
+    args = parser.parse_args()
+
+    row = json.loads(args.row) if args.row else sample_row(args.model)
+    result = run_benchmark(args.model, row, args.runs)
+
+    within_budget = True
+    if args.history:
+        within_budget = compare_with_history(result, args.history, args.max_regression)
+
+    print(json.dumps(result, indent=2))
+    if not within_budget:
+        print(f"Cold-start regression: median grew by {result['change_vs_previous']:.0%}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""Seeded synthetic datasets for the benchmarks.
+
+The same arguments always produce the same rows, so timings from different runs are
+measured on identical data:
+
+    python3 benchmarks/synthetic.py --rows 100000 --columns 50 --output data.csv
+
+Columns are numeric, categorical (with a given cardinality) or date strings. skew makes
+half of the numeric columns log-normal and the category frequencies Zipf-like; missing_rate
+blanks that share of every feature column.
+"""
+import argparse
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+
+DEFAULT_SPEC = {
+    'categorical_share': 0.3,
+    'cardinality': 20,
+    'missing_rate': 0.02,
+    'date_columns': 1,
+    'skew': 1.0,
+    'task': 'regression',
+    'seed': 42
+}
+TARGET_COLUMN = 'target'
+
+
+def dataset_spec(rows, columns, **overrides):
+    """Full description of a dataset; equal specs generate equal data."""
+    spec = {'rows': int(rows), 'columns': int(columns), **DEFAULT_SPEC}
+    spec.update({key: value for key, value in overrides.items() if value is not None})
+    return spec
+
+
+def spec_id(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def column_kinds(spec):
+    n_dates = min(spec['date_columns'], spec['columns'])
+    n_categorical = min(int(round(spec['columns'] * spec['categorical_share'])), spec['columns'] - n_dates)
+    n_numeric = spec['columns'] - n_dates - n_categorical
+    return (['numeric'] * n_numeric) + (['categorical'] * n_categorical) + (['date'] * n_dates)
+
+
+def _category_probabilities(cardinality, skew):
+    weights = 1.0 / np.arange(1, cardinality + 1) ** skew
+    return weights / weights.sum()
+
+
+def generate_dataset(spec):
+    rng = np.random.default_rng(spec['seed'])
+    n_rows = spec['rows']
+    data = {}
+    numeric = []
+
+    for i, kind in enumerate(column_kinds(spec)):
+        name = f"{kind[:3]}_{i}"
+        if kind == 'numeric':
+            if spec['skew'] > 0 and len(numeric) % 2 == 1:
+                values = rng.lognormal(0.0, spec['skew'], n_rows)
+            else:
+                values = rng.normal(0.0, 1.0, n_rows)
+            numeric.append(values)
+            data[name] = values
+        elif kind == 'categorical':
+            labels = np.array([f"c{k}" for k in range(spec['cardinality'])], dtype=object)
+            codes = rng.choice(spec['cardinality'], n_rows, p=_category_probabilities(spec['cardinality'], spec['skew']))
+            data[name] = labels[codes]
+        else:
+            days = rng.integers(0, 3 * 365, n_rows)
+            data[name] = (np.datetime64('2021-01-01') + days.astype('timedelta64[D]')).astype(str)
+
+    df = pd.DataFrame(data)
+
+    # The target depends on the first numeric columns so models have something to learn
+    signal = np.zeros(n_rows)
+    for weight, values in zip([2.0, -1.0, 0.5], numeric):
+        signal += weight * values
+    noise = rng.normal(0.0, 1.0, n_rows)
+    if spec['task'] == 'regression':
+        df[TARGET_COLUMN] = signal + noise
+    elif spec['task'] == 'classification':
+        df[TARGET_COLUMN] = np.where(signal + noise > np.median(signal), 'yes', 'no')
+
+    if spec['missing_rate'] > 0:
+        for name in data:
+            df.loc[rng.random(n_rows) < spec['missing_rate'], name] = np.nan
+
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a seeded synthetic dataset as CSV")
+    parser.add_argument('--rows', type=int, required=True)
+    parser.add_argument('--columns', type=int, required=True)
+    parser.add_argument('--categorical-share', type=float)
+    parser.add_argument('--cardinality', type=int)
+    parser.add_argument('--missing-rate', type=float)
+    parser.add_argument('--date-columns', type=int)
+    parser.add_argument('--skew', type=float)
+    parser.add_argument('--task', choices=['regression', 'classification', 'clustering'])
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    spec = dataset_spec(args.rows, args.columns, categorical_share=args.categorical_share,
+                        cardinality=args.cardinality, missing_rate=args.missing_rate,
+                        date_columns=args.date_columns, skew=args.skew, task=args.task, seed=args.seed)
+    generate_dataset(spec).to_csv(args.output, index=False)
+    print(json.dumps({'spec': spec, 'spec_id': spec_id(spec), 'output': args.output}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Parallel fitting and transforming of the per-column transformers.
+
+get_column_preprocessing builds one small pipeline per column, and ColumnTransformer runs
+them one after another. For wide or long tables they can run side by side instead:
+
+    serial     one after another, as before
+    threads    a thread per transformer; every thread reads the column buffers in place
+    processes  loky worker processes; numeric columns over PROCESS_MEMMAP_BYTES are dumped
+               once to a temp folder and memory-mapped read-only by the workers, instead of
+               being pickled into each of them (string columns are still pickled)
+
+The strategy comes from preprocessing_config['parallel'] ({"strategy": ..., "n_jobs": ...});
+"auto" runs small tables serially, where starting workers costs more than it saves, and
+uses threads otherwise. The parallel settings only apply inside column_parallelism, so a
+fitted preprocessor saved in a model artifact still transforms serially at predict time.
+The block sets the joblib backend for every call inside it, so it should hold the
+preprocessor's fit and transform only; a model fit inside it would run on that backend too.
+"""
+import os
+from contextlib import contextmanager
+from typing import Dict, Any
+import pandas as pd
+
+STRATEGIES = ('auto', 'serial', 'threads', 'processes')
+# Upper bound on workers per job; the worker pool runs several jobs at once
+MAX_JOBS = int(os.environ.get('PYTHON_COLUMN_JOBS', os.cpu_count() or 1))
+# Below either of these, auto stays serial
+PARALLEL_MIN_TRANSFORMERS = 4
+PARALLEL_MIN_CELLS = 1_000_000
+PROCESS_MEMMAP_BYTES = '1M'
+
+_BACKENDS = {'threads': 'threading', 'processes': 'loky'}
+
+
+def plan_parallelism(column_transformer, X: pd.DataFrame, config: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Choose serial, threads or processes for the transformers of column_transformer on X."""
+    config = config or {}
+    strategy = config.get('strategy', 'auto')
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unsupported parallel strategy: {strategy}. Supported strategies are {', '.join(STRATEGIES)}")
+
+    n_transformers = len(column_transformer.transformers) + (column_transformer.remainder != 'drop')
+    n_jobs = max(1, min(int(config.get('n_jobs') or MAX_JOBS), n_transformers))
+    cells = len(X) * len(X.columns)
+
+    if strategy == 'auto':
+        small = n_transformers < PARALLEL_MIN_TRANSFORMERS or cells < PARALLEL_MIN_CELLS
+        strategy = 'serial' if small or n_jobs == 1 else 'threads'
+    if strategy == 'serial':
+        n_jobs = 1
+
+    return {'strategy': strategy, 'n_jobs': n_jobs, 'transformers': n_transformers, 'cells': cells}
+
+
+@contextmanager
+def column_parallelism(column_transformer, plan: Dict[str, Any]):
+    """Fit and transform column_transformer with the planned strategy inside the block."""
+    if plan['strategy'] == 'serial':
+        yield column_transformer
+        return
+
+    from joblib import parallel_config
+
+    options = {'backend': _BACKENDS[plan['strategy']]}
+    if plan['strategy'] == 'processes':
+        options.update(max_nbytes=PROCESS_MEMMAP_BYTES, mmap_mode='r')
+
+    # Set on the instance only for the block; the backend applies to every joblib call in it
+    column_transformer.set_params(n_jobs=plan['n_jobs'])
+    try:
+        with parallel_config(**options):
+            yield column_transformer
+    finally:
+        column_transformer.set_params(n_jobs=None)
@@ -0,0 +1,302 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+# Saved models reference CompiledScorer, so this module is imported whenever one is loaded.
+# Estimator classes are only needed to compile a pipeline and are imported there.
+
+# Above this many (row, tree) pairs sklearn's Cython tree traversal is faster than the NumPy walk
+MAX_TREE_WALK_PAIRS = 50000
+
+
+def _is_missing(values):
+    if values.dtype.kind == 'f':
+        return np.isnan(values)
+    return pd.isna(values)
+
+
+def _is_passthrough(transformer):
+    from sklearn.preprocessing import FunctionTransformer
+
+    # Fitted ColumnTransformers store 'passthrough' as an identity FunctionTransformer
+    if isinstance(transformer, str):
+        return transformer == 'passthrough'
+    return isinstance(transformer, FunctionTransformer) and transformer.func is None
+
+
+def _compile_column_steps(transformer):
+    """Turn one fitted column pipeline into a list of NumPy operations."""
+    from sklearn.pipeline import Pipeline
+    from sklearn.impute import SimpleImputer
+    from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler, MinMaxScaler, RobustScaler
+    from pipeline_runtime import IdentityTransformer
+
+    steps = transformer.steps if isinstance(transformer, Pipeline) else [('step', transformer)]
+    ops = []
+    for _, step in steps:
+        if isinstance(step, IdentityTransformer):
+            continue
+        if isinstance(step, SimpleImputer):
+            if step.add_indicator:
+                raise ValueError("Imputers with missing indicators cannot be compiled")
+            ops.append(('impute', step.statistics_[0]))
+        elif isinstance(step, OneHotEncoder):
+            if step.drop_idx_ is not None or getattr(step, '_infrequent_enabled', False):
+                raise ValueError("One-hot encoders with dropped or infrequent categories cannot be compiled")
+            categories = step.categories_[0]
+            ops.append(('onehot', {category: index for index, category in enumerate(categories)}, len(categories)))
+        elif isinstance(step, OrdinalEncoder):
+            unknown = step.unknown_value if step.handle_unknown == 'use_encoded_value' else np.nan
+            categories = step.categories_[0]
+            ops.append(('ordinal', {category: float(index) for index, category in enumerate(categories)}, unknown))
+        elif isinstance(step, StandardScaler):
+            mean = step.mean_[0] if step.with_mean else 0.0
+            scale = step.scale_[0] if step.with_std else 1.0
+            ops.append(('standardize', mean, scale))
+        elif isinstance(step, MinMaxScaler):
+            if step.clip:
+                raise ValueError("Clipping min-max scalers cannot be compiled")
+            ops.append(('affine', step.scale_[0], step.min_[0]))
+        elif isinstance(step, RobustScaler):
+            center = step.center_[0] if step.with_centering else 0.0
+            scale = step.scale_[0] if step.with_scaling else 1.0
+            ops.append(('standardize', center, scale))
+        else:
+            raise ValueError(f"Preprocessing step '{type(step).__name__}' cannot be compiled")
+    return ops
+
+
+def _apply_column_ops(ops, values):
+    for op in ops:
+        if op[0] == 'impute':
+            values = np.where(_is_missing(values), op[1], values)
+        elif op[0] == 'onehot':
+            lookup, n_categories = op[1], op[2]
+            codes = np.fromiter((lookup.get(value, -1) for value in values), dtype=np.intp, count=len(values))
+            # Unknown categories encode as all zeros, like handle_unknown='ignore'
+            encoded = np.zeros((len(values), n_categories + 1))
+            encoded[np.arange(len(values)), codes] = 1.0
+            return encoded[:, :n_categories]
+        elif op[0] == 'ordinal':
+            lookup, unknown = op[1], op[2]
+            values = np.fromiter((lookup.get(value, unknown) for value in values), dtype=float, count=len(values))
+        elif op[0] == 'standardize':
+            # Same operation order as the scalers so tree thresholds see identical values
+            values = (np.asarray(values, dtype=float) - op[1]) / op[2]
+        else:
+            values = np.asarray(values, dtype=float) * op[1] + op[2]
+    return np.asarray(values, dtype=float).reshape(-1, 1)
+
+
+def _flatten_trees(trees):
+    """Concatenate fitted trees into flat node arrays with per-tree root offsets."""
+    left, right, feature, threshold, missing_left, is_leaf, value, roots = [], [], [], [], [], [], [], []
+    offset = 0
+    for tree in trees:
+        tree = tree.tree_
+        roots.append(offset)
+        leaf = tree.children_left == -1
+        left.append(np.where(leaf, -1, tree.children_left + offset))
+        right.append(np.where(leaf, -1, tree.children_right + offset))
+        feature.append(np.where(leaf, 0, tree.feature))
+        threshold.append(tree.threshold)
+        go_left = getattr(tree, 'missing_go_to_left', None)
+        missing_left.append(np.zeros(tree.node_count, dtype=bool) if go_left is None else go_left.astype(bool))
+        is_leaf.append(leaf)
+        value.append(tree.value[:, 0, :])
+        offset += tree.node_count
+    return {
+        'left': np.concatenate(left),
+        'right': np.concatenate(right),
+        'feature': np.concatenate(feature),
+        'threshold': np.concatenate(threshold),
+        'missing_left': np.concatenate(missing_left),
+        'is_leaf': np.concatenate(is_leaf),
+        'value': np.concatenate(value),
+        'roots': np.array(roots, dtype=np.intp)
+    }
+
+
+def _apply_trees(trees, X):
+    """Return the leaf value of every tree for every row, shape (n_rows, n_trees, n_values)."""
+    # Trees compare float32 copies of the data against float64 thresholds
+    X = np.asarray(X, dtype=np.float32)
+    n_rows, n_trees = X.shape[0], len(trees['roots'])
+    rows = np.repeat(np.arange(n_rows), n_trees)
+    nodes = np.tile(trees['roots'], n_rows)
+    has_missing = np.isnan(X).any()
+
+    # Walk all (row, tree) pairs together, dropping each one as soon as it reaches a leaf
+    active = np.flatnonzero(~trees['is_leaf'][nodes])
+    while active.size:
+        current = nodes[active]
+        x = X[rows[active], trees['feature'][current]]
+        go_left = x <= trees['threshold'][current]
+        if has_missing:
+            go_left |= np.isnan(x) & trees['missing_left'][current]
+        nodes[active] = np.where(go_left, trees['left'][current], trees['right'][current])
+        active = active[~trees['is_leaf'][nodes[active]]]
+    return trees['value'][nodes].reshape(n_rows, n_trees, -1)
+
+
+def _compile_model(model, n_features):
+    from sklearn.linear_model import (LinearRegression, Ridge, Lasso, ElasticNet, LogisticRegression,
+                                      SGDRegressor, SGDClassifier)
+    from sklearn.tree import DecisionTreeRegressor, DecisionTreeClassifier
+    from sklearn.ensemble import (RandomForestRegressor, RandomForestClassifier,
+                                  GradientBoostingRegressor, GradientBoostingClassifier)
+    from sklearn.cluster import KMeans
+    from neighbor_index import IndexedKNNRegressor, IndexedKNNClassifier
+
+    linear_regressors = (LinearRegression, Ridge, Lasso, ElasticNet, SGDRegressor)
+    linear_classifiers = (LogisticRegression, SGDClassifier)
+    if isinstance(model, linear_regressors):
+        return {'kind': 'linear', 'coef': np.atleast_2d(model.coef_).T.astype(float),
+                'intercept': np.atleast_1d(model.intercept_).astype(float), 'classes': None}
+    if isinstance(model, linear_classifiers):
+        return {'kind': 'linear', 'coef': model.coef_.T.astype(float),
+                'intercept': np.atleast_1d(model.intercept_).astype(float), 'classes': model.classes_}
+    # Tree specs reference the fitted trees, which the artifact already stores; the flat node
+    # arrays are built from them when the scorer is first used (see CompiledScorer._tree_arrays)
+    if isinstance(model, (DecisionTreeRegressor, RandomForestRegressor)):
+        trees = model.estimators_ if isinstance(model, RandomForestRegressor) else [model]
+        return {'kind': 'forest', 'estimators': list(trees), 'classes': None}
+    if isinstance(model, (DecisionTreeClassifier, RandomForestClassifier)):
+        trees = model.estimators_ if isinstance(model, RandomForestClassifier) else [model]
+        if any(tree.n_outputs_ != 1 for tree in trees):
+            raise ValueError("Multi-output trees cannot be compiled")
+        return {'kind': 'forest', 'estimators': list(trees), 'classes': model.classes_}
+    if isinstance(model, (GradientBoostingRegressor, GradientBoostingClassifier)):
+        # The raw prediction of the init estimator is a constant for the default prior/mean init
+        if model.init_ == 'zero':
+            init = np.zeros(model.estimators_.shape[1])
+        else:
+            init = model._raw_predict_init(np.zeros((1, n_features)))[0]
+        stages = [list(model.estimators_[:, k]) for k in range(model.estimators_.shape[1])]
+        classes = model.classes_ if isinstance(model, GradientBoostingClassifier) else None
+        return {'kind': 'boosting', 'stages': stages, 'init': init,
+                'learning_rate': model.learning_rate, 'classes': classes}
+    if isinstance(model, KMeans):
+        return {'kind': 'centroids', 'centers': model.cluster_centers_.astype(float), 'classes': None}
+    if isinstance(model, (IndexedKNNRegressor, IndexedKNNClassifier)):
+        # The prebuilt index is already plain arrays; only the preprocessing is compiled
+        return {'kind': 'neighbors', 'model': model, 'classes': None}
+    raise ValueError(f"Model type '{type(model).__name__}' cannot be compiled")
+
+
+class CompiledScorer:
+    """Flat NumPy version of a fitted preprocessing + model pipeline.
+
+    Preprocessing becomes per-column lookup tables and affine maps, linear models a dot
+    product and tree ensembles flat node arrays walked for all rows and trees at once.
+    The node arrays are not pickled: they are rebuilt from the model's own trees on first use.
+    """
+
+    def __init__(self, input_features, column_ops, model_spec):
+        self.input_features = input_features
+        self.column_ops = column_ops
+        self.model_spec = model_spec
+        self._trees = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_trees'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault('_trees', None)
+
+    def _tree_arrays(self):
+        """Flat node arrays of a forest, or one set per class column of a boosting model."""
+        if self._trees is None:
+            spec = self.model_spec
+            # Scorers saved before the arrays were built lazily carry them in the spec
+            if spec['kind'] == 'forest':
+                self._trees = spec['trees'] if 'trees' in spec else _flatten_trees(spec['estimators'])
+            else:
+                self._trees = [stage if isinstance(stage, dict) else _flatten_trees(stage) for stage in spec['stages']]
+        return self._trees
+
+    def handles(self, n_rows: int) -> bool:
+        """Whether scoring n_rows through this scorer is expected to beat the sklearn pipeline."""
+        spec = self.model_spec
+        if spec['kind'] == 'forest':
+            return n_rows * len(self._tree_arrays()['roots']) <= MAX_TREE_WALK_PAIRS
+        if spec['kind'] == 'boosting':
+            return n_rows * sum(len(stage['roots']) for stage in self._tree_arrays()) <= MAX_TREE_WALK_PAIRS
+        return True
+
+    def transform(self, df: pd.DataFrame) -> np.ndarray:
+        columns = []
+        for ops, input_columns in self.column_ops:
+            for column in input_columns:
+                values = df[column].to_numpy()
+                columns.append(_apply_column_ops(ops, values))
+        return np.hstack(columns)
+
+    def predict(self, df: pd.DataFrame) -> np.ndarray:
+        X = self.transform(df)
+        spec = self.model_spec
+        classes = spec['classes']
+
+        if spec['kind'] == 'neighbors':
+            return spec['model'].predict(X)
+
+        if spec['kind'] == 'centroids':
+            distances = ((X[:, None, :] - spec['centers'][None, :, :]) ** 2).sum(axis=2)
+            return distances.argmin(axis=1).astype(np.int32)
+
+        if spec['kind'] == 'linear':
+            scores = X @ spec['coef'] + spec['intercept']
+        elif spec['kind'] == 'forest':
+            leaves = _apply_trees(self._tree_arrays(), X)
+            if classes is not None:
+                leaves = leaves / leaves.sum(axis=2, keepdims=True)
+            scores = leaves.mean(axis=1)
+            if classes is not None:
+                return classes[scores.argmax(axis=1)]
+        else:
+            scores = spec['init'] + spec['learning_rate'] * np.column_stack([
+                _apply_trees(stage, X)[:, :, 0].sum(axis=1) for stage in self._tree_arrays()])
+
+        if classes is None:
+            return scores[:, 0]
+        if scores.shape[1] == 1:
+            return classes[(scores[:, 0] > 0).astype(int)]
+        return classes[scores.argmax(axis=1)]
+
+
+def compile_pipeline(pipeline) -> CompiledScorer:
+    """Compile a fitted pipeline, raising ValueError for steps without a NumPy equivalent."""
+    preprocessor = pipeline.named_steps['preprocessor']
+    column_transformer = preprocessor.preprocessor
+    input_features = preprocessor.input_features_
+
+    column_ops = []
+    for name, transformer, columns in column_transformer.transformers_:
+        if isinstance(transformer, str) and transformer == 'drop' or len(columns) == 0:
+            continue
+        # Remainder columns may be listed by position
+        columns = [input_features[c] if isinstance(c, (int, np.integer)) else str(c) for c in columns]
+        if _is_passthrough(transformer):
+            column_ops.append(([], columns))
+        else:
+            column_ops.append((_compile_column_steps(transformer), columns))
+
+    model_spec = _compile_model(pipeline.named_steps['model'], len(preprocessor.output_features_))
+    return CompiledScorer(input_features, column_ops, model_spec)
+
+
+def verify_scorer(scorer: CompiledScorer, pipeline, X: pd.DataFrame, max_rows: int = 1000) -> Dict[str, Any]:
+    """Compare the compiled scorer with the pipeline on (up to max_rows of) X."""
+    X = X.rename(columns=str)[scorer.input_features].head(max_rows)
+    expected = pipeline.predict(X)
+    actual = scorer.predict(X)
+    if expected.dtype.kind in 'fc':
+        error = float(np.max(np.abs(expected - actual))) if len(X) else 0.0
+        equivalent = bool(np.allclose(expected, actual, rtol=1e-7, atol=1e-9))
+    else:
+        error = float(np.mean(expected != actual)) if len(X) else 0.0
+        equivalent = bool(np.array_equal(expected, actual))
+    return {'equivalent': equivalent, 'max_error': error, 'n_checked': len(X)}
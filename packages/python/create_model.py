@@ -1,30 +1,38 @@
 import pandas as pd
 import numpy as np
 from typing import Dict, Any
-from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.base import clone
 from sklearn.compose import ColumnTransformer
-from sklearn.discriminant_analysis import StandardScaler
-from sklearn.impute import SimpleImputer
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error, accuracy_score, classification_report, confusion_matrix, silhouette_score
-from sklearn.linear_model import LinearRegression, Ridge, Lasso, ElasticNet, LogisticRegression
+from sklearn.linear_model import LinearRegression, Ridge, Lasso, ElasticNet, LogisticRegression, SGDRegressor, SGDClassifier
 from sklearn.ensemble import RandomForestRegressor, RandomForestClassifier, GradientBoostingRegressor, GradientBoostingClassifier
-from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder
-from sklearn.svm import SVR, SVC
+from sklearn.preprocessing import LabelEncoder
 from sklearn.cluster import KMeans, DBSCAN
 from sklearn.tree import DecisionTreeRegressor, DecisionTreeClassifier
 from sklearn.neighbors import KNeighborsRegressor, KNeighborsClassifier
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, KFold, StratifiedKFold
 from sklearn.pipeline import Pipeline
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 import json
-import io
+import hashlib
+import os
 import sys
+import time
 import logging
 import traceback
-import pickle
-import base64
+import sklearn
 
 # Import the get_column_preprocessing function from preprocessing.py
 from preprocessing import get_column_preprocessing
+from kernel_svm import ScalableSVR, ScalableSVC
+from neighbor_index import IndexedKNNRegressor, IndexedKNNClassifier
+from pipeline_runtime import ColumnPreservingTransformer
+from model_artifact import save_artifact, load_model_file, ARTIFACT_EXTENSION
+from compiled_scorer import compile_pipeline, verify_scorer
+from dataset_store import read_table, derived_path
+from memory_planner import plan_execution, use_sparse_output, budget_bytes, training_modes, PeakMemory
+from column_parallel import plan_parallelism, column_parallelism
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -37,19 +45,23 @@ def get_model(task: str, model_type: str, model_params: Dict[str, Any]):
             'ridge': Ridge,
             'lasso': Lasso,
             'elastic_net': ElasticNet,
+            'sgd': SGDRegressor,
             'decision_tree': DecisionTreeRegressor,
             'random_forest': RandomForestRegressor,
             'gradient_boosting': GradientBoostingRegressor,
-            'svr': SVR,
-            'knn': KNeighborsRegressor
+            'svr': ScalableSVR,
+            'knn': KNeighborsRegressor,
+            'knn_index': IndexedKNNRegressor
         },
         'classification': {
             'logistic_regression': LogisticRegression,
+            'sgd': SGDClassifier,
             'decision_tree': DecisionTreeClassifier,
             'random_forest': RandomForestClassifier,
             'gradient_boosting': GradientBoostingClassifier,
-            'svc': SVC,
-            'knn': KNeighborsClassifier
+            'svc': ScalableSVC,
+            'knn': KNeighborsClassifier,
+            'knn_index': IndexedKNNClassifier
         },
         'clustering': {
             'kmeans': KMeans,
@@ -62,114 +74,6 @@ def get_model(task: str, model_type: str, model_params: Dict[str, Any]):
     
     return model_map[task][model_type](**model_params)
 
-class ColumnPreservingTransformer(BaseEstimator, TransformerMixin):
-    def __init__(self, preprocessor):
-        self.preprocessor = preprocessor
-        self.input_features_ = None
-        self.output_features_ = None
-
-    def fit(self, X, y=None):
-        # Convert column names to strings
-        X = X.rename(columns=lambda x: str(x))
-        self.input_features_ = X.columns.tolist()
-        self.preprocessor.fit(X, y)
-        self.output_features_ = self._get_output_feature_names()
-        return self
-
-    def transform(self, X):
-        # Convert column names to strings
-        X = X.rename(columns=lambda x: str(x))
-        # Ensure input features match what the transformer expects
-        missing_cols = set(self.input_features_) - set(X.columns)
-        if missing_cols:
-            raise ValueError(f"Missing columns in input data: {missing_cols}")
-
-        # Reorder columns to match the order during fitting
-        X = X[self.input_features_]
-
-        X_transformed = self.preprocessor.transform(X)
-        return pd.DataFrame(X_transformed, columns=self.output_features_, index=X.index)
-
-    def _get_output_feature_names(self):
-        feature_names = []
-        for name, transformer, columns in self.preprocessor.transformers_:
-            if name == 'remainder':
-                if self.preprocessor.remainder != 'drop':
-                    feature_names.extend(map(str, columns))
-            elif isinstance(transformer, OneHotEncoder):
-                feature_names.extend([f"{str(col)}_{cat}" for col in columns for cat in transformer.categories_[0]])
-            elif isinstance(transformer, OrdinalEncoder):
-                feature_names.extend([f"{str(col)}_encoded" for col in columns])
-            elif isinstance(transformer, StandardScaler):
-                feature_names.extend(map(str, columns))
-            elif isinstance(transformer, Pipeline):
-                # Handle pipeline transformers
-                last_step = transformer.steps[-1][1]
-                if isinstance(last_step, OneHotEncoder):
-                    feature_names.extend([f"{str(col)}_{cat}" for col in columns for cat in last_step.categories_[0]])
-                elif isinstance(last_step, OrdinalEncoder):
-                    feature_names.extend([f"{str(col)}_encoded" for col in columns])
-                else:
-                    feature_names.extend(map(str, columns))
-            else:
-                # For any other transformer, use the input column names
-                feature_names.extend(map(str, columns))
-        
-        return feature_names
-
-    def get_feature_names_out(self, input_features=None):
-        if self.output_features_ is None:
-            raise ValueError("Transformer has not been fitted yet. Call 'fit' before using this method.")
-        return self.output_features_
-
-def get_column_preprocessing(preprocessing_config, columns, task_type):
-    transformers = []
-    
-    for column in preprocessing_config['columns']:
-        column_name = column['name']
-        if column_name not in columns:
-            continue
-        
-        pipeline_steps = []
-        
-        # Imputation
-        if 'imputation' in column['preprocessing']:
-            strategy = column['preprocessing']['imputation']
-            if strategy in ['mean', 'median', 'most_frequent']:
-                pipeline_steps.append(('imputer', SimpleImputer(strategy=strategy)))
-            elif strategy == 'constant':
-                fill_value = column['params'].get('fill_value', 'Unknown')
-                pipeline_steps.append(('imputer', SimpleImputer(strategy='constant', fill_value=fill_value)))
-            elif strategy == 'none':
-                # No imputation, skip this step
-                pass
-
-        # Encoding
-        if column['type'] == 'categorical':
-            if column['preprocessing'].get('encoding') == 'onehot':
-                encoder = OneHotEncoder(sparse=False, handle_unknown='ignore')
-                pipeline_steps.append(('encoder', encoder))
-            elif column['preprocessing'].get('encoding') == 'ordinal':
-                encoder = OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1)
-                pipeline_steps.append(('encoder', encoder))
-
-        # Scaling
-        if 'scaling' in column['preprocessing']:
-            if column['preprocessing']['scaling'] == 'standard':
-                pipeline_steps.append(('scaler', StandardScaler()))
-            elif column['preprocessing']['scaling'] == 'none':
-                # No scaling, skip this step
-                pass
-
-        if pipeline_steps:
-            transformer = Pipeline(steps=pipeline_steps)
-            transformers.append((column_name, transformer, [column_name]))
-        else:
-            # If no preprocessing steps are applied, pass the column through unchanged
-            transformers.append((column_name, 'passthrough', [column_name]))
-    
-    return ColumnTransformer(transformers, remainder='passthrough')
-
 def get_evaluation_code(task: str) -> str:
     if task == 'regression':
         return """
@@ -209,26 +113,642 @@ results['evaluation_output'] = f'Silhouette Score: {silhouette_avg}'
     else:
         raise ValueError(f"Unsupported task: {task}")
 
-def generate_pipeline_code(file_path: str, params: Dict[str, Any]) -> str:
+@lru_cache(maxsize=32)
+def _pipeline_spec_from_json(spec_json: str) -> Pipeline:
+    spec = json.loads(spec_json)
+    preprocessor = get_column_preprocessing(spec['preprocessing_config'], spec['columns'], spec['task'])
+    raw_columns = [column['name'] for column in spec['preprocessing_config'].get('columns', [])]
+    return Pipeline([
+        ('preprocessor', ColumnPreservingTransformer(preprocessor, raw_columns)),
+        ('model', get_model(spec['task'], spec['model_type'], spec['model_params']))
+    ])
+
+def build_pipeline(task: str, model_type: str, model_params: Dict[str, Any],
+                   preprocessing_config: Dict[str, Any], columns):
+    """Return an unfitted pipeline for the config and the hash of the config it was built from.
+
+    The pipeline spec is memoized per config, so repeated requests only pay for a clone.
+    """
+    spec_json = json.dumps({
+        'task': task,
+        'model_type': model_type,
+        'model_params': model_params,
+        'preprocessing_config': preprocessing_config,
+        'columns': [str(column) for column in columns]
+    }, sort_keys=True, default=str)
+    spec_hash = hashlib.sha256(spec_json.encode('utf-8')).hexdigest()
+    return clone(_pipeline_spec_from_json(spec_json)), spec_hash
+
+def _evaluate_regression(y_test, y_pred, X, model):
+    mse = mean_squared_error(y_test, y_pred)
+    r2 = r2_score(y_test, y_pred)
+    mae = mean_absolute_error(y_test, y_pred)
+    return {
+        'metrics': {'mse': float(mse), 'r2': float(r2), 'mae': float(mae)},
+        'evaluation_output': f'Mean Squared Error: {mse}\nR2 Score: {r2}\nMean Absolute Error: {mae}'
+    }
+
+def _evaluate_classification(y_test, y_pred, X, model):
+    accuracy = accuracy_score(y_test, y_pred)
+    classification_rep = classification_report(y_test, y_pred, output_dict=True)
+    return {
+        'metrics': {'accuracy': float(accuracy), 'classification_report': classification_rep},
+        'evaluation_output': f'Accuracy: {accuracy}\nClassification Report:\n{classification_report(y_test, y_pred)}'
+    }
+
+def _evaluate_clustering(y_test, y_pred, X, model):
+    labels = model.labels_ if hasattr(model, 'labels_') else model.predict(X)
+    silhouette_avg = silhouette_score(X, labels)
+    return {
+        'metrics': {'silhouette_score': float(silhouette_avg)},
+        'evaluation_output': f'Silhouette Score: {silhouette_avg}'
+    }
+
+# Same metrics as get_evaluation_code, which is only used for the exported pipeline code
+EVALUATORS = {
+    'regression': _evaluate_regression,
+    'classification': _evaluate_classification,
+    'clustering': _evaluate_clustering
+}
+
+def evaluate_predictions(task: str, y_test, y_pred, X=None, model=None) -> Dict[str, Any]:
+    """Compute the metrics and evaluation text of a task, as the generated pipeline code does."""
+    if task not in EVALUATORS:
+        raise ValueError(f"Unsupported task: {task}")
+    return EVALUATORS[task](y_test, y_pred, X, model)
+
+def _take_rows(data, indices):
+    return data.iloc[indices] if hasattr(data, 'iloc') else data[indices]
+
+def _fit_and_score_fold(fold, task, model_type, model_params, preprocessing_config, X_train, X_test, y_train, y_test):
+    start_time = time.perf_counter()
+
+    # Build a fresh preprocessor per fold so its statistics only see the training split
+    pipeline, _ = build_pipeline(task, model_type, model_params, preprocessing_config, X_train.columns)
+    pipeline.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start_time
+
+    y_pred = pipeline.predict(X_test)
+    score_time = time.perf_counter() - start_time - fit_time
+
+    return {
+        'fold': fold,
+        'metrics': evaluate_predictions(task, y_test, y_pred)['metrics'],
+        'fit_time': fit_time,
+        'score_time': score_time,
+        'train_size': len(X_train),
+        'test_size': len(X_test)
+    }
+
+def _aggregate_fold_metrics(fold_metrics):
+    mean, std = {}, {}
+    for key, value in fold_metrics[0].items():
+        values = [metrics.get(key) for metrics in fold_metrics]
+        if isinstance(value, dict):
+            if all(isinstance(v, dict) for v in values):
+                mean[key], std[key] = _aggregate_fold_metrics(values)
+        elif all(isinstance(v, (int, float)) for v in values):
+            mean[key] = float(np.mean(values))
+            std[key] = float(np.std(values))
+    return mean, std
+
+def run_cross_validation(X, y, task: str, model_type: str, model_params: Dict[str, Any],
+                         preprocessing_config: Dict[str, Any], cv_folds: int, n_jobs: int = None) -> Dict[str, Any]:
+    if task == 'clustering':
+        raise ValueError("Cross-validation is not supported for clustering tasks")
+
+    if task == 'classification':
+        splitter = StratifiedKFold(n_splits=cv_folds, shuffle=True, random_state=42)
+    else:
+        splitter = KFold(n_splits=cv_folds, shuffle=True, random_state=42)
+
+    n_jobs = n_jobs or min(cv_folds, os.cpu_count() or 1)
+    logger.debug(f"Running {cv_folds}-fold cross-validation with {n_jobs} worker(s)")
+
+    fold_args = [
+        (fold, task, model_type, model_params, preprocessing_config,
+         X.iloc[train_idx], X.iloc[test_idx], _take_rows(y, train_idx), _take_rows(y, test_idx))
+        for fold, (train_idx, test_idx) in enumerate(splitter.split(X, y))
+    ]
+
+    start_time = time.perf_counter()
+    if n_jobs == 1:
+        folds = [_fit_and_score_fold(*args) for args in fold_args]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            folds = list(executor.map(_fit_and_score_fold, *zip(*fold_args)))
+    wall_time = time.perf_counter() - start_time
+
+    metrics_mean, metrics_std = _aggregate_fold_metrics([fold['metrics'] for fold in folds])
+
+    return {
+        'n_folds': cv_folds,
+        'stratified': task == 'classification',
+        'n_jobs': n_jobs,
+        'metrics_mean': metrics_mean,
+        'metrics_std': metrics_std,
+        'folds': folds,
+        'wall_time': wall_time
+    }
+
+# Fitted model and cached test matrix shared with importance workers, set once per worker
+_importance_state = None
+
+def _init_importance_worker(model, X, y, task, feature_names):
+    global _importance_state
+    _importance_state = (model, X, y, task, feature_names)
+
+def _score_transformed(model, X, y, task, feature_names):
+    y_pred = model.predict(pd.DataFrame(X, columns=feature_names))
+    return accuracy_score(y, y_pred) if task == 'classification' else r2_score(y, y_pred)
+
+def _permute_feature(column, n_repeats, random_state):
+    model, X, y, task, feature_names = _importance_state
+    start_time = time.perf_counter()
+    rng = np.random.default_rng(random_state + column)
+    X_permuted = X.copy()
+    scores = []
+    for _ in range(n_repeats):
+        X_permuted[:, column] = rng.permutation(X[:, column])
+        scores.append(_score_transformed(model, X_permuted, y, task, feature_names))
+    return scores, time.perf_counter() - start_time
+
+def compute_permutation_importance(pipeline, X_test, y_test, task: str, n_repeats: int = 5,
+                                   max_samples: int = 10000, n_jobs: int = None,
+                                   random_state: int = 42) -> Dict[str, Any]:
+    """Permutation importance of the preprocessed output features.
+
+    The test split is transformed once and every permutation reuses that matrix,
+    so preprocessing is never re-run while columns are shuffled.
+    """
+    if task == 'clustering':
+        raise ValueError("Permutation importance is not supported for clustering tasks")
+
+    start_time = time.perf_counter()
+    preprocessor = pipeline.named_steps['preprocessor']
+    model = pipeline.named_steps['model']
+    feature_names = preprocessor.output_features_
+
+    X_transformed = np.asarray(preprocessor.transform(X_test), dtype=float)
+    y_test = np.asarray(y_test)
+    if len(X_transformed) > max_samples:
+        rows = np.random.default_rng(random_state).choice(len(X_transformed), max_samples, replace=False)
+        X_transformed, y_test = X_transformed[rows], y_test[rows]
+
+    baseline_score = _score_transformed(model, X_transformed, y_test, task, feature_names)
+    columns = range(X_transformed.shape[1])
+    n_jobs = n_jobs or min(len(columns), os.cpu_count() or 1)
+
+    if n_jobs == 1:
+        _init_importance_worker(model, X_transformed, y_test, task, feature_names)
+        outcomes = [_permute_feature(column, n_repeats, random_state) for column in columns]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_importance_worker,
+                                 initargs=(model, X_transformed, y_test, task, feature_names)) as executor:
+            outcomes = list(executor.map(_permute_feature, columns, [n_repeats] * len(columns),
+                                         [random_state] * len(columns)))
+
+    features = []
+    for name, (scores, elapsed) in zip(feature_names, outcomes):
+        drops = baseline_score - np.array(scores)
+        features.append({
+            'feature': name,
+            'importance_mean': float(drops.mean()),
+            'importance_std': float(drops.std()),
+            'time': elapsed
+        })
+    features.sort(key=lambda feature: feature['importance_mean'], reverse=True)
+
+    return {
+        'scoring': 'accuracy' if task == 'classification' else 'r2',
+        'baseline_score': float(baseline_score),
+        'n_samples': len(X_transformed),
+        'n_repeats': n_repeats,
+        'n_jobs': n_jobs,
+        'features': features,
+        'wall_time': time.perf_counter() - start_time
+    }
+
+def _importance_options(params: Dict[str, Any]) -> Dict[str, Any]:
+    options = params.get('feature_importance')
+    return options if isinstance(options, dict) else {}
+
+def get_artifact_path(file_path: str, params: Dict[str, Any]) -> str:
+    return params.get('artifact_path') or derived_path(file_path, '_model' + ARTIFACT_EXTENSION)
+
+def attach_compiled_scorer(pipeline, X_check) -> Dict[str, Any]:
+    """Compile the pipeline into a NumPy scorer and keep it only if it reproduces the pipeline on X_check."""
+    pipeline.compiled_scorer_ = None
+    try:
+        scorer = compile_pipeline(pipeline)
+    except ValueError as e:
+        logger.debug(f"Pipeline not compiled: {str(e)}")
+        return {'compiled': False, 'reason': str(e)}
+
+    try:
+        check = verify_scorer(scorer, pipeline, X_check)
+    except (ValueError, TypeError, KeyError) as e:
+        logger.warning(f"Compiled scorer failed on the check rows: {str(e)}; not using it")
+        return {'compiled': False, 'reason': str(e)}
+    if not check['equivalent']:
+        logger.warning(f"Compiled scorer disagrees with the pipeline (max error {check['max_error']}); not using it")
+        return {'compiled': False, 'reason': 'output mismatch', **check}
+
+    pipeline.compiled_scorer_ = scorer
+    return {'compiled': True, **check}
+
+def export_model(pipeline, artifact_path: str, task: str, model_type: str, compress: bool = False,
+                 X_check=None) -> Dict[str, Any]:
+    """Write the fitted pipeline to a binary artifact and describe it for the results.
+
+    When X_check is given the pipeline is also compiled into a NumPy scorer verified on those rows.
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    compiled = None
+    if X_check is not None:
+        compiled = attach_compiled_scorer(pipeline, X_check)
+    else:
+        # A scorer compiled before a retrain would no longer match the model
+        pipeline.compiled_scorer_ = None
+    header = save_artifact(pipeline, artifact_path, metadata={
+        'task': task,
+        'model_type': model_type,
+        'input_features': preprocessor.input_features_,
+        'output_features': preprocessor.output_features_,
+        'input_schema': getattr(preprocessor, 'input_schema_', None),
+        'compiled_scorer': bool(getattr(pipeline, 'compiled_scorer_', None)),
+        'sklearn_version': sklearn.__version__
+    }, compress=compress)
+    logger.debug(f"Saved model artifact to {artifact_path} ({len(header['buffers'])} out-of-band buffers)")
+    results = {
+        'model_artifact': artifact_path,
+        'artifact_id': header['artifact_id'],
+        'artifact_size': os.path.getsize(artifact_path)
+    }
+    if compiled is not None:
+        results['compiled_scorer'] = compiled
+    return results
+
+def encode_target(y, classes=None):
+    """Integer-encode a categorical target and return the codes with the classes they index.
+
+    Passing the classes of an earlier fit keeps the codes of that fit; labels outside them
+    raise a ValueError. Numeric targets are returned unchanged, with classes None.
+    """
+    if classes is None:
+        if not (pd.api.types.is_object_dtype(y.dtype) or pd.api.types.is_string_dtype(y.dtype)):
+            return y, None
+        encoder = LabelEncoder().fit(y)
+        return encoder.transform(y), encoder.classes_.tolist()
+
+    unseen = set(pd.unique(y)) - set(classes)
+    if unseen:
+        raise ValueError(f"New rows contain classes the model was not trained on: {unseen}")
+    return pd.Index(classes).get_indexer(y), classes
+
+def update_model_incrementally(model, X, y=None, n_new_estimators: int = None) -> str:
+    """Update a fitted model with new rows only and return the strategy used.
+
+    y must be encoded with the classes the model was trained on (see encode_target).
+    """
+    if hasattr(model, 'classes_') and y is not None:
+        unseen = set(np.unique(y)) - set(model.classes_)
+        if unseen:
+            raise ValueError(f"New rows contain classes the model was not trained on: {unseen}")
+
+    if hasattr(model, 'warm_start') and hasattr(model, 'n_estimators'):
+        # Forests grow new trees and boosting adds new stages fit on the new rows only
+        if hasattr(model, 'classes_') and len(np.unique(y)) != len(model.classes_):
+            raise ValueError("Warm-start retraining of a classifier requires every class to appear in the new rows")
+        model.warm_start = True
+        model.n_estimators += n_new_estimators or max(1, model.n_estimators // 10)
+        model.fit(X, y)
+        return 'warm_start'
+
+    if hasattr(model, 'partial_fit'):
+        if hasattr(model, 'classes_') and y is not None:
+            # The new rows may hold only some of the classes
+            model.partial_fit(X, y, classes=model.classes_)
+        elif y is not None:
+            model.partial_fit(X, y)
+        else:
+            model.partial_fit(X)
+        return 'partial_fit'
+
+    if isinstance(model, KMeans):
+        # Fold the new points into the running mean of their nearest centroid. Only the
+        # cluster sizes are kept; labels_ stays the labels of the original training rows
+        X = np.asarray(X, dtype=model.cluster_centers_.dtype)
+        labels = model.predict(X)
+        counts = getattr(model, 'cluster_sizes_', None)
+        if counts is None:
+            counts = np.bincount(model.labels_, minlength=model.n_clusters)
+        new_counts = np.bincount(labels, minlength=model.n_clusters)
+        sums = np.zeros_like(model.cluster_centers_)
+        np.add.at(sums, labels, X)
+        totals = np.maximum(counts + new_counts, 1)[:, None]
+        model.cluster_centers_ = (model.cluster_centers_ * counts[:, None] + sums) / totals
+        model.cluster_sizes_ = counts + new_counts
+        return 'incremental_centroids'
+
+    raise ValueError(f"Model type '{type(model).__name__}' does not support incremental retraining")
+
+def retrain_model(file_path: str, model_path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    task = params['task'].lower()
+    target_column = params.get('y_column')
+
+    # Arrays are copied so the estimators can be updated in place
+    pipeline = load_model_file(model_path, mmap_mode=False)
+
+    # Only the newly appended rows are read
+    df = read_table(file_path)
+    df.columns = df.columns.astype(str)
+    logger.debug(f"Loaded new rows for retraining: {df.shape}")
+
+    if task != 'clustering':
+        X = df.drop(columns=[target_column])
+        y = df[target_column]
+        # Encode with the classes of the original fit; artifacts saved without them keep raw labels
+        classes = getattr(pipeline, 'target_classes_', None)
+        if classes is not None:
+            y, _ = encode_target(y, classes)
+    else:
+        X = df
+        y = None
+
+    results = {}
+    start_time = time.perf_counter()
+
+    # Score the previous model on the new rows before they are learned
+    if task != 'clustering':
+        results['delta_metrics'] = evaluate_predictions(task, y, pipeline.predict(X))['metrics']
+
+    preprocessor = pipeline.named_steps['preprocessor']
+    if params.get('refresh_preprocessing'):
+        preprocessor.partial_fit(X)
+
+    strategy = update_model_incrementally(
+        pipeline.named_steps['model'], preprocessor.transform(X), y, params.get('n_new_estimators'))
+
+    results['retrain'] = {
+        'strategy': strategy,
+        'n_new_rows': len(df),
+        'refresh_preprocessing': bool(params.get('refresh_preprocessing')),
+        'retrain_time': time.perf_counter() - start_time
+    }
+    results['task'] = task
+    results['model_type'] = params['model_type']
+    results.update(export_model(pipeline, get_artifact_path(file_path, params), task, params['model_type'],
+                                params.get('compress_artifact', False),
+                                X if params.get('compile_scorer', True) else None))
+
+    return results
+
+def load_training_data(file_path: str, task: str, target_column: str = None):
+    # Repeated runs on the same file read the parsed columns from the dataset store
+    df = read_table(file_path)
+    logger.debug(f"Loaded data shape: {df.shape}")
+
+    # Convert all column names to strings
+    df.columns = df.columns.astype(str)
+
+    if task == 'clustering':
+        return df, None, None
+
+    X = df.drop(columns=[target_column])
+    # Encode target variable if it's categorical
+    y, classes = encode_target(df[target_column])
+    return X, y, classes
+
+# Share of the training rows fit at each stage of progressive training
+PROGRESSIVE_FRACTIONS = [0.01, 0.05, 0.25, 1.0]
+# Smaller stages say little about the full fit and are merged into the next one
+PROGRESSIVE_MIN_ROWS = 500
+# Each stage fits at least this many times the rows of the one before it
+PROGRESSIVE_MIN_GROWTH = 2
+# Two stages in a row improving the primary metric by less than this count as a plateau
+PLATEAU_TOLERANCE = 0.005
+PRIMARY_METRICS = {'regression': 'r2', 'classification': 'accuracy', 'clustering': 'silhouette_score'}
+
+def progressive_sizes(n_rows: int, fractions=None, min_rows: int = PROGRESSIVE_MIN_ROWS):
+    """Growing sample sizes for the stages of progressive training, ending with all n_rows.
+
+    Stages below min_rows are raised to it, and a stage is dropped when it is not at most
+    1/PROGRESSIVE_MIN_GROWTH of the next one, so 600 rows train in one stage, not [500, 600].
+    """
+    fractions = fractions or PROGRESSIVE_FRACTIONS
+    candidates = {min(n_rows, max(min_rows, int(round(fraction * n_rows)))) for fraction in fractions}
+    sizes = [n_rows]
+    for size in sorted(candidates, reverse=True):
+        if size * PROGRESSIVE_MIN_GROWTH <= sizes[0]:
+            sizes.insert(0, size)
+    return sizes
+
+def progressive_fit(pipeline, X_train, y_train, X_test, y_test, task: str, options: Dict[str, Any] = None,
+                    on_progress=None, should_stop=None, parallel: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Fit the pipeline's model on growing samples of the training rows, evaluating after each stage.
+
+    The preprocessor is fit and applied once and every stage reuses the transformed rows;
+    samples are nested prefixes of one shuffle. A parallel plan (see column_parallel) only
+    applies to the preprocessor, so the model's own n_jobs is untouched. on_progress receives the learning curve
+    after each stage. Training stops before the full data when should_stop returns true, or
+    with options stop_on_plateau once two stages in a row improve the primary metric by less
+    than plateau_tolerance; the pipeline keeps the model of the last stage that ran.
+    """
+    options = options or {}
+    tolerance = options.get('plateau_tolerance', PLATEAU_TOLERANCE)
+    metric = PRIMARY_METRICS[task]
+
+    preprocessor = pipeline.named_steps['preprocessor']
+    start_time = time.perf_counter()
+    X_train_t, X_test_t = _fit_preprocessor(preprocessor, X_train, y_train,
+                                            X_test if task != 'clustering' else None, parallel)
+    preprocess_time = time.perf_counter() - start_time
+
+    order = np.random.default_rng(options.get('random_state', 42)).permutation(len(X_train))
+    sizes = progressive_sizes(len(X_train), options.get('fractions'), options.get('min_rows', PROGRESSIVE_MIN_ROWS))
+    curve = []
+    stop_reason = None
+    for stage, size in enumerate(sizes):
+        sample = np.sort(order[:size])
+        model = clone(pipeline.named_steps['model'])
+        start_time = time.perf_counter()
+        if task != 'clustering':
+            model.fit(_take_rows(X_train_t, sample), _take_rows(y_train, sample))
+            fit_time = time.perf_counter() - start_time
+            evaluation = evaluate_predictions(task, y_test, model.predict(X_test_t))
+        else:
+            model.fit(_take_rows(X_train_t, sample))
+            fit_time = time.perf_counter() - start_time
+            evaluation = evaluate_predictions(task, None, None, X=_take_rows(X_train_t, sample), model=model)
+
+        point = {
+            'stage': stage,
+            'rows': int(size),
+            'fraction': size / len(X_train),
+            'fit_time': fit_time,
+            'metrics': evaluation['metrics']
+        }
+        if curve:
+            point['improvement'] = evaluation['metrics'][metric] - curve[-1]['metrics'][metric]
+        curve.append(point)
+        pipeline.steps[-1] = ('model', model)
+        logger.info(f"Progressive stage {stage}: {size} rows, {metric} {evaluation['metrics'][metric]:.4f}")
+
+        if size < len(X_train):
+            if options.get('stop_on_plateau', False) and len(curve) >= 3 and \
+                    all(p['improvement'] < tolerance for p in curve[-2:]):
+                stop_reason = 'plateau'
+            elif should_stop is not None and should_stop():
+                stop_reason = 'stopped'
+        if on_progress is not None:
+            on_progress({'learning_curve': curve, 'primary_metric': metric,
+                         'final': stop_reason is not None or stage == len(sizes) - 1})
+        if stop_reason:
+            break
+
+    return {
+        'evaluation': evaluation,
+        'learning_curve': curve,
+        'primary_metric': metric,
+        'stopped_early': stop_reason is not None,
+        'stop_reason': stop_reason,
+        'rows_used': curve[-1]['rows'],
+        'preprocess_time': preprocess_time
+    }
+
+def _fit_preprocessor(preprocessor, X_train, y_train, X_test=None, parallel: Dict[str, Any] = None):
+    """Fit preprocessor and transform the train and test rows under the parallel plan only."""
+    with column_parallelism(preprocessor.preprocessor, parallel or {'strategy': 'serial'}):
+        preprocessor.fit(X_train, y_train)
+        X_train_t = preprocessor.transform(X_train)
+        X_test_t = preprocessor.transform(X_test) if X_test is not None else None
+    return X_train_t, X_test_t
+
+def train_pipeline(file_path: str, params: Dict[str, Any], on_progress=None, should_stop=None) -> Dict[str, Any]:
+    """Build, fit, evaluate and export the pipeline described by params without generating code."""
+    task = params['task'].lower()
+    model_type = params['model_type']
+    model_params = params.get('model_params', {})
+    preprocessing_config = params.get('preprocessing_config', {})
+
+    X, y, classes = load_training_data(file_path, task, params.get('y_column'))
+
+    if task != 'clustering':
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    else:
+        X_train, y_train = X, None
+
+    pipeline, spec_hash = build_pipeline(task, model_type, model_params, preprocessing_config, X.columns)
+    logger.debug(f"Built pipeline spec {spec_hash[:12]} for X_train shape {X_train.shape}")
+
+    preprocessor = pipeline.named_steps['preprocessor']
+    # Refuse jobs over an explicit or env memory budget (otherwise warn and run the smallest plan),
+    # and keep wide one-hot output sparse when dense would not fit
+    plan = plan_execution(preprocessor.preprocessor, X_train, budget_bytes(params.get('memory_budget_mb')),
+                          training_modes(pipeline.named_steps['model']))
+    logger.info(f"Memory plan: {plan['mode']} for {plan['rows']} rows x {plan['output_width']} columns")
+    if plan['mode'] == 'sparse':
+        use_sparse_output(preprocessor.preprocessor)
+
+    parallel = plan_parallelism(preprocessor.preprocessor, X_train, preprocessing_config.get('parallel'))
+    logger.info(f"Column transformers: {parallel['strategy']} with {parallel['n_jobs']} job(s)")
+
+    # The parallel plan covers the column transformers only; the model is fit outside it
+    # so its own n_jobs and joblib backend apply
+    with PeakMemory() as peak:
+        start_time = time.perf_counter()
+        if params.get('progressive'):
+            options = params['progressive'] if isinstance(params['progressive'], dict) else {}
+            progressive = progressive_fit(pipeline, X_train, y_train, None if task == 'clustering' else X_test,
+                                          None if task == 'clustering' else y_test, task, options,
+                                          on_progress, should_stop, parallel)
+            fit_time = time.perf_counter() - start_time
+            results = progressive.pop('evaluation')
+            results['progressive'] = progressive
+        else:
+            X_train_t, X_test_t = _fit_preprocessor(preprocessor, X_train, y_train,
+                                                    X_test if task != 'clustering' else None, parallel)
+            model = pipeline.named_steps['model']
+            if task != 'clustering':
+                model.fit(X_train_t, y_train)
+                fit_time = time.perf_counter() - start_time
+                results = evaluate_predictions(task, y_test, model.predict(X_test_t))
+            else:
+                model.fit(X_train_t)
+                fit_time = time.perf_counter() - start_time
+                # Silhouette is computed on the preprocessed features the model was fit on
+                results = evaluate_predictions(task, None, None, X=X_train_t, model=model)
+
+        logger.debug(f"Input features: {preprocessor.input_features_}")
+        logger.debug(f"Output features: {preprocessor.output_features_}")
+
+    # Saved with the model so retraining encodes new labels to the same codes
+    pipeline.target_classes_ = classes
+    results['memory'] = peak.report(plan)
+    results['parallel'] = parallel
+    if hasattr(pipeline.named_steps['model'], 'index_summary'):
+        results['neighbor_index'] = pipeline.named_steps['model'].index_summary()
+    results['task'] = task
+    results['model_type'] = model_type
+    results['pipeline_spec_hash'] = spec_hash
+    results['fit_time'] = fit_time
+
+    if params.get('cv_folds'):
+        results['cross_validation'] = run_cross_validation(
+            X, y, task, model_type, model_params, preprocessing_config,
+            int(params['cv_folds']), params.get('cv_n_jobs'))
+
+    if params.get('feature_importance') and task == 'clustering':
+        # There is no held-out score to permute against
+        results['feature_importance'] = {'skipped': True,
+                                         'reason': "Permutation importance is not supported for clustering tasks"}
+    elif params.get('feature_importance'):
+        results['feature_importance'] = compute_permutation_importance(
+            pipeline, X_test, y_test, task, **_importance_options(params))
+
+    X_check = (X_train if task == 'clustering' else X_test) if params.get('compile_scorer', True) else None
+    artifact_path = get_artifact_path(file_path, params)
+    results.update(export_model(pipeline, artifact_path, task, model_type,
+                                bool(params.get('compress_artifact', False)), X_check))
+
+    # The equivalent standalone code is only produced on request
+    if params.get('export_code'):
+        results['pipeline_code'] = generate_pipeline_code(file_path, {**params, 'artifact_path': artifact_path},
+                                                          sparse_output=plan['mode'] == 'sparse')
+
+    return results
+
+def generate_pipeline_code(file_path: str, params: Dict[str, Any], sparse_output: bool = False) -> str:
     task = params['task'].lower()
     model_type = params['model_type']
     model_params = params.get('model_params', {})
     target_column = params.get('y_column')
     preprocessing_config = params.get('preprocessing_config', {})
+    cv_folds = params.get('cv_folds')
+    artifact_path = get_artifact_path(file_path, params)
+    compress_artifact = bool(params.get('compress_artifact', False))
     
     imports = """
+import logging
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error, accuracy_score, classification_report, silhouette_score
-from sklearn.preprocessing import LabelEncoder
 from sklearn.pipeline import Pipeline
 from preprocessing import get_column_preprocessing
+from memory_planner import use_sparse_output
+from dataset_store import read_table
+from pipeline_runtime import ColumnPreservingTransformer
+from create_model import (get_model, encode_target, export_model, progressive_fit, run_cross_validation,
+                          compute_permutation_importance)
+
+logger = logging.getLogger(__name__)
     """
 
     data_loading = f"""
-# Read the CSV file
-df = pd.read_csv('{file_path}')
+# Read the data (a dataset store key or a CSV path)
+df = read_table('{file_path}')
 logger.debug(f"Loaded data shape: {{df.shape}}")
 
 # Convert all column names to strings
@@ -238,15 +758,13 @@ df.columns = df.columns.astype(str)
 if '{task}' != 'clustering':
     y_column = '{target_column}'
     X = df.drop(columns=[y_column])
-    y = df[y_column]
-    
+
     # Encode target variable if it's categorical
-    if y.dtype == 'object':
-        le = LabelEncoder()
-        y = le.fit_transform(y)
+    y, target_classes = encode_target(df[y_column])
 else:
     X = df
     y = None
+    target_classes = None
 
 # Split the data if not clustering
 if '{task}' != 'clustering':
@@ -254,14 +772,44 @@ if '{task}' != 'clustering':
 else:
     X_train = X
     X_test = X  # For silhouette score calculation
+    y_train = None
 
 logger.debug(f"X_train shape: {{X_train.shape}}")
 logger.debug(f"y_train shape: {{y_train.shape if y_train is not None else None}}")
     """
 
+    if params.get('progressive'):
+        options = params['progressive'] if isinstance(params['progressive'], dict) else {}
+        test_split = 'None, None' if task == 'clustering' else 'X_test, y_test'
+        fit_code = f"""
+# Fit the model on growing samples of the training rows, evaluating after each one
+progressive = progressive_fit(pipeline, X_train, y_train, {test_split}, '{task}', {options})
+"""
+        evaluation_code = """
+results = progressive.pop('evaluation')
+results['progressive'] = progressive
+"""
+    else:
+        fit_code = f"""
+if '{task}' != 'clustering':
+    pipeline.fit(X_train, y_train)
+    y_pred = pipeline.predict(X_test)
+else:
+    labels = pipeline.fit_predict(X_train)
+    # Evaluate clustering on the preprocessed features the model was fit on
+    X = column_preserving_preprocessor.transform(X_train)
+"""
+        evaluation_code = f"""
+results = {{}}
+{get_evaluation_code(task)}
+"""
+
     model_creation = f"""
 # Create preprocessor
 preprocessor = get_column_preprocessing({preprocessing_config}, X.columns, '{task}')
+if {sparse_output}:
+    # Chosen by the memory planner: the dense one-hot output would not fit the memory budget
+    use_sparse_output(preprocessor)
 
 # Wrap the preprocessor in a ColumnPreservingTransformer
 column_preserving_preprocessor = ColumnPreservingTransformer(preprocessor)
@@ -275,58 +823,84 @@ pipeline = Pipeline([
     ('model', model)
 ])
 
-if '{task}' != 'clustering':
-    pipeline.fit(X_train, y_train)
-    y_pred = pipeline.predict(X_test)
-else:
-    labels = pipeline.fit_predict(X_train)
-
+{fit_code}
 # Log the input and output features
 logger.debug(f"Input features: {{column_preserving_preprocessor.input_features_}}")
 logger.debug(f"Output features: {{column_preserving_preprocessor.output_features_}}")
     """
 
 
+    extra_evaluation = ""
+    if cv_folds:
+        extra_evaluation += f"""
+# Cross-validate on the full dataset, refitting preprocessing inside each fold
+results['cross_validation'] = run_cross_validation(X, y, '{task}', '{model_type}', {model_params}, {preprocessing_config}, {int(cv_folds)}, {params.get('cv_n_jobs')})
+"""
+
+    if params.get('feature_importance') and task != 'clustering':
+        extra_evaluation += f"""
+# Permutation importance on the transformed test split
+results['feature_importance'] = compute_permutation_importance(pipeline, X_test, y_test, '{task}', **{_importance_options(params)})
+"""
+
     evaluation = f"""
 # Evaluate the model
-results = {{}}
-{get_evaluation_code(task)}
-
+{evaluation_code}
 results['task'] = '{task}'
 results['model_type'] = '{model_type}'
-
-# Save the entire pipeline
-pickle_buffer = io.BytesIO()
-pickle.dump(pipeline, pickle_buffer)
-pickle_buffer.seek(0)
-results['model_pickle'] = base64.b64encode(pickle_buffer.getvalue()).decode('utf-8')
+pipeline.target_classes_ = target_classes
+{extra_evaluation}
+# Save the entire pipeline as a binary artifact next to the input data
+results.update(export_model(pipeline, '{artifact_path}', '{task}', '{model_type}', {compress_artifact}))
     """
 
-    return imports + data_loading + model_creation + evaluation
-
-def process_json_input(json_input: str) -> str:
+    code = imports + data_loading + model_creation + evaluation
+    _check_standalone(code)
+    return code
+
+def _check_standalone(code: str):
+    """Raise if the generated code uses a name it neither imports nor assigns."""
+    import ast
+    import builtins
+
+    tree = ast.parse(code)
+    defined = set(dir(builtins))
+    used = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            defined.update((alias.asname or alias.name).split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.Name):
+            (defined if isinstance(node.ctx, ast.Store) else used).add(node.id)
+        elif isinstance(node, ast.arg):
+            defined.add(node.arg)
+    undefined = used - defined
+    if undefined:
+        raise ValueError(f"Generated pipeline code uses undefined names: {', '.join(sorted(undefined))}")
+
+def process_json_input(json_input: str, on_progress=None, should_stop=None) -> str:
     try:
         logger.debug(f"Received JSON input: {json_input}")
         data = json.loads(json_input)
         
         logger.debug(f"Parsed data: {json.dumps(data, indent=2)}")
         
-        # Extract the file path and parameters
-        file_path = data['filePath']
+        # Extract the data source (an ingested dataset key or a CSV path) and parameters
+        file_path = data.get('datasetKey') or data['filePath']
         params = data['params']
+
+        # Update a previously trained pipeline with the new rows only
+        if data.get('mode') == 'retrain':
+            results = retrain_model(file_path, data['modelPath'], params)
+            logger.debug(f"Retrain results: {results['retrain']}")
+            return json.dumps({
+                "success": True,
+                "results": results
+            })
         
-        # Generate the pipeline code
-        pipeline_code = generate_pipeline_code(file_path, params)
-        logger.debug(f"Generated pipeline code:\n{pipeline_code}")
-        
-        # Execute the generated code
-        local_vars = {'get_model': get_model, 'logger': logger}
-        exec(pipeline_code, globals(), local_vars)
-        
-        # Extract the results
-        results = local_vars.get('results', {})
+        # Build and train the pipeline directly from the params
+        results = train_pipeline(file_path, params, on_progress, should_stop)
         
-        logger.debug(f"Extracted results: {results}")
+        logger.debug(f"Training results: {results}")
         
         return json.dumps({
             "success": True,
@@ -0,0 +1,268 @@
+"""Content-addressed store of parsed datasets shared by analyze, preprocess and train.
+
+An uploaded CSV is parsed once and written as a dataset file keyed by the SHA-256 of its
+raw bytes. Later steps on the same content - including a re-uploaded copy under another
+name - read the stored columns. The store evicts the least recently used datasets once it
+grows past its size budget.
+
+Dataset files hold no pickles, so a planted file can at worst hold wrong data:
+
+    magic | header length (uint32) | JSON header | column sections
+
+Numeric, boolean and datetime columns are raw NumPy buffers, memory-mapped on load
+instead of parsed again; other columns are JSON lists of their values. The store lives in
+a directory private to the user running the workers (mode 0700, owner checked).
+"""
+import hashlib
+import io
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+DATASET_EXTENSION = '.skdata'
+DEFAULT_STORE_DIR = os.environ.get('DATASET_STORE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'soupknit', 'datasets')
+DEFAULT_MAX_BYTES = int(float(os.environ.get('DATASET_STORE_MB', 2048)) * 1024 * 1024)
+
+_KEY_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+_HASH_CHUNK_BYTES = 1024 * 1024
+# Column sections start on this boundary so buffers can be mapped straight from the file
+_ALIGNMENT = 64
+_MAGIC = b'SKDATA02'
+_PREFIX = struct.Struct('<8sI')
+
+logger = logging.getLogger(__name__)
+
+
+def is_dataset_key(value: str) -> bool:
+    return isinstance(value, str) and bool(_KEY_PATTERN.match(value))
+
+
+def content_hash(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(_HASH_CHUNK_BYTES), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def dataset_path(key: str, store_dir: str = None) -> str:
+    if not is_dataset_key(key):
+        raise ValueError(f"Invalid dataset key: {key}")
+    return os.path.join(store_dir or DEFAULT_STORE_DIR, key + DATASET_EXTENSION)
+
+
+def _private_store(store_dir: str = None) -> str:
+    """Create the store directory if needed and make sure only this user can use it."""
+    store_dir = store_dir or DEFAULT_STORE_DIR
+    os.makedirs(store_dir, mode=0o700, exist_ok=True)
+    stat = os.lstat(store_dir)
+    if not os.path.isdir(store_dir) or os.path.islink(store_dir):
+        raise ValueError(f"Dataset store {store_dir} is not a directory")
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        raise ValueError(f"Dataset store {store_dir} is owned by another user")
+    if stat.st_mode & 0o077:
+        os.chmod(store_dir, 0o700)
+    return store_dir
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _is_buffer_dtype(dtype) -> bool:
+    return isinstance(dtype, np.dtype) and dtype.kind in 'biufcmM'
+
+
+def _json_value(value):
+    if value is None or (np.isscalar(value) and pd.isna(value)):
+        return None
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _column_section(series: pd.Series):
+    """The stored dtype and bytes of one column."""
+    if _is_buffer_dtype(series.dtype):
+        values = np.ascontiguousarray(series.to_numpy())
+        return values.dtype.str, memoryview(values.view(np.uint8))
+    values = [_json_value(value) for value in series.array]
+    return str(series.dtype), memoryview(json.dumps(values, default=str).encode('utf-8'))
+
+
+def _write_dataset(df: pd.DataFrame, path: str) -> None:
+    columns = [str(column) for column in df.columns]
+    sections, entries = [], []
+    offset = 0
+    for i, column in enumerate(columns):
+        dtype, section = _column_section(df.iloc[:, i])
+        entries.append({'name': column, 'dtype': dtype, 'buffer': _is_buffer_dtype(df.iloc[:, i].dtype),
+                        'offset': offset, 'length': section.nbytes})
+        sections.append(section)
+        offset = _align(offset + section.nbytes)
+
+    header = json.dumps({
+        'kind': 'dataset',
+        'rows': len(df),
+        'columns': columns,
+        'dtypes': {column: str(df.iloc[:, i].dtype) for i, column in enumerate(columns)},
+        'sections': entries
+    }).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header))
+    with open(path, 'wb') as file:
+        file.write(_PREFIX.pack(_MAGIC, len(header)))
+        file.write(header)
+        file.write(b'\0' * (data_start - _PREFIX.size - len(header)))
+        position = 0
+        for section, entry in zip(sections, entries):
+            file.write(b'\0' * (entry['offset'] - position))
+            file.write(section)
+            position = entry['offset'] + entry['length']
+
+
+def _read_header(file) -> Dict[str, Any]:
+    prefix = file.read(_PREFIX.size)
+    if len(prefix) < _PREFIX.size or _PREFIX.unpack(prefix)[0] != _MAGIC:
+        raise ValueError("Not a dataset file")
+    header_length = _PREFIX.unpack(prefix)[1]
+    header = json.loads(file.read(header_length).decode('utf-8'))
+    header['data_start'] = _align(_PREFIX.size + header_length)
+    return header
+
+
+def _read_dataset(path: str) -> pd.DataFrame:
+    with open(path, 'rb') as file:
+        header = _read_header(file)
+        # Copy-on-write, so callers may modify the columns without touching the file
+        data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY))
+
+    columns = {}
+    for entry in header['sections']:
+        start = header['data_start'] + entry['offset']
+        view = data[start:start + entry['length']]
+        if entry['buffer']:
+            columns[entry['name']] = np.frombuffer(view, dtype=np.dtype(entry['dtype']))
+            continue
+        # Missing values come back as NaN, as read_csv gives them
+        values = pd.Series(json.loads(bytes(view).decode('utf-8')), dtype=object)
+        values = values.where(values.notna(), np.nan)
+        columns[entry['name']] = values.array if entry['dtype'] == 'object' else values.astype(entry['dtype']).array
+    return pd.DataFrame(columns, columns=header['columns'], copy=False)
+
+
+def _describe(key: str, path: str, cached: bool) -> Dict[str, Any]:
+    with open(path, 'rb') as file:
+        metadata = _read_header(file)
+    return {
+        'dataset_key': key,
+        'path': path,
+        'rows': metadata['rows'],
+        'columns': metadata['columns'],
+        'bytes': os.path.getsize(path),
+        'cached': cached
+    }
+
+
+def _store_frame(df: pd.DataFrame, key: str, store_dir: str, max_bytes: int) -> str:
+    path = dataset_path(key, store_dir)
+    # Workers may ingest the same upload at once; each writes its own file and the rename is atomic
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    _write_dataset(df, temp_path)
+    os.replace(temp_path, path)
+    evict(store_dir, max_bytes, keep=path)
+    return path
+
+
+def _ingest(key: str, read_source, store_dir: str = None, max_bytes: int = None) -> Dict[str, Any]:
+    store_dir = _private_store(store_dir)
+    path = dataset_path(key, store_dir)
+    if os.path.exists(path):
+        try:
+            description = _describe(key, path, True)
+        except ValueError:
+            # Written in an older format; parse the source again
+            logger.info(f"Dataset {key[:12]} in store has an old format, ingesting again")
+        else:
+            # Refresh the modification time, which eviction uses as last access
+            os.utime(path)
+            logger.info(f"Dataset {key[:12]} found in store")
+            return description
+
+    df = read_source()
+    _store_frame(df, key, store_dir, DEFAULT_MAX_BYTES if max_bytes is None else max_bytes)
+    logger.info(f"Ingested dataset {key[:12]} with shape {df.shape}")
+    return _describe(key, path, False)
+
+
+def ingest_file(file_path: str, store_dir: str = None, max_bytes: int = None) -> Dict[str, Any]:
+    """Parse a CSV file into the store unless identical content is already there."""
+    return _ingest(content_hash(file_path), lambda: pd.read_csv(file_path), store_dir, max_bytes)
+
+
+def ingest_content(content: str, store_dir: str = None, max_bytes: int = None) -> Dict[str, Any]:
+    """Like ingest_file for CSV content passed as a string."""
+    key = hashlib.sha256(content.encode('utf-8')).hexdigest()
+    return _ingest(key, lambda: pd.read_csv(io.StringIO(content)), store_dir, max_bytes)
+
+
+def load_dataset(key: str, store_dir: str = None) -> pd.DataFrame:
+    """Load a stored dataset; columns are copy-on-write views over the mapped file."""
+    path = dataset_path(key, _private_store(store_dir))
+    if not os.path.exists(path):
+        raise ValueError(f"Dataset {key} is not in the store; ingest it again")
+    os.utime(path)
+    return _read_dataset(path)
+
+
+def read_table(source: str, store_dir: str = None) -> pd.DataFrame:
+    """Read a dataset given either its key or the path of a CSV file."""
+    if is_dataset_key(source) and not os.path.exists(source):
+        return load_dataset(source, store_dir)
+    return load_dataset(ingest_file(source, store_dir)['dataset_key'], store_dir)
+
+
+def derived_path(source: str, suffix: str) -> str:
+    """Path for a file produced from source: next to a CSV file, or a fresh temp file for a key."""
+    if is_dataset_key(source) and not os.path.exists(source):
+        fd, path = tempfile.mkstemp(prefix=f"{source[:12]}_", suffix=suffix)
+        os.close(fd)
+        return path
+    return os.path.splitext(source)[0] + suffix
+
+
+def evict(store_dir: str = None, max_bytes: int = None, keep: str = None) -> int:
+    """Delete least recently used datasets until the store fits max_bytes; returns bytes freed."""
+    store_dir = _private_store(store_dir)
+    max_bytes = DEFAULT_MAX_BYTES if max_bytes is None else max_bytes
+
+    entries = []
+    for name in os.listdir(store_dir):
+        if not name.endswith(DATASET_EXTENSION):
+            continue
+        path = os.path.join(store_dir, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    for _, size, path in sorted(entries):
+        if total - freed <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        freed += size
+        logger.info(f"Evicted dataset {os.path.basename(path)} ({size} bytes)")
+    return freed
@@ -0,0 +1,136 @@
+import pandas as pd
+from typing import Dict, Any, List
+
+# Categorical columns with more distinct values than this are not validated against a category list
+MAX_SCHEMA_CATEGORIES = 1000
+
+
+def _column_kind(series):
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+        return 'numeric'
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return 'datetime'
+    return 'categorical'
+
+
+def _derive_source(column, raw_columns):
+    # Columns of an already preprocessed file look like 'transformer_city__city_ny' or 'remainder__age'
+    name = column.split('__', 1)[1] if '__' in column else column
+    # Longest names first so 'city_code' is not mistaken for a category of 'city'
+    for raw in sorted(raw_columns, key=len, reverse=True):
+        if name == raw:
+            return {'source': raw, 'category': None}
+        if name.startswith(raw + '_'):
+            return {'source': raw, 'category': name[len(raw) + 1:]}
+    return None
+
+
+def build_input_schema(X: pd.DataFrame, raw_columns: List[str] = None) -> Dict[str, Any]:
+    """Describe the columns a pipeline was trained on so prediction input can be aligned in one step.
+
+    raw_columns are the user-facing column names from the preprocessing config. Training columns
+    derived from them (for example one-hot columns of a preprocessed file) record their source
+    column and category, so raw input can be mapped without parsing names at prediction time.
+    """
+    columns = [str(column) for column in X.columns]
+    schema = {'columns': columns, 'dtypes': {}, 'categories': {}, 'defaults': {}, 'sources': {}}
+
+    for column, (_, series) in zip(columns, X.items()):
+        kind = _column_kind(series)
+        schema['dtypes'][column] = kind
+        non_null = series.dropna()
+
+        if kind == 'numeric':
+            schema['defaults'][column] = float(non_null.median()) if len(non_null) else None
+        elif kind == 'categorical':
+            categories = sorted(non_null.astype(str).unique().tolist())
+            if len(categories) <= MAX_SCHEMA_CATEGORIES:
+                schema['categories'][column] = categories
+            schema['defaults'][column] = str(non_null.astype(str).mode().iloc[0]) if len(non_null) else None
+        else:
+            schema['defaults'][column] = None
+
+        if raw_columns and column not in raw_columns:
+            source = _derive_source(column, raw_columns)
+            if source is not None:
+                schema['sources'][column] = source
+                if source['category'] is not None:
+                    schema['defaults'][column] = 0.0
+
+    return schema
+
+
+def plan_alignment(schema: Dict[str, Any], input_columns) -> Dict[str, Any]:
+    """Work out once how a set of input columns maps onto the schema."""
+    input_columns = set(map(str, input_columns))
+    copies, indicators, fill, missing = {}, [], {}, []
+
+    for column in schema['columns']:
+        if column in input_columns:
+            continue
+        source = schema['sources'].get(column)
+        if source and source['source'] in input_columns:
+            if source['category'] is None:
+                copies[column] = source['source']
+            else:
+                indicators.append((column, source['source'], source['category']))
+        else:
+            missing.append(column)
+            if schema['defaults'].get(column) is not None:
+                fill[column] = schema['defaults'][column]
+
+    return {
+        'columns': schema['columns'],
+        'copies': copies,
+        'indicators': indicators,
+        'fill': fill,
+        'missing': missing,
+        'numeric': [column for column in schema['columns'] if schema['dtypes'][column] == 'numeric'],
+        'categorical': [column for column in schema['columns'] if schema['dtypes'][column] == 'categorical'],
+        'categories': schema['categories'],
+        'defaults': {column: value for column, value in schema['defaults'].items() if value is not None}
+    }
+
+
+def apply_alignment(plan: Dict[str, Any], df: pd.DataFrame) -> pd.DataFrame:
+    df = df.rename(columns=str)
+
+    derived = {column: df[source] for column, source in plan['copies'].items()}
+    derived.update({
+        column: (df[source].astype(str) == category).astype(float)
+        for column, source, category in plan['indicators']
+    })
+    if derived:
+        df = df.assign(**derived)
+
+    # Reorder, drop unknown columns and add missing ones in a single step
+    aligned = df.reindex(columns=plan['columns'])
+    if plan['fill']:
+        aligned = aligned.fillna(plan['fill'])
+
+    if plan['numeric']:
+        raw = aligned[plan['numeric']]
+        numeric = raw.apply(pd.to_numeric, errors='coerce')
+        # Values that could not be parsed fall back to the training default instead of becoming NaN
+        unparsed = numeric.isna() & raw.notna()
+        if unparsed.any().any():
+            numeric = numeric.mask(unparsed, pd.Series(plan['defaults']).reindex(plan['numeric']), axis=1)
+        aligned[plan['numeric']] = numeric
+    for column in plan['categorical']:
+        values = aligned[column]
+        aligned[column] = values.where(values.isna(), values.astype(str))
+
+    return aligned
+
+
+def find_unknown_categories(plan: Dict[str, Any], aligned: pd.DataFrame) -> Dict[str, List[str]]:
+    unknown = {}
+    for column in plan['categorical']:
+        categories = plan['categories'].get(column)
+        if categories is None:
+            continue
+        values = aligned[column]
+        mask = values.notna() & ~values.isin(categories)
+        if mask.any():
+            unknown[column] = sorted(values[mask].unique().tolist())
+    return unknown
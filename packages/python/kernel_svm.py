@@ -0,0 +1,167 @@
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin, ClassifierMixin
+from sklearn.kernel_approximation import Nystroem, RBFSampler
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVR, SVC, LinearSVR, LinearSVC
+from sklearn.utils.metaestimators import available_if
+
+KERNEL_APPROXIMATIONS = ['auto', 'exact', 'nystroem', 'rff']
+# libsvm solver settings with no counterpart in the linear solvers, and their SVR/SVC defaults
+EXACT_ONLY_PARAMS = {'shrinking': True, 'cache_size': 200}
+
+
+class _KernelApproximationMixin:
+    """Shared fitting logic for SVMs that swap the exact kernel for an explicit feature map.
+
+    With kernel_approximation='auto' the exact solver is used up to auto_threshold rows and
+    a Nystroem map with a linear solver above it, so model size and prediction cost are
+    bounded by n_components instead of the number of support vectors. The libsvm-only
+    settings in EXACT_ONLY_PARAMS are rejected when the approximation is used.
+    """
+
+    def _resolve_approximation(self, n_samples):
+        if self.kernel_approximation not in KERNEL_APPROXIMATIONS:
+            raise ValueError(f"Unsupported kernel approximation '{self.kernel_approximation}'. "
+                             f"Choose one of {KERNEL_APPROXIMATIONS}")
+        if self.kernel_approximation == 'auto':
+            return 'nystroem' if n_samples > self.auto_threshold else 'exact'
+        return self.kernel_approximation
+
+    def _resolve_gamma(self, X):
+        # Match the 'scale' and 'auto' definitions used by the exact libsvm estimators
+        if self.gamma == 'scale':
+            variance = X.var()
+            return 1.0 / (X.shape[1] * variance) if variance != 0 else 1.0
+        if self.gamma == 'auto':
+            return 1.0 / X.shape[1]
+        return self.gamma
+
+    def _build_feature_map(self, X, approximation):
+        n_components = min(self.n_components, X.shape[0])
+        gamma = self._resolve_gamma(X)
+        if approximation == 'rff':
+            if self.kernel != 'rbf':
+                raise ValueError(f"Random Fourier features only approximate the 'rbf' kernel, got '{self.kernel}'")
+            return RBFSampler(gamma=gamma, n_components=n_components, random_state=self.random_state)
+        return Nystroem(kernel=self.kernel, gamma=gamma, degree=self.degree, coef0=self.coef0,
+                        n_components=n_components, random_state=self.random_state)
+
+    def _check_approximation_params(self):
+        changed = [name for name, default in EXACT_ONLY_PARAMS.items() if getattr(self, name) != default]
+        if changed:
+            raise ValueError(f"{', '.join(changed)} can only be used with the exact solver; set "
+                             f"kernel_approximation='exact' to use them (approximation '{self.approximation_}' was chosen)")
+
+    def _fit_estimator(self, X, y, exact_estimator, linear_estimator):
+        X = np.asarray(X, dtype=float)
+        self.approximation_ = self._resolve_approximation(X.shape[0])
+        if self.approximation_ != 'exact':
+            self._check_approximation_params()
+        if self.approximation_ == 'exact':
+            self.estimator_ = exact_estimator
+        elif self.kernel == 'linear':
+            self.estimator_ = linear_estimator
+        else:
+            self.estimator_ = Pipeline([
+                ('feature_map', self._build_feature_map(X, self.approximation_)),
+                ('linear', linear_estimator)
+            ])
+        self.estimator_.fit(X, y)
+        self.n_features_in_ = X.shape[1]
+        return self
+
+    def predict(self, X):
+        return self.estimator_.predict(np.asarray(X, dtype=float))
+
+
+class ScalableSVR(_KernelApproximationMixin, RegressorMixin, BaseEstimator):
+    def __init__(self, kernel='rbf', C=1.0, epsilon=0.1, gamma='scale', degree=3, coef0=0.0, tol=1e-3,
+                 shrinking=True, cache_size=200, verbose=False, max_iter=-1, kernel_approximation='auto',
+                 n_components=300, auto_threshold=10000, random_state=None):
+        self.kernel = kernel
+        self.C = C
+        self.epsilon = epsilon
+        self.gamma = gamma
+        self.degree = degree
+        self.coef0 = coef0
+        self.tol = tol
+        self.shrinking = shrinking
+        self.cache_size = cache_size
+        self.verbose = verbose
+        self.max_iter = max_iter
+        self.kernel_approximation = kernel_approximation
+        self.n_components = n_components
+        self.auto_threshold = auto_threshold
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        exact = SVR(kernel=self.kernel, C=self.C, epsilon=self.epsilon, gamma=self.gamma,
+                    degree=self.degree, coef0=self.coef0, tol=self.tol, shrinking=self.shrinking,
+                    cache_size=self.cache_size, verbose=self.verbose, max_iter=self.max_iter)
+        linear = LinearSVR(C=self.C, epsilon=self.epsilon, tol=self.tol, dual='auto', verbose=int(self.verbose),
+                           max_iter=self.max_iter if self.max_iter > 0 else 1000,
+                           random_state=self.random_state)
+        return self._fit_estimator(X, y, exact, linear)
+
+
+class ScalableSVC(_KernelApproximationMixin, ClassifierMixin, BaseEstimator):
+    def __init__(self, kernel='rbf', C=1.0, gamma='scale', degree=3, coef0=0.0, shrinking=True,
+                 probability=False, tol=1e-3, cache_size=200, class_weight=None, verbose=False, max_iter=-1,
+                 decision_function_shape='ovr', break_ties=False, kernel_approximation='auto', n_components=300,
+                 auto_threshold=10000, random_state=None):
+        self.kernel = kernel
+        self.C = C
+        self.gamma = gamma
+        self.degree = degree
+        self.coef0 = coef0
+        self.shrinking = shrinking
+        self.probability = probability
+        self.tol = tol
+        self.cache_size = cache_size
+        self.class_weight = class_weight
+        self.verbose = verbose
+        self.max_iter = max_iter
+        self.decision_function_shape = decision_function_shape
+        self.break_ties = break_ties
+        self.kernel_approximation = kernel_approximation
+        self.n_components = n_components
+        self.auto_threshold = auto_threshold
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        exact = SVC(kernel=self.kernel, C=self.C, gamma=self.gamma, degree=self.degree, coef0=self.coef0,
+                    shrinking=self.shrinking, tol=self.tol,
+                    cache_size=self.cache_size, class_weight=self.class_weight, verbose=self.verbose,
+                    max_iter=self.max_iter, decision_function_shape=self.decision_function_shape,
+                    break_ties=self.break_ties, random_state=self.random_state)
+        # The linear solvers are one-vs-rest and predict the class with the largest decision value
+        linear = LinearSVC(C=self.C, tol=self.tol, class_weight=self.class_weight, dual='auto',
+                           verbose=int(self.verbose), max_iter=self.max_iter if self.max_iter > 0 else 1000,
+                           random_state=self.random_state)
+        if self.decision_function_shape == 'ovo' and self._resolve_approximation(len(X)) != 'exact':
+            raise ValueError("decision_function_shape='ovo' requires kernel_approximation='exact'")
+        self._fit_estimator(X, y, exact, linear)
+        self.classes_ = self.estimator_.classes_
+
+        self.calibrator_ = None
+        if self.probability:
+            # Platt scaling on 5 folds, as SVC(probability=True) does, whose probability
+            # parameter is deprecated since sklearn 1.9; predict keeps using estimator_
+            from sklearn.base import clone
+            from sklearn.calibration import CalibratedClassifierCV
+            self.calibrator_ = CalibratedClassifierCV(clone(self.estimator_), method='sigmoid', cv=5)
+            self.calibrator_.fit(np.asarray(X, dtype=float), y)
+        return self
+
+    def decision_function(self, X):
+        return self.estimator_.decision_function(np.asarray(X, dtype=float))
+
+    def _check_probability(self):
+        if not self.probability:
+            raise AttributeError("predict_proba is not available when probability=False")
+        return True
+
+    @available_if(_check_probability)
+    def predict_proba(self, X):
+        model = self.calibrator_ if getattr(self, 'calibrator_', None) is not None else self.estimator_
+        return model.predict_proba(np.asarray(X, dtype=float))
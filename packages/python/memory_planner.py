@@ -0,0 +1,217 @@
+"""Memory budget planning for preprocessing and training.
+
+Before a ColumnTransformer is fit, the output width is estimated from the configured
+transformers (one-hot category counts, date features, passthrough columns) and the row
+count, and the cheapest execution mode that fits the budget is chosen:
+
+    dense    float64 fit_transform, as before
+    float32  transformed in row chunks into a float32 array
+    sparse   transformed to CSR; rows are densified chunk by chunk when written
+    chunked  transformed and written in row chunks, never holding the whole output
+
+When the estimate exceeds the budget in every allowed mode, a job with an explicit budget
+(passed in, or PYTHON_MEMORY_BUDGET_MB) is refused before any large allocation; under the
+default budget it runs in the allowed mode with the smallest estimate and logs a warning.
+PeakMemory reports the measured peak resident memory of the step.
+"""
+import logging
+import os
+import resource
+import pandas as pd
+from typing import Dict, Any
+
+MB = 1024 * 1024
+DEFAULT_BUDGET_BYTES = int(float(os.environ.get('PYTHON_MEMORY_BUDGET_MB', 2048)) * MB)
+# A budget set by the operator is enforced like one passed with the job
+DEFAULT_BUDGET_ENFORCED = 'PYTHON_MEMORY_BUDGET_MB' in os.environ
+
+PREPROCESS_MODES = ('dense', 'float32', 'sparse', 'chunked')
+TRAINING_MODES = ('dense', 'sparse')
+
+# fit_transform holds every column block before stacking them, the stacked result is
+# copied once more when it becomes a DataFrame, and writing it needs about one more
+DENSE_COPIES = 3
+# Temporaries of the encoders and the CSV writer that do not scale with the output width
+WORKING_OVERHEAD_BYTES = 32 * MB
+# CSR stores a float64 value and an int32 column index per non-zero
+SPARSE_BYTES_PER_VALUE = 12
+# ColumnTransformer.fit runs a full fit_transform, so outside dense mode it is fit with
+# sparse one-hot output, which holds the sparse blocks and their stacked copy
+SPARSE_FIT_COPIES = 2
+MIN_CHUNK_ROWS = 1000
+# Share of the budget left after the input that a single chunk may use
+CHUNK_BUDGET_SHARE = 0.25
+_SAMPLE_ROWS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+def budget_bytes(budget_mb=None):
+    """Budget in bytes for a job, or None to plan against the default budget."""
+    return int(float(budget_mb) * MB) if budget_mb else None
+
+
+def estimate_input_bytes(X: pd.DataFrame) -> int:
+    """In-memory size of X, measuring string columns on a sample of rows."""
+    if len(X) == 0:
+        return 0
+    sample = X.head(_SAMPLE_ROWS)
+    return int(sample.memory_usage(index=False, deep=True).sum() * len(X) / len(sample))
+
+
+def estimate_output(column_transformer, X: pd.DataFrame) -> Dict[str, Any]:
+    """Estimate width and non-zeros per row of an unfitted ColumnTransformer's output."""
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder
+
+    width = 0
+    nnz_per_row = 0
+    covered = set()
+    for name, transformer, columns in column_transformer.transformers:
+        columns = [column for column in columns if column in X.columns]
+        covered.update(columns)
+        if not columns or transformer == 'drop':
+            continue
+        steps = [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+        block_width = block_nnz = len(columns)
+        for step in steps:
+            if isinstance(step, OneHotEncoder):
+                # One column per category, but still a single non-zero per input column
+                block_width = int(sum(X[column].nunique(dropna=False) for column in columns))
+            elif type(step).__name__ == 'DateTransformer':
+                block_width = block_nnz = len(step.features) * len(columns)
+        width += block_width
+        nnz_per_row += block_nnz
+
+    if column_transformer.remainder != 'drop':
+        remainder = len([column for column in X.columns if column not in covered])
+        width += remainder
+        nnz_per_row += remainder
+
+    return {'width': width, 'nnz_per_row': nnz_per_row}
+
+
+def use_sparse_output(column_transformer):
+    """Make one-hot encoders emit sparse matrices and keep the stacked output sparse."""
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder
+
+    for _, transformer, _ in column_transformer.transformers:
+        steps = [step for _, step in transformer.steps] if isinstance(transformer, Pipeline) else [transformer]
+        for step in steps:
+            if isinstance(step, OneHotEncoder):
+                try:
+                    step.set_params(sparse_output=True)
+                except ValueError:
+                    # Older scikit-learn versions call the parameter 'sparse'
+                    step.set_params(sparse=True)
+    column_transformer.set_params(sparse_threshold=1.0)
+    return column_transformer
+
+
+def training_modes(estimator):
+    """Sparse training is only an option for estimators that accept sparse input."""
+    try:
+        accepts_sparse = estimator.__sklearn_tags__().input_tags.sparse
+    except AttributeError:
+        accepts_sparse = False
+    return TRAINING_MODES if accepts_sparse else ('dense',)
+
+
+def _chunk_rows(n_rows: int, row_bytes: int, free_bytes: int) -> int:
+    rows = int(free_bytes * CHUNK_BUDGET_SHARE // max(row_bytes, 1))
+    return max(1, min(n_rows, max(MIN_CHUNK_ROWS, rows)))
+
+
+def plan_execution(column_transformer, X: pd.DataFrame, budget: int = None,
+                   modes=PREPROCESS_MODES) -> Dict[str, Any]:
+    """Pick the first of modes whose estimated peak fits the budget.
+
+    When none does, an explicit budget raises ValueError before anything large is
+    allocated; the default budget falls back to the mode with the smallest estimate.
+    """
+    enforced = budget is not None or DEFAULT_BUDGET_ENFORCED
+    budget = DEFAULT_BUDGET_BYTES if budget is None else budget
+    n_rows = len(X)
+    output = estimate_output(column_transformer, X)
+    width = output['width']
+    input_bytes = estimate_input_bytes(X)
+
+    dense_row = width * 8 * DENSE_COPIES
+    chunk_rows = _chunk_rows(n_rows, dense_row, budget - input_bytes - WORKING_OVERHEAD_BYTES)
+    chunk_bytes = chunk_rows * dense_row
+    sparse_bytes = n_rows * output['nnz_per_row'] * SPARSE_BYTES_PER_VALUE
+    fit_bytes = input_bytes + sparse_bytes * SPARSE_FIT_COPIES + chunk_bytes
+    estimates = {
+        'dense': input_bytes + n_rows * dense_row,
+        # The float32 array and its DataFrame copy
+        'float32': fit_bytes + n_rows * width * 4 * 2,
+        # The transformed CSR matrix is kept while it is written
+        'sparse': fit_bytes + sparse_bytes,
+        'chunked': fit_bytes
+    }
+    estimates = {mode: int(estimates[mode] + WORKING_OVERHEAD_BYTES) for mode in modes}
+
+    plan = {
+        'rows': n_rows,
+        'output_width': width,
+        'input_bytes': input_bytes,
+        'budget_bytes': budget,
+        'estimated_bytes': estimates,
+        'chunk_rows': chunk_rows
+    }
+    for mode in modes:
+        if estimates[mode] <= budget:
+            return {'mode': mode, **plan}
+
+    smallest = min(estimates, key=estimates.get)
+    message = (f"Estimated memory for {n_rows} rows x {width} output columns is {estimates[smallest] / MB:.1f} MB "
+               f"even in {smallest} mode, over the {budget / MB:.1f} MB budget")
+    if enforced:
+        raise ValueError(message)
+    logger.warning(f"{message}; running in {smallest} mode since no budget was set")
+    return {'mode': smallest, 'over_budget': True, **plan}
+
+
+def _status_bytes(field: str) -> int:
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith(field):
+                return int(line.split()[1]) * 1024
+    raise OSError(f"{field} not found")
+
+
+class PeakMemory:
+    """Measure the peak resident memory of the enclosed block.
+
+    Pool workers are long-lived, so the kernel's high-water mark is reset on entry where
+    Linux allows it; elsewhere the peak may include earlier jobs of the same process.
+    The resident memory at entry (interpreter and libraries) does not count against the budget.
+    """
+
+    def __enter__(self):
+        try:
+            with open('/proc/self/clear_refs', 'w') as clear_refs:
+                clear_refs.write('5')
+            self.baseline_bytes = _status_bytes('VmRSS:')
+        except OSError:
+            self.baseline_bytes = 0
+        self.peak_bytes = None
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.peak_bytes = _status_bytes('VmHWM:')
+        except OSError:
+            # ru_maxrss is in kilobytes on Linux
+            self.peak_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return False
+
+    def report(self, plan: Dict[str, Any]) -> Dict[str, Any]:
+        used = self.peak_bytes - self.baseline_bytes
+        return {
+            **plan,
+            'peak_rss_bytes': self.peak_bytes,
+            'baseline_rss_bytes': self.baseline_bytes,
+            'within_budget': used <= plan['budget_bytes']
+        }
@@ -0,0 +1,131 @@
+import hashlib
+import json
+import mmap
+import pickle
+import struct
+import zlib
+from typing import Dict, Any
+
+# File layout: magic | header length (uint32) | JSON header | pickle stream | buffers.
+# The pickle stream and every buffer start on an ALIGNMENT boundary relative to the
+# data section so NumPy arrays can be mapped straight from the file.
+MAGIC = b'SKMODEL1'
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+# Arrays smaller than this stay inside the pickle stream
+MIN_OUT_OF_BAND_BYTES = 4096
+ARTIFACT_EXTENSION = '.skmodel'
+
+_PREFIX = struct.Struct('<8sI')
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_artifact(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def save_artifact(obj, path: str, metadata: Dict[str, Any] = None, compress: bool = False) -> Dict[str, Any]:
+    """Write obj to path as a binary model artifact and return its header."""
+    buffers = []
+
+    def collect_buffer(buffer):
+        # Returning a true value keeps the buffer in-band
+        if buffer.raw().nbytes < MIN_OUT_OF_BAND_BYTES:
+            return True
+        buffers.append(buffer)
+        return False
+
+    pickle_bytes = pickle.dumps(obj, protocol=5, buffer_callback=collect_buffer)
+
+    digest = hashlib.sha256(pickle_bytes)
+    sections = [pickle_bytes]
+    buffer_entries = []
+    offset = _align(len(pickle_bytes))
+    for buffer in buffers:
+        data = buffer.raw()
+        digest.update(data)
+        compressed = False
+        if compress:
+            packed = zlib.compress(data, 6)
+            # Only keep the compressed copy when it is worth losing the ability to mmap
+            if len(packed) < 0.9 * data.nbytes:
+                data, compressed = packed, True
+        buffer_entries.append({'offset': offset, 'length': len(data), 'compressed': compressed})
+        sections.append(data)
+        offset = _align(offset + len(data))
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'artifact_id': digest.hexdigest(),
+        'metadata': metadata or {},
+        'pickle': {'offset': 0, 'length': len(pickle_bytes)},
+        'buffers': buffer_entries
+    }
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(_PREFIX.size + len(header_bytes))
+
+    with open(path, 'wb') as file:
+        file.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+        file.write(header_bytes)
+        file.write(b'\0' * (data_start - _PREFIX.size - len(header_bytes)))
+        position = 0
+        for section, entry in zip(sections, [header['pickle']] + buffer_entries):
+            file.write(b'\0' * (entry['offset'] - position))
+            file.write(section)
+            position = entry['offset'] + entry['length']
+
+    return header
+
+
+def _read_prefix(file):
+    magic, header_length = _PREFIX.unpack(file.read(_PREFIX.size))
+    if magic != MAGIC:
+        raise ValueError("Not a model artifact file")
+    header = json.loads(file.read(header_length).decode('utf-8'))
+    header['data_start'] = _align(_PREFIX.size + header_length)
+    return header
+
+
+def read_artifact_header(path: str) -> Dict[str, Any]:
+    """Read only the header (metadata, artifact id, layout) without unpickling the model."""
+    with open(path, 'rb') as file:
+        return _read_prefix(file)
+
+
+def load_artifact(path: str, mmap_mode: bool = True, writable: bool = False):
+    """Load the object stored in an artifact.
+
+    With mmap_mode, uncompressed arrays are read-only views over the mapped file
+    and pages are only read from disk when the model touches them. writable maps
+    the file copy-on-write instead, so arrays can be modified without touching it.
+    """
+    with open(path, 'rb') as file:
+        header = _read_prefix(file)
+        if mmap_mode:
+            access = mmap.ACCESS_COPY if writable else mmap.ACCESS_READ
+            data = memoryview(mmap.mmap(file.fileno(), 0, access=access))
+        else:
+            file.seek(0)
+            data = memoryview(bytearray(file.read()))
+
+    start = header['data_start']
+    buffers = []
+    for entry in header['buffers']:
+        view = data[start + entry['offset']:start + entry['offset'] + entry['length']]
+        buffers.append(bytearray(zlib.decompress(view)) if entry['compressed'] else view)
+
+    pickle_entry = header['pickle']
+    pickle_view = data[start + pickle_entry['offset']:start + pickle_entry['offset'] + pickle_entry['length']]
+    return pickle.loads(pickle_view, buffers=buffers)
+
+
+def load_model_file(path: str, mmap_mode: bool = True):
+    """Load a model from either a binary artifact or a legacy pickle file."""
+    if is_artifact(path):
+        return load_artifact(path, mmap_mode=mmap_mode)
+    with open(path, 'rb') as file:
+        return pickle.load(file)
@@ -0,0 +1,268 @@
+import numpy as np
+from sklearn.base import BaseEstimator, RegressorMixin, ClassifierMixin
+
+INDEX_TYPES = ['auto', 'brute', 'kd_tree', 'ivf']
+STORAGE_TYPES = ['float64', 'float32', 'uint8']
+# Up to this many training rows a scan over the compact points is as fast as any index
+BRUTE_MAX_SAMPLES = 5000
+# Above this many dimensions kd-tree pruning stops paying off and auto scans instead
+TREE_MAX_DIMENSIONS = 15
+MAX_LISTS = 4096
+# Training rows the IVF coarse quantizer is fit on
+QUANTIZER_SAMPLE_ROWS = 100000
+# Stored points and queries per distance block, which holds _QUERY_CHUNK_ROWS x _SCAN_CHUNK_ROWS floats
+_SCAN_CHUNK_ROWS = 8192
+_QUERY_CHUNK_ROWS = 1024
+_GATHER_MAX_QUERIES = 16
+
+
+def _default_probes(n_lists):
+    # Scanning about 2 * sqrt(n_lists) lists kept recall of the exact neighbors above 0.95
+    # on one-hot encoded tables, but only about 0.7 of the 5 nearest on 20k x 40 Gaussian
+    # data; raise n_probe where recall matters
+    return max(8, int(2 * np.sqrt(n_lists)))
+
+
+def _kd_tree_class(dtype):
+    # sklearn only exposes the float64 tree publicly; the float32 variant keeps the points compact
+    if dtype == np.float32:
+        try:
+            from sklearn.neighbors._kd_tree import KDTree32
+            return KDTree32
+        except ImportError:
+            pass
+    from sklearn.neighbors import KDTree
+    return KDTree
+
+
+class _IndexedNeighborsMixin:
+    """Shared fitting and search logic for k-nearest-neighbor models with a prebuilt index.
+
+    The training points are kept as float32, float64 or per-dimension uint8 codes, and the
+    index is built once at fit time. 'auto' stays exact, like KNeighbors*: a kd-tree for
+    large, low-dimensional data and a blocked scan otherwise. The inverted-file (IVF) index,
+    which only scans the n_probe k-means lists closest to a query and so can miss some
+    neighbors, is only used when index='ivf' is asked for. Everything is stored as plain
+    arrays, so a loaded artifact maps them from disk instead of reading them into memory.
+    """
+
+    def _resolve_index(self, n_samples, n_features):
+        if self.index not in INDEX_TYPES:
+            raise ValueError(f"Unsupported neighbor index '{self.index}'. Choose one of {INDEX_TYPES}")
+        if self.storage not in STORAGE_TYPES:
+            raise ValueError(f"Unsupported point storage '{self.storage}'. Choose one of {STORAGE_TYPES}")
+        if self.index == 'kd_tree' and self.storage == 'uint8':
+            raise ValueError("The kd-tree index stores float points; use storage 'float32' or 'float64'")
+        if self.index != 'auto':
+            return self.index
+        if n_samples > BRUTE_MAX_SAMPLES and n_features <= TREE_MAX_DIMENSIONS and self.storage != 'uint8':
+            return 'kd_tree'
+        return 'brute'
+
+    def index_summary(self):
+        """The index fit chose and whether its neighbors can differ from an exact search."""
+        summary = {'index': self.index_, 'storage': self.storage,
+                   # IVF skips unprobed lists and uint8 codes round the points
+                   'approximate': self.index_ == 'ivf' or self.storage == 'uint8'}
+        if self.index_ == 'ivf':
+            summary['n_lists'] = len(self.centroids_)
+            summary['n_probe'] = min(self.n_probe or _default_probes(len(self.centroids_)), len(self.centroids_))
+        return summary
+
+    def _encode_points(self, X):
+        if self.storage == 'uint8':
+            self.offset_ = X.min(axis=0)
+            span = X.max(axis=0) - self.offset_
+            self.scale_ = np.where(span > 0, span / 255.0, 1.0)
+            return np.rint((X - self.offset_) / self.scale_).astype(np.uint8)
+        return X.astype(self.storage)
+
+    def _decode_points(self, points):
+        if self.storage == 'uint8':
+            return points * self.scale_ + self.offset_
+        return points.astype(np.float64, copy=False)
+
+    def _fit_index(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        n_samples, self.n_features_in_ = X.shape
+        if n_samples < self.n_neighbors:
+            raise ValueError(f"n_neighbors={self.n_neighbors} is larger than the {n_samples} training rows")
+        self.index_ = self._resolve_index(n_samples, self.n_features_in_)
+
+        if self.index_ == 'kd_tree':
+            points = X.astype(self.storage)
+            self.tree_ = _kd_tree_class(points.dtype)(points, leaf_size=self.leaf_size)
+            return self
+
+        points = self._encode_points(X)
+        if self.index_ == 'brute':
+            self.points_ = points
+            self.ids_ = np.arange(n_samples, dtype=np.int32)
+            return self
+
+        from sklearn.cluster import MiniBatchKMeans
+
+        n_lists = self.n_lists or int(np.clip(np.sqrt(n_samples), 16, MAX_LISTS))
+        n_lists = min(n_lists, n_samples)
+        rng = np.random.default_rng(self.random_state)
+        sample = X[rng.choice(n_samples, min(n_samples, QUANTIZER_SAMPLE_ROWS), replace=False)]
+        quantizer = MiniBatchKMeans(n_clusters=n_lists, n_init=1, random_state=self.random_state).fit(sample)
+        self.centroids_ = quantizer.cluster_centers_.astype(np.float32)
+        lists = quantizer.predict(X)
+
+        # Points are stored grouped by list, so scanning a list reads one contiguous block
+        order = np.argsort(lists, kind='stable')
+        self.points_ = points[order]
+        self.ids_ = order.astype(np.int32)
+        self.list_offsets_ = np.searchsorted(lists[order], np.arange(n_lists + 1)).astype(np.int64)
+        return self
+
+    def _merge_block(self, best_distances, best_positions, rows, X_rows, start, stop, k):
+        """Merge the stored points start:stop into the running k nearest of the query rows."""
+        points = self._decode_points(self.points_[start:stop])
+        # Squared distances via the dot product; the final neighbors are measured exactly afterwards
+        distances = ((X_rows ** 2).sum(axis=1)[:, None] - 2 * X_rows @ points.T
+                     + (points ** 2).sum(axis=1)[None, :])
+        distances = np.concatenate([best_distances[rows], distances], axis=1)
+        positions = np.concatenate([best_positions[rows],
+                                    np.broadcast_to(np.arange(start, stop), (len(rows), stop - start))], axis=1)
+        keep = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        best_distances[rows] = np.take_along_axis(distances, keep, axis=1)
+        best_positions[rows] = np.take_along_axis(positions, keep, axis=1)
+
+    def _scan_all(self, best_distances, best_positions, rows, X, k):
+        for query_start in range(0, len(rows), _QUERY_CHUNK_ROWS):
+            chunk = rows[query_start:query_start + _QUERY_CHUNK_ROWS]
+            for start in range(0, len(self.points_), _SCAN_CHUNK_ROWS):
+                stop = min(len(self.points_), start + _SCAN_CHUNK_ROWS)
+                self._merge_block(best_distances, best_positions, chunk, X[chunk], start, stop, k)
+
+    def _scan_lists(self, best_distances, best_positions, probes, X, k):
+        # Group the (list, query) pairs by list, so each list is decoded once per batch
+        lists = probes.ravel()
+        query_rows = np.repeat(np.arange(len(X)), probes.shape[1])
+        order = np.argsort(lists, kind='stable')
+        lists, query_rows = lists[order], query_rows[order]
+        bounds = np.searchsorted(lists, np.arange(len(self.centroids_) + 1))
+        for i in np.flatnonzero(np.diff(bounds)):
+            start, stop = self.list_offsets_[i], self.list_offsets_[i + 1]
+            list_rows = query_rows[bounds[i]:bounds[i + 1]]
+            if start == stop:
+                continue
+            for query_start in range(0, len(list_rows), _QUERY_CHUNK_ROWS):
+                rows = list_rows[query_start:query_start + _QUERY_CHUNK_ROWS]
+                self._merge_block(best_distances, best_positions, rows, X[rows], start, stop, k)
+
+    def _search_points(self, X, k):
+        """Positions in the stored points of the k nearest of each row of X, in no particular order."""
+        best_distances = np.full((len(X), k), np.inf)
+        best_positions = np.zeros((len(X), k), dtype=np.int64)
+
+        if self.index_ == 'brute':
+            self._scan_all(best_distances, best_positions, np.arange(len(X)), X, k)
+            return best_positions
+
+        # IVF: every query scans only the n_probe lists with the closest centroids
+        n_probe = min(self.n_probe or _default_probes(len(self.centroids_)), len(self.centroids_))
+        centroids = self.centroids_.astype(np.float64)
+        centroid_distances = ((X ** 2).sum(axis=1)[:, None] - 2 * X @ centroids.T
+                              + (centroids ** 2).sum(axis=1)[None, :])
+        probes = np.argpartition(centroid_distances, n_probe - 1, axis=1)[:, :n_probe]
+        if len(X) <= _GATHER_MAX_QUERIES:
+            # Few queries, as when scoring single rows: gather each one's probed lists into one block
+            for row, lists in enumerate(probes):
+                positions = np.concatenate([np.arange(self.list_offsets_[i], self.list_offsets_[i + 1])
+                                            for i in lists])
+                if len(positions) >= k:
+                    points = self._decode_points(self.points_[positions])
+                    distances = ((points - X[row]) ** 2).sum(axis=1)
+                    keep = np.argpartition(distances, k - 1)[:k]
+                    best_distances[row], best_positions[row] = distances[keep], positions[keep]
+        else:
+            self._scan_lists(best_distances, best_positions, probes, X, k)
+
+        # Queries whose probed lists held fewer than k points fall back to a full scan
+        short = np.flatnonzero(np.isinf(best_distances).any(axis=1))
+        if len(short):
+            best_distances[short] = np.inf
+            self._scan_all(best_distances, best_positions, short, X, k)
+        return best_positions
+
+    def kneighbors(self, X, n_neighbors=None):
+        """Distances to and training-row indices of the nearest neighbors of each row of X, nearest first."""
+        k = n_neighbors or self.n_neighbors
+        X = np.asarray(X, dtype=np.float64)
+        if self.index_ == 'kd_tree':
+            distances, indices = self.tree_.query(X.astype(np.asarray(self.tree_.data).dtype), k=k)
+            return distances.astype(np.float64), indices
+
+        positions = self._search_points(X, k)
+        distances = np.sqrt(((self._decode_points(self.points_[positions.ravel()]).reshape(len(X), k, -1)
+                              - X[:, None, :]) ** 2).sum(axis=2))
+        order = np.argsort(distances, axis=1, kind='stable')
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = self.ids_[np.take_along_axis(positions, order, axis=1)].astype(np.int64)
+        return distances, indices
+
+    def _neighbor_weights(self, distances):
+        if self.weights == 'uniform':
+            return np.ones_like(distances)
+        if self.weights != 'distance':
+            raise ValueError(f"Unsupported weights '{self.weights}'. Choose 'uniform' or 'distance'")
+        # As in sklearn, exact matches take all of the weight when a query has any
+        with np.errstate(divide='ignore'):
+            weights = 1.0 / distances
+        exact = np.isinf(weights)
+        rows = exact.any(axis=1)
+        weights[rows] = exact[rows]
+        return weights
+
+
+class IndexedKNNRegressor(_IndexedNeighborsMixin, RegressorMixin, BaseEstimator):
+    def __init__(self, n_neighbors=5, weights='uniform', index='auto', storage='float32', leaf_size=40,
+                 n_lists=None, n_probe=None, random_state=0):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.index = index
+        self.storage = storage
+        self.leaf_size = leaf_size
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        self.y_ = np.asarray(y, dtype=np.float64)
+        return self._fit_index(X)
+
+    def predict(self, X):
+        distances, indices = self.kneighbors(X)
+        weights = self._neighbor_weights(distances)
+        return (self.y_[indices] * weights).sum(axis=1) / weights.sum(axis=1)
+
+
+class IndexedKNNClassifier(_IndexedNeighborsMixin, ClassifierMixin, BaseEstimator):
+    def __init__(self, n_neighbors=5, weights='uniform', index='auto', storage='float32', leaf_size=40,
+                 n_lists=None, n_probe=None, random_state=0):
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.index = index
+        self.storage = storage
+        self.leaf_size = leaf_size
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.random_state = random_state
+
+    def fit(self, X, y):
+        self.classes_, codes = np.unique(np.asarray(y), return_inverse=True)
+        self.codes_ = codes.astype(np.int32)
+        return self._fit_index(X)
+
+    def predict_proba(self, X):
+        distances, indices = self.kneighbors(X)
+        weights = self._neighbor_weights(distances)
+        votes = np.zeros((len(indices), len(self.classes_)))
+        np.add.at(votes, (np.arange(len(indices))[:, None], self.codes_[indices]), weights)
+        return votes / votes.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
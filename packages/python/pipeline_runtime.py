@@ -0,0 +1,130 @@
+import pandas as pd
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.pipeline import Pipeline
+from input_schema import build_input_schema
+
+# Classes referenced by saved pipelines. predict.py imports only this module at startup, so
+# anything needed just for fitting is imported inside the method that uses it; unpickling a
+# model then only loads the estimator modules the artifact actually references.
+
+
+class IdentityTransformer(BaseEstimator, TransformerMixin):
+    def fit(self, X, y=None):
+        return self
+
+    def transform(self, X):
+        return X
+
+    def __sklearn_is_fitted__(self):
+        # Stateless, so a column pipeline made only of identity steps counts as fitted
+        return True
+
+
+class ColumnPreservingTransformer(BaseEstimator, TransformerMixin):
+    def __init__(self, preprocessor, raw_columns=None):
+        self.preprocessor = preprocessor
+        self.raw_columns = raw_columns
+        self.input_features_ = None
+        self.output_features_ = None
+
+    def fit(self, X, y=None):
+        # Convert column names to strings
+        X = X.rename(columns=lambda x: str(x))
+        self.input_features_ = X.columns.tolist()
+        self.n_samples_seen_ = len(X)
+        # Values seen per column, which weight the running means of mean imputers
+        self.n_values_seen_ = X.notna().sum().astype(int).to_dict()
+        # Compiled input schema used to align prediction input without parsing column names
+        self.input_schema_ = build_input_schema(X, self.raw_columns)
+        self.preprocessor.fit(X, y)
+        self.output_features_ = self._get_output_feature_names()
+        return self
+
+    def partial_fit(self, X, y=None):
+        """Refresh the fitted statistics with new rows where a step supports it.
+
+        Scalers are updated through their own partial_fit and mean imputers with a running
+        mean weighted by the non-missing values seen per column. Encoders and other imputers
+        keep their fitted state.
+        """
+        from sklearn.impute import SimpleImputer
+
+        X = X.rename(columns=lambda x: str(x))[self.input_features_]
+        n_seen = getattr(self, 'n_samples_seen_', None)
+        # Pipelines saved before per-column counts were kept fall back to the row count
+        values_seen = getattr(self, 'n_values_seen_', None) or dict.fromkeys(self.input_features_, n_seen)
+        batch_values = X.notna().sum().astype(int).to_dict()
+
+        for name, transformer, columns in self.preprocessor.transformers_:
+            if name == 'remainder' or not isinstance(transformer, Pipeline):
+                continue
+            X_step = X[columns]
+            for index, (step_name, step) in enumerate(transformer.steps):
+                if hasattr(step, 'partial_fit'):
+                    step.partial_fit(X_step)
+                elif isinstance(step, SimpleImputer) and step.strategy == 'mean' and index == 0 and n_seen:
+                    # The imputer reads the raw columns, so their counts weight the two means
+                    seen = np.array([values_seen[str(column)] for column in columns], dtype=float)
+                    batch = np.array([batch_values[str(column)] for column in columns], dtype=float)
+                    batch_sum = np.nansum(np.asarray(X_step, dtype=float), axis=0)
+                    total = seen + batch
+                    updated = (step.statistics_ * seen + batch_sum) / np.maximum(total, 1)
+                    step.statistics_ = np.where(batch > 0, updated, step.statistics_)
+                X_step = step.transform(X_step)
+
+        if n_seen:
+            self.n_samples_seen_ = n_seen + len(X)
+            self.n_values_seen_ = {column: values_seen[column] + batch_values[column] for column in self.input_features_}
+        return self
+
+    def transform(self, X):
+        # Convert column names to strings
+        X = X.rename(columns=lambda x: str(x))
+        # Ensure input features match what the transformer expects
+        missing_cols = set(self.input_features_) - set(X.columns)
+        if missing_cols:
+            raise ValueError(f"Missing columns in input data: {missing_cols}")
+
+        # Reorder columns to match the order during fitting
+        X = X[self.input_features_]
+
+        X_transformed = self.preprocessor.transform(X)
+        if hasattr(X_transformed, 'tocoo'):
+            # Sparse one-hot output (chosen by the memory planner) stays sparse
+            return pd.DataFrame.sparse.from_spmatrix(X_transformed, index=X.index, columns=self.output_features_)
+        return pd.DataFrame(X_transformed, columns=self.output_features_, index=X.index)
+
+    def _get_output_feature_names(self):
+        from sklearn.preprocessing import OneHotEncoder, OrdinalEncoder, StandardScaler
+
+        feature_names = []
+        for name, transformer, columns in self.preprocessor.transformers_:
+            if name == 'remainder':
+                if self.preprocessor.remainder != 'drop':
+                    feature_names.extend(map(str, columns))
+            elif isinstance(transformer, OneHotEncoder):
+                feature_names.extend([f"{str(col)}_{cat}" for col in columns for cat in transformer.categories_[0]])
+            elif isinstance(transformer, OrdinalEncoder):
+                feature_names.extend([f"{str(col)}_encoded" for col in columns])
+            elif isinstance(transformer, StandardScaler):
+                feature_names.extend(map(str, columns))
+            elif isinstance(transformer, Pipeline):
+                # Handle pipeline transformers
+                last_step = transformer.steps[-1][1]
+                if isinstance(last_step, OneHotEncoder):
+                    feature_names.extend([f"{str(col)}_{cat}" for col in columns for cat in last_step.categories_[0]])
+                elif isinstance(last_step, OrdinalEncoder):
+                    feature_names.extend([f"{str(col)}_encoded" for col in columns])
+                else:
+                    feature_names.extend(map(str, columns))
+            else:
+                # For any other transformer, use the input column names
+                feature_names.extend(map(str, columns))
+        
+        return feature_names
+
+    def get_feature_names_out(self, input_features=None):
+        if self.output_features_ is None:
+            raise ValueError("Transformer has not been fitted yet. Call 'fit' before using this method.")
+        return self.output_features_
@@ -1,19 +1,31 @@
 import pandas as pd
 import numpy as np
-import pickle
 import json
+import hashlib
+import os
 import sys
+import time
 import logging
-from sklearn.compose import ColumnTransformer
-from create_model import ColumnPreservingTransformer
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+# Only the runtime classes are imported up front; unpickling a model loads the estimator
+# modules it references. ColumnPreservingTransformer must also be importable from __main__
+# for models pickled by running create_model.py as a script.
+from pipeline_runtime import ColumnPreservingTransformer
+from model_artifact import load_model_file, is_artifact, read_artifact_header
+from input_schema import plan_alignment, apply_alignment, find_unknown_categories
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 def load_model(model_path):
-    with open(model_path, 'rb') as file:
-        return pickle.load(file)
+    # Binary artifacts are memory-mapped; legacy .pkl files are still unpickled
+    return load_model_file(model_path, mmap_mode=True)
 
 def extract_feature_data(input_data):
     logger.debug(f"Extracting feature data from: {input_data}")
@@ -57,27 +69,7 @@ def prepare_input_data(df, column_mapping, expected_features):
     # Reorder columns to match expected features
     return df[expected_features]
 
-def predict(pipeline, input_data):
-    logger.debug(f"Raw input data: {input_data}")
-    
-    # Extract the actual feature data
-    feature_data = extract_feature_data(input_data)
-    logger.debug(f"Extracted feature data: {feature_data}")
-    
-    # Create a DataFrame with the feature data
-    df = pd.DataFrame([feature_data])
-    logger.debug(f"Input DataFrame:\n{df}")
-    
-    # Get the expected input features from the pipeline
-    preprocessor = pipeline.named_steps['preprocessor']
-    expected_features = preprocessor.input_features_
-    logger.debug(f"Expected features: {expected_features}")
-    logger.debug(f"Input data columns: {df.columns}")
-    
-    # Map input column names to expected feature names
-    column_mapping = map_column_names(df.columns, expected_features)
-    logger.debug(f"Column mapping: {column_mapping}")
-    
+def align_input_frame(df, column_mapping, expected_features):
     # Rename columns based on the mapping
     df = prepare_input_data(df, column_mapping, expected_features)
     logger.debug(f"DataFrame after renaming:\n{df}")
@@ -90,15 +82,23 @@ def predict(pipeline, input_data):
             df[col] = None
     
     # Reorder columns to match the expected order
-    df = df[expected_features]
-    logger.debug(f"Reordered DataFrame:\n{df}")
-    
-    # Log the pipeline steps
-    logger.debug("Pipeline steps:")
-    for name, step in pipeline.named_steps.items():
-        logger.debug(f"  {name}: {type(step).__name__}")
-    
-    # Make prediction using the pipeline
+    return df[expected_features]
+
+def align_to_schema(df, plan):
+    aligned = apply_alignment(plan, df)
+    if plan['missing']:
+        logger.warning(f"Missing columns in input data filled with training defaults: {plan['missing']}")
+    unknown = find_unknown_categories(plan, aligned)
+    if unknown:
+        logger.warning(f"Categories not seen during training: {unknown}")
+    return aligned
+
+def score_frame(pipeline, df):
+    # Models exported with a verified NumPy scorer skip the sklearn pipeline entirely
+    scorer = getattr(pipeline, 'compiled_scorer_', None)
+    if scorer is not None and scorer.handles(len(df)):
+        return scorer.predict(df)
+
     try:
         # Transform the data through each step of the pipeline
         for name, step in pipeline.named_steps.items():
@@ -107,13 +107,53 @@ def predict(pipeline, input_data):
                 logger.debug(f"After {name} step:\n{df}")
         
         # Make the final prediction
-        prediction = pipeline.named_steps['model'].predict(df)
-        logger.debug(f"Raw prediction: {prediction}")
+        return pipeline.named_steps['model'].predict(df)
     except Exception as e:
         logger.error(f"Error during prediction: {str(e)}")
         logger.error(f"Input data shape: {df.shape}")
         logger.error(f"Input data columns: {df.columns}")
         raise
+
+def prepare_frame(pipeline, df):
+    """Align raw input rows with the columns the pipeline was trained on."""
+    preprocessor = pipeline.named_steps['preprocessor']
+    schema = getattr(preprocessor, 'input_schema_', None)
+    if schema is not None:
+        # Align against the schema compiled at training time
+        return align_to_schema(df, plan_alignment(schema, df.columns))
+
+    expected_features = preprocessor.input_features_
+    logger.debug(f"Expected features: {expected_features}")
+    logger.debug(f"Input data columns: {df.columns}")
+    
+    # Map input column names to expected feature names
+    column_mapping = map_column_names(df.columns, expected_features)
+    logger.debug(f"Column mapping: {column_mapping}")
+    
+    return align_input_frame(df, column_mapping, expected_features)
+
+def predict(pipeline, input_data):
+    logger.debug(f"Raw input data: {input_data}")
+    
+    # Extract the actual feature data
+    feature_data = extract_feature_data(input_data)
+    logger.debug(f"Extracted feature data: {feature_data}")
+    
+    # Create a DataFrame with the feature data
+    df = pd.DataFrame([feature_data])
+    logger.debug(f"Input DataFrame:\n{df}")
+    
+    df = prepare_frame(pipeline, df)
+    logger.debug(f"Reordered DataFrame:\n{df}")
+    
+    # Log the pipeline steps
+    logger.debug("Pipeline steps:")
+    for name, step in pipeline.named_steps.items():
+        logger.debug(f"  {name}: {type(step).__name__}")
+    
+    # Make prediction using the pipeline
+    prediction = score_frame(pipeline, df)
+    logger.debug(f"Raw prediction: {prediction}")
     
     # Convert numpy types to native Python types for JSON serialization
     if isinstance(prediction, np.ndarray):
@@ -124,25 +164,566 @@ def predict(pipeline, input_data):
     logger.debug(f"Final prediction: {prediction}")
     return prediction
 
-def main():
-    # Read input from stdin
-    input_json = sys.stdin.read()
-    input_data = json.loads(input_json)
-    
-    model_path = input_data['model_path']
+def iter_batch_chunks(source, chunk_size, file_format=None):
+    """Yield DataFrame chunks from a list of records or a CSV/Parquet file path."""
+    if isinstance(source, list):
+        for start in range(0, len(source), chunk_size):
+            yield pd.DataFrame.from_records(source[start:start + chunk_size])
+        return
+
+    file_format = file_format or os.path.splitext(source)[1].lstrip('.').lower()
+    if file_format == 'csv':
+        yield from pd.read_csv(source, chunksize=chunk_size)
+    elif file_format == 'parquet':
+        # Streaming Parquet reads need the optional pyarrow dependency
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported batch file format: {file_format}")
+
+def predict_batch(pipeline, source, chunk_size=1000, file_format=None):
+    """Score many rows chunk by chunk, yielding a list of predictions per chunk.
+
+    The column mapping is derived from the first chunk and reused for the rest of the batch.
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    schema = getattr(preprocessor, 'input_schema_', None)
+    expected_features = preprocessor.input_features_
+    plan = column_mapping = None
+    for chunk in iter_batch_chunks(source, chunk_size, file_format):
+        if schema is not None:
+            plan = plan or plan_alignment(schema, chunk.columns)
+            df = align_to_schema(chunk, plan)
+        else:
+            if column_mapping is None:
+                column_mapping = map_column_names(chunk.columns, expected_features)
+                logger.debug(f"Batch column mapping: {column_mapping}")
+            df = align_input_frame(chunk, column_mapping, expected_features)
+        yield score_frame(pipeline, df).tolist()
+
+def run_batch(pipeline, batch, chunk_size, output_stream=sys.stdout):
+    """Stream one JSON line per scored chunk followed by a summary line."""
+    start_time = time.perf_counter()
+    source = batch['records'] if 'records' in batch else batch['file_path']
+    rows = 0
+    for index, predictions in enumerate(predict_batch(pipeline, source, chunk_size, batch.get('format'))):
+        output_stream.write(json.dumps({'chunk': index, 'offset': rows, 'predictions': predictions}) + '\n')
+        output_stream.flush()
+        rows += len(predictions)
+    output_stream.write(json.dumps({
+        'done': True,
+        'rows': rows,
+        'elapsed_ms': (time.perf_counter() - start_time) * 1000
+    }) + '\n')
+    output_stream.flush()
+
+class PipelineCache:
+    """Memory-bounded LRU cache of loaded pipelines keyed by model URL and version.
+
+    The size of an entry is the size of the model file it was loaded from.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Per-key locks held while a model is loaded, so concurrent misses share one load
+        self._loading = {}
+
+    @contextmanager
+    def loading(self, key):
+        with self._lock:
+            lock = self._loading.setdefault(key, threading.Lock())
+        with lock:
+            yield
+        with self._lock:
+            if self._loading.get(key) is lock:
+                del self._loading[key]
+
+    def get(self, key, record=True):
+        with self._lock:
+            if key[1] is None:
+                # Without a version, serve whichever version of the model is loaded
+                key = next((cached for cached in self._entries if cached[0] == key[0]), key)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += record
+                return None
+            self._entries.move_to_end(key)
+            self.hits += record
+            return entry[0]
+
+    def put(self, key, pipeline, size):
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (pipeline, size)
+            self.total_bytes += size
+            # Always keep the newest entry, even if it alone exceeds the budget
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted_key, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                logger.info(f"Evicted pipeline {evicted_key} from cache")
+
+    def evict(self, model_key):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == model_key]:
+                self.total_bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'total_bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+def input_row_hash(feature_data, schema=None):
+    """Hash of one input row as the pipeline will see it.
+
+    With the input schema the row is aligned exactly as predict does it, so rows that differ
+    only in column order, number formatting or extra columns share a hash. Legacy models
+    without a schema hash the raw row with its columns sorted.
+    """
+    df = pd.DataFrame([extract_feature_data(feature_data)])
+    if schema is not None:
+        df = apply_alignment(plan_alignment(schema, df.columns), df)
+    else:
+        df = df.reindex(columns=sorted(df.columns, key=str))
+    values = [None if pd.isna(value) else value for value in df.iloc[0].tolist()]
+    canonical = json.dumps([[str(column) for column in df.columns], values], default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+class PredictionCache:
+    """Bounded LRU cache of prediction results keyed by model key, model version and input row hash.
+
+    Lookups only hash the raw request row (see request_key), so they stay cheap for the
+    process that dispatches every job. The aligned row hash (input_row_hash) is computed by
+    whoever runs the prediction and stored with the result, so raw rows that align to the
+    same input share one entry. Entries expire ttl_seconds after they were stored. A new
+    version of a model drops the results of its older versions, and invalidate drops every
+    result of a model.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidated = 0
+        self._entries = OrderedDict()
+        # Latest version seen per model key, and the aligned row hash of each raw request row
+        self._versions = {}
+        self._row_hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def request_key(self, request):
+        """(model key, model version, raw row hash) of a predict request, or None without a version."""
+        model_key = request.get('model_key') or request.get('model_path')
+        version = request.get('model_version')
+        if model_key is None or version is None:
+            return None
+        raw = json.dumps(request['feature_data'], sort_keys=True, default=str)
+        return model_key, version, hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, request_key):
+        with self._lock:
+            row_hash = self._row_hashes.get(request_key)
+            key = (request_key[0], request_key[1], row_hash)
+            entry = self._entries.get(key) if row_hash is not None else None
+            if entry is not None and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._row_hashes.move_to_end(request_key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, request_key, row_hash, result):
+        model_key, version, _ = request_key
+        key = (model_key, version, row_hash)
+        with self._lock:
+            if self._versions.get(model_key) != version:
+                self._drop(model_key)
+                self._versions[model_key] = version
+            self._row_hashes[request_key] = row_hash
+            self._row_hashes.move_to_end(request_key)
+            while len(self._row_hashes) > self.max_entries:
+                self._row_hashes.popitem(last=False)
+            self._entries[key] = (result, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def _drop(self, model_key):
+        for key in [key for key in self._row_hashes if key[0] == model_key]:
+            del self._row_hashes[key]
+        stale = [key for key in self._entries if key[0] == model_key]
+        for key in stale:
+            del self._entries[key]
+        self.invalidated += len(stale)
+        return len(stale)
+
+    def invalidate(self, model_key):
+        """Drop every cached result of a model, for example after it was retrained."""
+        with self._lock:
+            self._versions.pop(model_key, None)
+            return self._drop(model_key)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'invalidated': self.invalidated
+            }
+
+def _score_each(pipeline, items, outcomes):
+    for i, row in items:
+        try:
+            outcomes[i] = predict(pipeline, row)
+        except Exception as row_error:
+            outcomes[i] = row_error
+
+def score_rows(pipeline, rows):
+    """Predictions for several single-row requests scored together; a failed row gets its exception."""
+    # Rows that send the same columns share one aligned frame; anything else is scored as predict would
+    groups = OrderedDict()
+    singles = []
+    for i, feature_data in enumerate(rows):
+        row = extract_feature_data(feature_data)
+        if isinstance(row, dict):
+            groups.setdefault(tuple(row), []).append((i, row))
+        else:
+            singles.append((i, row))
+
+    outcomes = [None] * len(rows)
+    _score_each(pipeline, singles, outcomes)
+    for items in groups.values():
+        try:
+            df = prepare_frame(pipeline, pd.DataFrame([row for _, row in items]))
+            predictions = np.asarray(score_frame(pipeline, df)).tolist()
+        except Exception as e:
+            # Score rows one by one so a single bad row only fails its own request
+            logger.warning(f"Batched prediction failed ({str(e)}); scoring {len(items)} rows individually")
+            _score_each(pipeline, items, outcomes)
+            continue
+        for (i, _), prediction in zip(items, predictions):
+            outcomes[i] = [prediction]
+    return outcomes
+
+class MicroBatcher:
+    """Collects concurrent single-row predictions per model and scores each window as one batch.
+
+    A window closes after window_ms from its first request or once max_rows requests are
+    queued, whichever comes first. Every caller gets a future for its own row. By default a
+    lane key is a loaded pipeline and the window is scored on the lane's thread; a dispatch
+    callable instead receives (key, [(item, future), ...]) and must resolve the futures,
+    as the worker pool does by sending the window to a worker as one job.
+    """
+
+    def __init__(self, window_ms=2.0, max_rows=256, dispatch=None):
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._dispatch = dispatch or self._score
+        self._lock = threading.Lock()
+        # One lane per key: a queue of (item, future, enqueue time) and its condition
+        self._lanes = {}
+        self._requests = 0
+        self._batches = 0
+        self._rows = 0
+        self._max_batch = 0
+        self._wait_total = 0.0
+        self._histogram = OrderedDict((bound, 0) for bound in (1, 4, 16, 64, 256))
+        self._histogram['more'] = 0
+
+    def submit(self, key, item):
+        future = Future()
+        with self._lock:
+            lane = self._lanes.get(key)
+            if lane is None:
+                lane = self._lanes[key] = ([], threading.Condition(self._lock))
+                threading.Thread(target=self._run_lane, args=(key,), daemon=True).start()
+            queue, condition = lane
+            queue.append((item, future, time.perf_counter()))
+            self._requests += 1
+            if len(queue) == 1 or len(queue) >= self.max_rows:
+                condition.notify()
+        return future
+
+    def _run_lane(self, key):
+        queue, condition = self._lanes[key]
+        while True:
+            with self._lock:
+                # An idle lane lingers for one window before its thread exits
+                idle_deadline = time.perf_counter() + self.window
+                while not queue:
+                    remaining = idle_deadline - time.perf_counter()
+                    if remaining <= 0:
+                        del self._lanes[key]
+                        return
+                    condition.wait(remaining)
+
+                deadline = queue[0][2] + self.window
+                while len(queue) < self.max_rows:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+
+                batch = queue[:self.max_rows]
+                del queue[:self.max_rows]
+                self._record_batch(batch)
+            pairs = [(item, future) for item, future, _ in batch]
+            try:
+                self._dispatch(key, pairs)
+            except Exception as e:
+                for _, future in pairs:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _record_batch(self, batch):
+        now = time.perf_counter()
+        self._batches += 1
+        self._rows += len(batch)
+        self._max_batch = max(self._max_batch, len(batch))
+        self._wait_total += sum(now - enqueued for _, _, enqueued in batch)
+        bucket = next((bound for bound in self._histogram if bound != 'more' and len(batch) <= bound), 'more')
+        self._histogram[bucket] += 1
+
+    def _score(self, pipeline, batch):
+        for (_, future), outcome in zip(batch, score_rows(pipeline, [item for item, _ in batch])):
+            if isinstance(outcome, Exception):
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'window_ms': self.window * 1000,
+                'max_rows': self.max_rows,
+                'requests': self._requests,
+                'batches': self._batches,
+                'queue_depth': sum(len(queue) for queue, _ in self._lanes.values()),
+                'active_lanes': len(self._lanes),
+                'mean_batch_size': self._rows / self._batches if self._batches else 0.0,
+                'max_batch_size': self._max_batch,
+                'mean_wait_ms': self._wait_total / self._rows * 1000 if self._rows else 0.0,
+                'batch_size_histogram': {str(bound): count for bound, count in self._histogram.items()}
+            }
+
+class ModelNotLoadedError(Exception):
+    pass
+
+def get_model_version(model_path):
+    if is_artifact(model_path):
+        return read_artifact_header(model_path)['artifact_id']
+    stat = os.stat(model_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+def get_cached_pipeline(cache, request):
+    model_path = request.get('model_path')
+    model_key = request.get('model_key') or model_path
+    version = request.get('model_version')
+    if version is None and model_path:
+        version = get_model_version(model_path)
+
+    key = (model_key, version)
+    pipeline = cache.get(key)
+    if pipeline is not None:
+        return pipeline, True
+
+    if not model_path:
+        raise ModelNotLoadedError(f"Model {model_key} (version {version}) is not loaded; resend with model_path")
+
+    with cache.loading(key):
+        # Requests that missed while another one was loading the model use its result
+        pipeline = cache.get(key, record=False)
+        if pipeline is not None:
+            return pipeline, True
+        # A new version of a model replaces every older version in the cache
+        cache.evict(model_key)
+        pipeline = load_model(model_path)
+        cache.put(key, pipeline, os.path.getsize(model_path))
+    return pipeline, False
+
+def handle_worker_request(cache, request, batcher=None):
+    request_type = request.get('type', 'predict')
+    response = {'id': request.get('id')}
+    try:
+        if request_type == 'stats':
+            response['stats'] = cache.stats()
+            if batcher is not None:
+                response['batching'] = batcher.stats()
+        elif request_type == 'evict':
+            cache.evict(request['model_key'])
+            response['evicted'] = request['model_key']
+        elif request_type == 'predict':
+            start_time = time.perf_counter()
+            pipeline, cached = get_cached_pipeline(cache, request)
+            if batcher is not None:
+                response['prediction'] = batcher.submit(pipeline, request['feature_data']).result()
+            else:
+                response['prediction'] = predict(pipeline, request['feature_data'])
+            response['cached'] = cached
+            response['elapsed_ms'] = (time.perf_counter() - start_time) * 1000
+        elif request_type == 'predict_batch':
+            start_time = time.perf_counter()
+            pipeline, cached = get_cached_pipeline(cache, request)
+            batch = request['batch']
+            source = batch['records'] if 'records' in batch else batch['file_path']
+            predictions = []
+            for chunk in predict_batch(pipeline, source, request.get('chunk_size', 1000), batch.get('format')):
+                predictions.extend(chunk)
+            response['predictions'] = predictions
+            response['cached'] = cached
+            response['elapsed_ms'] = (time.perf_counter() - start_time) * 1000
+        else:
+            raise ValueError(f"Unsupported request type: {request_type}")
+    except ModelNotLoadedError as e:
+        response['error'] = str(e)
+        response['error_code'] = 'model_not_loaded'
+    except Exception as e:
+        logger.error(f"Error handling worker request: {str(e)}", exc_info=True)
+        response['error'] = str(e)
+    return response
+
+def serve_stdio(cache, input_stream=sys.stdin, output_stream=sys.stdout):
+    """Answer one JSON request per input line with one JSON response line."""
+    for line in input_stream:
+        if not line.strip():
+            continue
+        try:
+            response = handle_worker_request(cache, json.loads(line))
+        except json.JSONDecodeError as e:
+            response = {'id': None, 'error': f"Invalid JSON request: {str(e)}"}
+        output_stream.write(json.dumps(response) + '\n')
+        output_stream.flush()
+
+def serve_socket(cache, socket_path, batcher=None):
+    """Serve the same line-delimited protocol on a local Unix socket.
+
+    Connections are handled on separate threads, so concurrent single-row predictions
+    can be micro-batched when a batcher is given.
+    """
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                try:
+                    response = handle_worker_request(cache, json.loads(line), batcher)
+                except json.JSONDecodeError as e:
+                    response = {'id': None, 'error': f"Invalid JSON request: {str(e)}"}
+                self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+                self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        logger.info(f"Prediction worker listening on {socket_path}")
+        server.serve_forever()
+
+def run_worker(argv):
+    parser = argparse.ArgumentParser(description="Long-lived prediction worker")
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--socket', help="Serve on this Unix socket path instead of stdin/stdout")
+    parser.add_argument('--cache-mb', type=float, default=float(os.environ.get('PREDICT_CACHE_MB', 512)))
+    parser.add_argument('--batch-window-ms', type=float,
+                        default=float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 2)),
+                        help="Micro-batching window for concurrent socket requests; 0 disables batching")
+    parser.add_argument('--max-batch-rows', type=int, default=int(os.environ.get('PREDICT_MAX_BATCH_ROWS', 256)))
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+
+    # Per-row debug logging would dominate the latency of warm predictions
+    logging.getLogger().setLevel(args.log_level.upper())
+    cache = PipelineCache(int(args.cache_mb * 1024 * 1024))
+
+    if args.socket:
+        # Requests on stdin are answered one at a time, so batching only pays off on the socket
+        batcher = MicroBatcher(args.batch_window_ms, args.max_batch_rows) if args.batch_window_ms > 0 else None
+        serve_socket(cache, args.socket, batcher)
+    else:
+        serve_stdio(cache)
+
+def run_prediction(input_data, cache=None):
+    """Answer one prediction request; with a cache the pipeline is reused across requests."""
+    model_path = input_data.get('model_path')
     feature_data = input_data['feature_data']
     
     logger.debug(f"Model path: {model_path}")
     logger.debug(f"Feature data: {feature_data}")
     
     # Load the model (pipeline)
-    pipeline = load_model(model_path)
+    if cache is not None:
+        pipeline, _ = get_cached_pipeline(cache, input_data)
+    else:
+        pipeline = load_model(model_path)
     
     # Predict
-    result = predict(pipeline, feature_data)
+    result = {'prediction': predict(pipeline, feature_data)}
+    if input_data.get('return_row_hash'):
+        # Key of the result in a PredictionCache, computed here rather than by the dispatcher
+        schema = getattr(pipeline.named_steps['preprocessor'], 'input_schema_', None)
+        result['row_hash'] = input_row_hash(feature_data, schema)
+    return result
+
+def run_prediction_batch(input_data, cache):
+    """Answer the single-row requests in input_data['rows'], all against one model, as one batch."""
+    pipeline, _ = get_cached_pipeline(cache, input_data)
+    rows = input_data['rows']
+    schema = getattr(pipeline.named_steps['preprocessor'], 'input_schema_', None)
+    results = []
+    for feature_data, outcome in zip(rows, score_rows(pipeline, rows)):
+        if isinstance(outcome, Exception):
+            results.append({'error': str(outcome)})
+            continue
+        result = {'prediction': outcome}
+        if input_data.get('return_row_hash'):
+            result['row_hash'] = input_row_hash(feature_data, schema)
+        results.append(result)
+    return {'results': results}
+
+def main():
+    if '--worker' in sys.argv[1:]:
+        run_worker(sys.argv[1:])
+        return
+
+    # Read input from stdin
+    input_json = sys.stdin.read()
+    input_data = json.loads(input_json)
     
+    model_path = input_data['model_path']
+
+    # Batch requests stream one JSON line per chunk instead of a single result
+    if 'batch' in input_data:
+        run_batch(load_model(model_path), input_data['batch'], input_data.get('chunk_size', 1000))
+        return
+
     # Return the result as JSON
-    print(json.dumps({'prediction': result}))
+    print(json.dumps(run_prediction(input_data)))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
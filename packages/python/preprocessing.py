@@ -2,6 +2,7 @@ import pandas as pd
 import numpy as np
 import sys
 import json
+import itertools
 import logging
 from sklearn.experimental import enable_iterative_imputer
 from sklearn.preprocessing import StandardScaler, OneHotEncoder, RobustScaler, OrdinalEncoder, MinMaxScaler
@@ -13,6 +14,13 @@ from sklearn.feature_selection import SelectKBest, f_classif
 from scipy import sparse
 from sklearn.base import BaseEstimator, TransformerMixin
 import sklearn
+from dataset_store import read_table, derived_path
+from memory_planner import plan_execution, use_sparse_output, budget_bytes, PeakMemory
+from column_parallel import plan_parallelism, column_parallelism
+from result_protocol import FramedResult, table_reference, arrow_ipc_bytes, write_frame, PREVIEW_ROWS
+
+# IdentityTransformer lives with the other classes saved inside model pipelines
+from pipeline_runtime import IdentityTransformer
 
 
 # Set up logging
@@ -163,13 +171,6 @@ class FrequencyEncoder(BaseEstimator, TransformerMixin):
     def get_feature_names_out(self, input_features=None):
         return [f'{input_features[0]}_freq'] if input_features else ['frequency']
     
-class IdentityTransformer(BaseEstimator, TransformerMixin):
-    def fit(self, X, y=None):
-        return self
-
-    def transform(self, X):
-        return X
-
 def apply_global_preprocessing(data, preprocessing_config):
     """Apply global preprocessing steps to the entire dataset."""
     global_preprocessing = preprocessing_config.get('global_preprocessing', [])
@@ -258,12 +259,67 @@ def get_feature_names(column_transformer, original_features):
     logger.debug(f"Final feature names: {feature_names}")
     return feature_names
 
-def preprocess_data(file_path, task_type, target_column, preprocessing_config):
+def _parse_date_columns(data, date_columns):
+    # Same outcome as read_csv(parse_dates=...): columns that do not parse stay as they are
+    for col in date_columns:
+        if col in data.columns:
+            try:
+                data[col] = pd.to_datetime(data[col])
+            except (ValueError, TypeError):
+                logger.warning(f"Could not parse date column: {col}")
+    return data
+
+def _transformed_chunks(preprocessor, X, chunk_rows):
+    for start in range(0, max(len(X), 1), chunk_rows):
+        chunk = preprocessor.transform(X.iloc[start:start + chunk_rows])
+        yield chunk.toarray() if sparse.issparse(chunk) else np.asarray(chunk)
+
+def _parallel_chunks(preprocessor, X, chunk_rows, parallel):
+    # The chunks are consumed while writing, after the fit's parallel block has closed
+    with column_parallelism(preprocessor, parallel):
+        yield from _transformed_chunks(preprocessor, X, chunk_rows)
+
+def _sparse_chunks(X_sparse, chunk_rows):
+    for start in range(0, max(X_sparse.shape[0], 1), chunk_rows):
+        yield X_sparse[start:start + chunk_rows].toarray()
+
+def _transform_float32(preprocessor, X, chunk_rows):
+    # Filled chunk by chunk so the float64 output only ever exists one chunk at a time
+    result = None
+    start = 0
+    for chunk in _transformed_chunks(preprocessor, X, chunk_rows):
+        if result is None:
+            result = np.empty((len(X), chunk.shape[1]), dtype=np.float32)
+        result[start:start + len(chunk)] = chunk
+        start += len(chunk)
+    return result
+
+def _write_chunks(chunks, feature_names, y, target_column, output_csv):
+    """Write dense row chunks to output_csv and return the first one as a DataFrame."""
+    first = None
+    start = 0
+    for chunk in chunks:
+        frame = pd.DataFrame(chunk, columns=feature_names)
+        if y is not None:
+            frame[target_column] = y.iloc[start:start + len(chunk)].to_numpy()
+        frame.to_csv(output_csv, index=False, mode='w' if first is None else 'a', header=first is None)
+        if first is None:
+            first = frame
+        start += len(chunk)
+    return first
+
+def preprocess_data(file_path, task_type, target_column, preprocessing_config, memory_budget=None):
+    """Preprocess a CSV file, or a dataset already in the store when file_path is its key.
+
+    Returns the output path, the preprocessed table (only its first chunk for sparse and
+    chunked plans) and the memory plan that was executed, with the column parallelism
+    used under 'parallel'.
+    """
     logger.info(f"Starting preprocessing for file: {file_path}")
 
     # Load data
     try:
-        data = pd.read_csv(file_path, parse_dates=preprocessing_config.get('date_columns', []))
+        data = _parse_date_columns(read_table(file_path), preprocessing_config.get('date_columns', []))
         logger.info(f"Loaded data shape: {data.shape}")
         logger.debug(f"Original columns in dataframe: {data.columns.tolist()}")
     except Exception as e:
@@ -341,20 +397,50 @@ def preprocess_data(file_path, task_type, target_column, preprocessing_config):
         logger.error(f"Error in get_column_preprocessing: {str(e)}")
         raise
 
+    # Choose dense, float32, sparse or chunked execution before the output is allocated
+    plan = plan_execution(preprocessor, X, memory_budget)
+    logger.info(f"Memory plan: {plan['mode']} for {plan['rows']} rows x {plan['output_width']} columns "
+                f"(estimated {plan['estimated_bytes'][plan['mode']]} of {plan['budget_bytes']} bytes)")
+    if plan['mode'] != 'dense':
+        # Fitting runs a full fit_transform; sparse one-hot output keeps that small
+        use_sparse_output(preprocessor)
+
+    # Run the per-column transformers serially or side by side, depending on the table size
+    parallel = plan_parallelism(preprocessor, X, preprocessing_config.get('parallel'))
+    logger.info(f"Column transformers: {parallel['strategy']} with {parallel['n_jobs']} job(s)")
+
     # Fit and transform the data
     try:
-        logger.debug("Starting fit_transform on preprocessor")
-        X_preprocessed = preprocessor.fit_transform(X)
+        with column_parallelism(preprocessor, parallel):
+            if plan['mode'] == 'dense':
+                logger.debug("Starting fit_transform on preprocessor")
+                X_preprocessed = preprocessor.fit_transform(X)
+
+                # Convert to dense array if it's sparse
+                if sparse.issparse(X_preprocessed):
+                    logger.info("Converting sparse matrix to dense array")
+                    X_preprocessed = X_preprocessed.toarray()
+                elif not isinstance(X_preprocessed, np.ndarray):
+                    logger.info("Converting to numpy array")
+                    X_preprocessed = np.array(X_preprocessed)
+            else:
+                preprocessor.fit(X)
+                if plan['mode'] == 'float32':
+                    X_preprocessed = _transform_float32(preprocessor, X, plan['chunk_rows'])
+                elif plan['mode'] == 'sparse':
+                    X_preprocessed = preprocessor.transform(X)
+                else:
+                    # Chunked: nothing the size of the output is held; rows are transformed while writing
+                    X_preprocessed = None
         logger.info("Preprocessing completed successfully")
-        logger.debug(f"Preprocessed X shape: {X_preprocessed.shape}")
 
-        # Convert to dense array if it's sparse
-        if sparse.issparse(X_preprocessed):
-            logger.info("Converting sparse matrix to dense array")
-            X_preprocessed = X_preprocessed.toarray()
-        elif not isinstance(X_preprocessed, np.ndarray):
-            logger.info("Converting to numpy array")
-            X_preprocessed = np.array(X_preprocessed)
+        if X_preprocessed is None:
+            chunks = _parallel_chunks(preprocessor, X, plan['chunk_rows'], parallel)
+            first_chunk = next(chunks)
+            n_features = first_chunk.shape[1]
+        else:
+            n_features = X_preprocessed.shape[1]
+            logger.debug(f"Preprocessed X shape: {X_preprocessed.shape}")
 
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}")
@@ -368,32 +454,76 @@ def preprocess_data(file_path, task_type, target_column, preprocessing_config):
         logger.debug(f"Extracted feature names: {feature_names}")
         
         # Verify the number of feature names matches the number of columns
-        if len(feature_names) != X_preprocessed.shape[1]:
-            logger.warning(f"Mismatch in number of features: {len(feature_names)} names for {X_preprocessed.shape[1]} columns")
+        if len(feature_names) != n_features:
+            logger.warning(f"Mismatch in number of features: {len(feature_names)} names for {n_features} columns")
             logger.warning("Using generic column names")
-            feature_names = [f'feature_{i}' for i in range(X_preprocessed.shape[1])]
+            feature_names = [f'feature_{i}' for i in range(n_features)]
     except Exception as e:
         logger.error(f"Error getting feature names: {str(e)}")
         logger.warning("Using generic column names")
-        feature_names = [f'feature_{i}' for i in range(X_preprocessed.shape[1])]
+        feature_names = [f'feature_{i}' for i in range(n_features)]
 
-    # Convert to DataFrame
-    preprocessed_data = pd.DataFrame(X_preprocessed, columns=feature_names)
+    output_csv = derived_path(file_path, "_preprocessed.csv")
+    if plan['mode'] in ('dense', 'float32'):
+        # Convert to DataFrame
+        preprocessed_data = pd.DataFrame(X_preprocessed, columns=feature_names)
 
-    # Add target column back if it exists
-    if y is not None:
-        preprocessed_data[target_column] = y.reset_index(drop=True)
+        # Add target column back if it exists
+        if y is not None:
+            preprocessed_data[target_column] = y.reset_index(drop=True)
 
-    # Save preprocessed data
-    output_csv = file_path.rsplit(".", 1)[0] + "_preprocessed.csv"
-    preprocessed_data.to_csv(output_csv, index=False)
+        # Save preprocessed data
+        preprocessed_data.to_csv(output_csv, index=False)
+    else:
+        if plan['mode'] == 'sparse':
+            chunks = _sparse_chunks(X_preprocessed, plan['chunk_rows'])
+        else:
+            chunks = itertools.chain([first_chunk], chunks)
+        # Only the first chunk is kept, for the preview
+        preprocessed_data = _write_chunks(chunks, feature_names, y, target_column, output_csv)
     logger.info(f"Preprocessed data saved to {output_csv}")
 
     # Log the first few rows and columns of preprocessed data for verification
     logger.debug(f"First few rows of preprocessed data:\n{preprocessed_data.head().to_string()}")
     logger.debug(f"Preprocessed data columns: {preprocessed_data.columns.tolist()}")
 
-    return output_csv, preprocessed_data.to_csv(index=False)
+    return output_csv, preprocessed_data, {**plan, 'parallel': parallel}
+
+def run_preprocessing(params):
+    """Preprocess the file described by a JSON request and describe the result.
+
+    The preprocessed table stays on disk and the result only references it with a bounded
+    preview. With resultFormat 'arrow' the table is also returned as an Arrow IPC payload.
+    """
+    file_path = params.get('datasetKey') or params['filePath']
+    task_type = params['taskType']
+    target_column = params.get('targetColumn')  # Make target_column optional
+    preprocessing_config = params['preProcessingConfig']
+
+    logger.info(f"Input file path: {file_path}")
+    logger.info(f"Task type: {task_type}")
+    logger.info(f"Target column: {target_column}")
+    logger.debug(f"Preprocessing config: {json.dumps(preprocessing_config, indent=2)}")
+
+    with PeakMemory() as peak:
+        output_csv, preprocessed_data, plan = preprocess_data(
+            file_path, task_type, target_column, preprocessing_config, budget_bytes(params.get('memoryBudgetMb')))
+    table = table_reference(preprocessed_data, output_csv, 'csv', params.get('previewRows', PREVIEW_ROWS))
+    table['rows'] = plan['rows']
+    result = {
+        "preprocessed_file": output_csv,
+        "table": table,
+        "parallel": plan.pop('parallel'),
+        "memory": peak.report(plan)
+    }
+    if params.get('resultFormat') == 'arrow' and plan['mode'] not in ('dense', 'float32'):
+        logger.warning(f"The {plan['mode']} memory plan keeps no full table in memory; returning it by file reference only")
+    elif params.get('resultFormat') == 'arrow':
+        try:
+            return FramedResult({**result, "payload_format": "arrow_ipc"}, arrow_ipc_bytes(preprocessed_data))
+        except ImportError:
+            logger.warning("pyarrow is not installed; returning the preprocessed table by file reference only")
+    return result
 
 if __name__ == "__main__":
     logger.info("Script started")
@@ -404,31 +534,23 @@ if __name__ == "__main__":
     try:
         # Try to parse input as JSON
         params = json.loads(input_data)
-        file_path = params['filePath']
-        task_type = params['taskType']
-        target_column = params.get('targetColumn')  # Make target_column optional
-        preprocessing_config = params['preProcessingConfig']
     except json.JSONDecodeError:
         # If not JSON, assume it's the old format
-        params = input_data.strip().split('\n')
-        file_path = params[0]
-        task_type = params[1]
-        target_column = params[2] if len(params) > 2 else None
-        preprocessing_config = json.loads(params[3] if len(params) > 3 else '{}')
-
-    logger.info(f"Input file path: {file_path}")
-    logger.info(f"Task type: {task_type}")
-    logger.info(f"Target column: {target_column}")
-    logger.debug(f"Preprocessing config: {json.dumps(preprocessing_config, indent=2)}")
+        lines = input_data.strip().split('\n')
+        params = {
+            'filePath': lines[0],
+            'taskType': lines[1],
+            'targetColumn': lines[2] if len(lines) > 2 else None,
+            'preProcessingConfig': json.loads(lines[3] if len(lines) > 3 else '{}')
+        }
 
     try:
-        output_csv, preprocessed_json = preprocess_data(file_path, task_type, target_column, preprocessing_config)
-        result = {
-            "preprocessed_file": output_csv,
-            "preprocessed_data": preprocessed_json
-        }
-        sys.stdout.write(json.dumps(result))
-        sys.stdout.flush()
+        result = run_preprocessing(params)
+        if isinstance(result, FramedResult):
+            write_frame(sys.stdout.buffer, result.header, result.payload)
+        else:
+            sys.stdout.write(json.dumps(result))
+            sys.stdout.flush()
         sys.exit(0)
     except Exception as e:
         logger.error(f"Error during preprocessing: {str(e)}")
@@ -437,4 +559,4 @@ if __name__ == "__main__":
         sys.stderr.flush()
         sys.exit(1)
 else:
-    __all__ = ['get_column_preprocessing']
\ No newline at end of file
+    __all__ = ['get_column_preprocessing']
@@ -0,0 +1,72 @@
+import json
+import struct
+import numpy as np
+import pandas as pd
+from typing import Dict, Any
+
+# Frame layout: header length (uint32) | payload length (uint64) | JSON header | binary payload.
+# Large tables never travel inside the JSON header: they are either referenced by file path
+# or sent as an Arrow IPC stream in the payload, and the header only carries a bounded preview.
+FRAME_PREFIX = struct.Struct('>IQ')
+PREVIEW_ROWS = 15
+
+
+class FramedResult:
+    """A job result made of a small JSON header and an optional binary payload."""
+
+    def __init__(self, header: Dict[str, Any], payload: bytes = b''):
+        self.header = header
+        self.payload = payload
+
+
+def encode_frame(header: Dict[str, Any], payload: bytes = b'') -> bytes:
+    header_bytes = json.dumps(header).encode('utf-8')
+    return FRAME_PREFIX.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+
+def write_frame(stream, header: Dict[str, Any], payload: bytes = b''):
+    """Write one frame to a binary stream such as sys.stdout.buffer."""
+    stream.write(encode_frame(header, payload))
+    stream.flush()
+
+
+def read_frame(stream):
+    """Read one frame from a binary stream; returns None at end of stream."""
+    prefix = stream.read(FRAME_PREFIX.size)
+    if len(prefix) < FRAME_PREFIX.size:
+        return None
+    header_length, payload_length = FRAME_PREFIX.unpack(prefix)
+    header = json.loads(stream.read(header_length).decode('utf-8'))
+    return header, stream.read(payload_length)
+
+
+def preview_records(df: pd.DataFrame, n_rows: int = PREVIEW_ROWS):
+    """First n_rows of df as JSON-safe records."""
+    head = df.head(n_rows)
+    head = head.astype(object).where(head.notna(), None)
+    return [
+        {str(column): value.item() if isinstance(value, np.generic) else value for column, value in row.items()}
+        for row in head.to_dict(orient='records')
+    ]
+
+
+def table_reference(df: pd.DataFrame, path: str, file_format: str = 'csv', n_preview: int = PREVIEW_ROWS) -> Dict[str, Any]:
+    """Describe a table that was written to path, with a bounded preview instead of the data."""
+    return {
+        'path': path,
+        'format': file_format,
+        'rows': len(df),
+        'columns': [str(column) for column in df.columns],
+        'preview': preview_records(df, n_preview)
+    }
+
+
+def arrow_ipc_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize df as an Arrow IPC stream (needs the optional pyarrow dependency)."""
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
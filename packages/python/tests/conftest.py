@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The job modules are flat scripts run from packages/python, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
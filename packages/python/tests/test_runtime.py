@@ -0,0 +1,281 @@
+import io
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.neighbors import KNeighborsClassifier, KNeighborsRegressor
+
+from compiled_scorer import compile_pipeline
+from create_model import build_pipeline
+from input_schema import build_input_schema, plan_alignment, apply_alignment, find_unknown_categories
+from neighbor_index import IndexedKNNClassifier, IndexedKNNRegressor
+from predict import PredictionCache
+from result_protocol import encode_frame, read_frame, write_frame
+
+PREPROCESSING = {'columns': [
+    {'name': 'age', 'type': 'numeric', 'preprocessing': {'imputation': 'mean', 'scaling': 'standard'}, 'params': {}},
+    {'name': 'income', 'type': 'numeric', 'preprocessing': {'scaling': 'minmax'}, 'params': {}},
+    {'name': 'city', 'type': 'categorical', 'preprocessing': {'imputation': 'most_frequent', 'encoding': 'onehot'},
+     'params': {}},
+    {'name': 'size', 'type': 'categorical', 'preprocessing': {'encoding': 'ordinal'}, 'params': {}}
+]}
+
+
+@pytest.fixture(scope='module')
+def table():
+    rng = np.random.default_rng(0)
+    n_rows = 300
+    X = pd.DataFrame({
+        'age': rng.normal(40, 10, n_rows),
+        'income': rng.normal(50000, 15000, n_rows),
+        'city': rng.choice(['ny', 'sf', 'la'], n_rows),
+        'size': rng.choice(['s', 'm', 'l'], n_rows)
+    })
+    X.loc[::17, 'age'] = np.nan
+    X.loc[::23, 'city'] = np.nan
+    signal = X['age'].fillna(40) / 10 + X['income'] / 20000 + (X['city'] == 'ny') * 2
+    targets = {
+        'regression': signal + rng.normal(0, 0.5, n_rows),
+        'binary': (signal > signal.median()).astype(int),
+        'multiclass': pd.cut(signal, 3, labels=False).astype(int)
+    }
+    return X, targets
+
+
+def _fit(X, y, task, model_type, model_params=None):
+    pipeline, _ = build_pipeline(task, model_type, model_params or {}, PREPROCESSING, X.columns)
+    return pipeline.fit(X, y)
+
+
+@pytest.mark.parametrize('model_type, model_params', [
+    ('linear_regression', {}),
+    ('ridge', {}),
+    ('sgd', {'random_state': 0}),
+    ('decision_tree', {'random_state': 0}),
+    ('random_forest', {'n_estimators': 10, 'random_state': 0}),
+    ('gradient_boosting', {'n_estimators': 20, 'random_state': 0}),
+    ('knn_index', {}),
+])
+def test_compiled_scorer_matches_regression_pipeline(table, model_type, model_params):
+    X, targets = table
+    pipeline = _fit(X, targets['regression'], 'regression', model_type, model_params)
+    scorer = compile_pipeline(pipeline)
+    np.testing.assert_allclose(scorer.predict(X), pipeline.predict(X), rtol=1e-7, atol=1e-9)
+
+
+@pytest.mark.parametrize('target', ['binary', 'multiclass'])
+@pytest.mark.parametrize('model_type, model_params', [
+    ('logistic_regression', {}),
+    ('sgd', {'random_state': 0}),
+    ('decision_tree', {'random_state': 0}),
+    ('random_forest', {'n_estimators': 10, 'random_state': 0}),
+    ('gradient_boosting', {'n_estimators': 20, 'random_state': 0}),
+    ('knn_index', {}),
+])
+def test_compiled_scorer_matches_classification_pipeline(table, model_type, model_params, target):
+    X, targets = table
+    pipeline = _fit(X, targets[target], 'classification', model_type, model_params)
+    scorer = compile_pipeline(pipeline)
+    np.testing.assert_array_equal(scorer.predict(X), pipeline.predict(X))
+
+
+def test_compiled_scorer_matches_kmeans_pipeline(table):
+    X, _ = table
+    pipeline = _fit(X, None, 'clustering', 'kmeans', {'n_clusters': 4, 'n_init': 2, 'random_state': 0})
+    np.testing.assert_array_equal(compile_pipeline(pipeline).predict(X), pipeline.predict(X))
+
+
+def test_compiled_scorer_survives_pickling(table):
+    import pickle
+
+    X, targets = table
+    pipeline = _fit(X, targets['regression'], 'regression', 'random_forest', {'n_estimators': 5, 'random_state': 0})
+    scorer = compile_pipeline(pipeline)
+    scorer.predict(X.head(3))
+    restored = pickle.loads(pickle.dumps(scorer))
+    assert restored._trees is None
+    np.testing.assert_allclose(restored.predict(X), pipeline.predict(X))
+
+
+def test_compile_rejects_unsupported_model(table):
+    X, targets = table
+    pipeline = _fit(X, targets['binary'], 'classification', 'knn')
+    with pytest.raises(ValueError):
+        compile_pipeline(pipeline)
+
+
+@pytest.fixture
+def schema():
+    # Columns of an already preprocessed file whose raw names contain underscores
+    X = pd.DataFrame({
+        'transformer_city_code__city_code': [1.0, 2.0, 3.0],
+        'transformer_city__city_new_york': [1.0, 0.0, 0.0],
+        'transformer_city__city_la': [0.0, 1.0, 1.0],
+        'remainder__home_owner': ['yes', 'no', 'yes'],
+        'age': [30.0, 40.0, 50.0]
+    })
+    return build_input_schema(X, ['city_code', 'city', 'home_owner', 'age'])
+
+
+def test_schema_derives_sources_of_underscore_columns(schema):
+    assert schema['sources']['transformer_city_code__city_code'] == {'source': 'city_code', 'category': None}
+    assert schema['sources']['transformer_city__city_new_york'] == {'source': 'city', 'category': 'new_york'}
+    assert schema['sources']['remainder__home_owner'] == {'source': 'home_owner', 'category': None}
+
+
+def test_alignment_maps_raw_input_onto_training_columns(schema):
+    df = pd.DataFrame([{'city': 'new_york', 'city_code': '7', 'home_owner': 'no', 'age': 35, 'extra': 'x'}])
+    aligned = apply_alignment(plan_alignment(schema, df.columns), df)
+
+    assert aligned.columns.tolist() == schema['columns']
+    row = aligned.iloc[0]
+    assert row['transformer_city_code__city_code'] == 7.0
+    assert row['transformer_city__city_new_york'] == 1.0
+    assert row['transformer_city__city_la'] == 0.0
+    assert row['remainder__home_owner'] == 'no'
+    assert row['age'] == 35.0
+
+
+def test_alignment_fills_missing_and_unparsable_columns(schema):
+    df = pd.DataFrame([{'age': 'not a number'}])
+    plan = plan_alignment(schema, df.columns)
+    aligned = apply_alignment(plan, df)
+
+    assert set(plan['missing']) == {'transformer_city_code__city_code', 'transformer_city__city_new_york',
+                                    'transformer_city__city_la', 'remainder__home_owner'}
+    row = aligned.iloc[0]
+    # Numeric columns fall back to the training median, one-hot columns to 0, categories to the mode
+    assert row['age'] == 40.0
+    assert row['transformer_city_code__city_code'] == 2.0
+    assert row['transformer_city__city_new_york'] == 0.0
+    assert row['remainder__home_owner'] == 'yes'
+
+
+def test_alignment_reports_unknown_categories(schema):
+    df = pd.DataFrame([{'home_owner': 'maybe', 'age': 20}])
+    plan = plan_alignment(schema, df.columns)
+    assert find_unknown_categories(plan, apply_alignment(plan, df)) == {'remainder__home_owner': ['maybe']}
+
+
+def test_frame_round_trip():
+    stream = io.BytesIO()
+    write_frame(stream, {'id': 'a', 'ok': True, 'result': {'rows': 3}}, b'\x00\x01payload')
+    write_frame(stream, {'id': 'b', 'ok': False, 'error': 'boom'})
+    stream.seek(0)
+
+    assert read_frame(stream) == ({'id': 'a', 'ok': True, 'result': {'rows': 3}}, b'\x00\x01payload')
+    assert read_frame(stream) == ({'id': 'b', 'ok': False, 'error': 'boom'}, b'')
+    assert read_frame(stream) is None
+
+
+def test_frame_encoding_matches_write_frame():
+    stream = io.BytesIO()
+    write_frame(stream, {'id': 'c'}, b'xyz')
+    assert stream.getvalue() == encode_frame({'id': 'c'}, b'xyz')
+
+
+@pytest.fixture(scope='module')
+def points():
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(6000, 4))
+    return X, X @ rng.normal(size=4), (X[:, 0] > 0).astype(int) + (X[:, 1] > 1), rng.normal(size=(200, 4))
+
+
+@pytest.mark.parametrize('index, n_features', [('brute', 4), ('kd_tree', 4), ('auto', 4), ('auto', 20)])
+def test_exact_neighbor_indexes_match_sklearn(index, n_features):
+    rng = np.random.default_rng(2)
+    X, queries = rng.normal(size=(6000, n_features)), rng.normal(size=(200, n_features))
+    model = IndexedKNNRegressor(index=index, storage='float64').fit(X, np.zeros(len(X)))
+    assert not model.index_summary()['approximate']
+
+    distances, indices = model.kneighbors(queries)
+    expected_distances, expected_indices = KNeighborsRegressor().fit(X, np.zeros(len(X))).kneighbors(queries)
+    np.testing.assert_array_equal(indices, expected_indices)
+    np.testing.assert_allclose(distances, expected_distances)
+
+
+@pytest.mark.parametrize('weights', ['uniform', 'distance'])
+@pytest.mark.parametrize('index', ['brute', 'kd_tree'])
+def test_indexed_knn_predictions_match_sklearn(points, index, weights):
+    X, y_regression, y_classes, queries = points
+    regressor = IndexedKNNRegressor(index=index, weights=weights, storage='float64').fit(X, y_regression)
+    np.testing.assert_allclose(regressor.predict(queries),
+                               KNeighborsRegressor(weights=weights).fit(X, y_regression).predict(queries))
+    classifier = IndexedKNNClassifier(index=index, weights=weights, storage='float64').fit(X, y_classes)
+    expected = KNeighborsClassifier(weights=weights).fit(X, y_classes)
+    np.testing.assert_allclose(classifier.predict_proba(queries), expected.predict_proba(queries))
+    np.testing.assert_array_equal(classifier.predict(queries), expected.predict(queries))
+
+
+def test_ivf_index_is_reported_as_approximate(points):
+    X, y_regression, _, queries = points
+    model = IndexedKNNRegressor(index='ivf', n_probe=10 ** 6).fit(X, y_regression)
+    summary = model.index_summary()
+    assert summary['index'] == 'ivf' and summary['approximate']
+    # Probing every list is an exact search
+    _, indices = model.kneighbors(queries)
+    np.testing.assert_array_equal(indices, KNeighborsRegressor().fit(X, y_regression).kneighbors(queries)[1])
+
+
+def _request(row, version='v1', model_key='model'):
+    return {'model_key': model_key, 'model_version': version, 'feature_data': {'inputData': row}}
+
+
+def test_prediction_cache_hits_after_put():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    key = cache.request_key(_request({'a': 1}))
+    assert cache.get(key) is None
+    cache.put(key, 'row-1', {'prediction': [1.0]})
+    assert cache.get(key) == {'prediction': [1.0]}
+    # Another raw row that aligned to the same input shares the entry once its hash is known
+    other = cache.request_key(_request({'a': 1.0, 'b': None}))
+    cache.put(other, 'row-1', {'prediction': [1.0]})
+    assert cache.stats()['entries'] == 1
+    assert cache.request_key({'model_key': 'model', 'feature_data': {}}) is None
+
+
+def test_prediction_cache_expires_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'monotonic', lambda: now[0])
+    cache = PredictionCache(max_entries=10, ttl_seconds=5)
+    key = cache.request_key(_request({'a': 1}))
+    cache.put(key, 'row-1', {'prediction': [1.0]})
+
+    now[0] += 4
+    assert cache.get(key) is not None
+    now[0] += 2
+    assert cache.get(key) is None
+    assert cache.stats()['expired'] == 1
+
+
+def test_prediction_cache_evicts_least_recently_used():
+    cache = PredictionCache(max_entries=2, ttl_seconds=60)
+    keys = [cache.request_key(_request({'a': i})) for i in range(3)]
+    cache.put(keys[0], 'row-0', {'prediction': [0]})
+    cache.put(keys[1], 'row-1', {'prediction': [1]})
+    cache.get(keys[0])
+    cache.put(keys[2], 'row-2', {'prediction': [2]})
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == {'prediction': [0]}
+    assert cache.get(keys[2]) == {'prediction': [2]}
+    assert cache.stats()['evicted'] == 1
+
+
+def test_prediction_cache_invalidates_models_and_old_versions():
+    cache = PredictionCache(max_entries=10, ttl_seconds=60)
+    old = cache.request_key(_request({'a': 1}, version='v1'))
+    other = cache.request_key(_request({'a': 1}, model_key='other'))
+    cache.put(old, 'row-1', {'prediction': [1]})
+    cache.put(other, 'row-1', {'prediction': [2]})
+
+    # A new version of a model drops the results of the old one
+    new = cache.request_key(_request({'a': 1}, version='v2'))
+    cache.put(new, 'row-1', {'prediction': [3]})
+    assert cache.get(old) is None
+    assert cache.get(new) == {'prediction': [3]}
+
+    assert cache.invalidate('model') == 1
+    assert cache.get(new) is None
+    assert cache.get(other) == {'prediction': [2]}
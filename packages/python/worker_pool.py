@@ -0,0 +1,461 @@
+"""Long-lived entry point that runs analyze, preprocess, train and predict jobs for the server.
+
+A forkserver process imports pandas, scikit-learn and the job modules once and forks a bounded
+pool of workers from that warm state, so a job no longer pays for interpreter startup and
+library imports. Jobs arrive as one JSON object per stdin line:
+
+    {"id": "...", "type": "ingest" | "analyze" | "preprocess" | "train" | "predict", "payload": {...}}
+
+and each gets one frame back on stdout, in completion order (see result_protocol): a JSON header
+
+    {"id": "...", "ok": true, "result": {...}}    or    {"id": "...", "ok": false, "error": "..."}
+
+followed by an optional binary payload, such as an Arrow IPC table. The payload of each job
+type is the JSON the matching script reads on stdin; an ingest job parses {"filePath": ...} into
+the dataset store (see dataset_store) and returns the dataset key later jobs can pass instead.
+
+Repeated predictions that carry a model_version are answered by this process from a bounded
+result cache keyed by model version and the aligned input row (see predict.PredictionCache).
+The worker computes the aligned row hash; this process only hashes the raw row. An {"type": "invalidate",
+"payload": {"model_key": ...}} job drops the cached results of a retrained model.
+
+Predictions that miss the result cache are micro-batched per model (see predict.MicroBatcher):
+the requests that arrive within --batch-window-ms of each other, up to --max-batch-rows, go
+to one worker as a single job and are scored as one frame. The stats job reports the batch
+sizes and the number of requests waiting for their window under "batching".
+
+A train job with params.progressive fits growing samples of the data (see
+create_model.progressive_fit) and sends a progress frame after each stage, before its result:
+
+    {"id": "...", "ok": true, "progress": {"learning_curve": [...], "primary_metric": ..., "final": ...}}
+
+Progress travels on a separate queue, so the last progress frame can arrive after the result,
+which already holds the full learning curve. {"type": "stop", "payload": {"job_id": ...}} makes
+a running progressive job finish after its current stage with the model fit so far.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from analyze_file import analyze_input
+from dataset_store import ingest_file, ingest_content
+from preprocessing import run_preprocessing
+from create_model import process_json_input
+from predict import (run_prediction, run_prediction_batch, PipelineCache, PredictionCache, MicroBatcher,
+                     ModelNotLoadedError)
+# Models pickled by running create_model.py as a script reference __main__.ColumnPreservingTransformer
+from pipeline_runtime import ColumnPreservingTransformer
+from result_protocol import FramedResult, write_frame
+
+# Imported once by the forkserver so every forked worker starts with them loaded
+PRELOAD_MODULES = ['pandas', 'numpy', 'sklearn', 'analyze_file', 'preprocessing', 'create_model', 'predict',
+                   'pipeline_runtime', 'compiled_scorer', 'model_artifact', 'dataset_store',
+                   'memory_planner', 'column_parallel', 'neighbor_index']
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Per-worker pipeline cache so repeated predictions against the same model skip loading it
+_pipeline_cache = None
+# Queue to the parent for the progress frames of running jobs
+_progress_queue = None
+
+
+def _init_worker(cache_bytes, log_level, progress_queue=None):
+    global _pipeline_cache, _progress_queue
+    _pipeline_cache = PipelineCache(cache_bytes)
+    _progress_queue = progress_queue
+    logging.getLogger().setLevel(log_level)
+    # Only the parent writes to stdout; a stray print in a job must not corrupt the protocol
+    sys.stdout = sys.stderr
+
+
+def _ingest_job(payload):
+    if 'fileContent' in payload:
+        return ingest_content(payload['fileContent'])
+    return ingest_file(payload['filePath'])
+
+
+def _train_job(payload, job_id=None, stop_event=None):
+    on_progress = None
+    if job_id is not None and _progress_queue is not None:
+        def on_progress(progress):
+            _progress_queue.put({'id': job_id, 'ok': True, 'progress': progress})
+    should_stop = stop_event.is_set if stop_event is not None else None
+    return json.loads(process_json_input(json.dumps(payload), on_progress, should_stop))
+
+
+def _predict_job(payload):
+    return run_prediction(payload, _pipeline_cache)
+
+
+def _predict_rows_job(payload):
+    return run_prediction_batch(payload, _pipeline_cache)
+
+
+JOB_HANDLERS = {
+    'ingest': _ingest_job,
+    'analyze': analyze_input,
+    'preprocess': run_preprocessing,
+    'train': _train_job,
+    'predict': _predict_job
+}
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def run_job(job_type, payload, job_id=None, stop_event=None):
+    if job_type == 'train':
+        return _train_job(payload, job_id, stop_event)
+    if job_type == 'predict_rows':
+        # Internal: one micro-batch window of predict jobs
+        return _predict_rows_job(payload)
+    return JOB_HANDLERS[job_type](payload)
+
+
+def _batch_key(payload):
+    # Requests are batched per model; without a version the model file identifies it
+    if payload.get('model_version') is not None:
+        return 'version', payload.get('model_key') or payload.get('model_path'), payload['model_version']
+    return 'path', payload.get('model_path')
+
+
+class QueueFullError(Exception):
+    pass
+
+
+def _is_progressive(job_type, payload):
+    return job_type == 'train' and bool(payload.get('params', {}).get('progressive'))
+
+
+class WorkerPool:
+    """Bounded process pool: at most max_workers jobs run and max_queue more wait."""
+
+    def __init__(self, max_workers, max_queue, max_jobs_per_worker, cache_bytes, log_level,
+                 prediction_cache=None, batch_window_ms=0, max_batch_rows=256):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.cache_bytes = cache_bytes
+        self.log_level = log_level
+        # Results of repeated predictions are answered here without a worker round trip
+        self.prediction_cache = prediction_cache
+        # Concurrent predict jobs for the same model are sent to a worker together
+        self.batcher = MicroBatcher(batch_window_ms, max_batch_rows, self._dispatch_batch) if batch_window_ms > 0 else None
+        self._lock = threading.Lock()
+        self._output_lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._context = multiprocessing.get_context('forkserver')
+        self._context.set_forkserver_preload(PRELOAD_MODULES)
+        self._progress = self._context.Queue()
+        # Stop flags of running progressive jobs; the manager process is started on first use
+        self._manager = None
+        self._stop_events = {}
+        # Jobs sent to the current executor, for recycling on Pythons without max_tasks_per_child
+        self._executor_jobs = 0
+        threading.Thread(target=self._forward_progress, daemon=True).start()
+        self._executor = self._start_executor()
+        # Start the forkserver and a first worker now rather than on the first real job
+        self._executor.submit(_warm_up).result()
+
+    def _start_executor(self):
+        # Recycling workers bounds the memory pandas and sklearn leave behind after large jobs.
+        # max_tasks_per_child needs Python 3.11; before that the whole pool is replaced after
+        # max_workers * max_jobs_per_worker jobs (see _count_job)
+        options = {}
+        if sys.version_info >= (3, 11):
+            options['max_tasks_per_child'] = self.max_jobs_per_worker
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=self._context,
+            initializer=_init_worker,
+            initargs=(self.cache_bytes, self.log_level, self._progress),
+            **options
+        )
+
+    def _count_job(self, executor):
+        if sys.version_info >= (3, 11):
+            return
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor_jobs += 1
+            if self._executor_jobs < self.max_workers * self.max_jobs_per_worker:
+                return
+            self._executor = self._start_executor()
+            self._executor_jobs = 0
+        # Jobs already submitted still run to completion on the old workers
+        executor.shutdown(wait=False)
+
+    def write(self, message, payload=b''):
+        with self._output_lock:
+            write_frame(sys.stdout.buffer, message, payload)
+
+    def _forward_progress(self):
+        while True:
+            self.write(self._progress.get())
+
+    def _stop_event(self, job_id):
+        with self._lock:
+            if self._manager is None:
+                self._manager = self._context.Manager()
+            event = self._manager.Event()
+            self._stop_events[job_id] = event
+        return event
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                'workers': self.max_workers,
+                'max_queue': self.max_queue,
+                'pending': self._pending,
+                'completed': self._completed,
+                'failed': self._failed
+            }
+        if self.prediction_cache is not None:
+            stats['prediction_cache'] = self.prediction_cache.stats()
+        if self.batcher is not None:
+            stats['batching'] = self.batcher.stats()
+        return stats
+
+    def _prediction_cache_key(self, payload):
+        # Only hashes the raw row: this runs on the thread that dispatches every job
+        if self.prediction_cache is None or not payload.get('use_cache', True) or 'feature_data' not in payload:
+            return None
+        try:
+            return self.prediction_cache.request_key(payload)
+        except (TypeError, ValueError) as e:
+            # The worker reports malformed requests; they are just not cached
+            logger.warning(f"Prediction not cacheable: {str(e)}")
+            return None
+
+    def _answer_from_cache(self, job_id, cache_key, start_time):
+        result = self.prediction_cache.get(cache_key)
+        if result is None:
+            return False
+        with self._lock:
+            self._completed += 1
+        self.write({'id': job_id, 'ok': True, 'result': {**result, 'result_cache': 'hit'},
+                    'elapsed_ms': (time.perf_counter() - start_time) * 1000})
+        return True
+
+    def submit(self, job):
+        job_id = job.get('id')
+        job_type = job.get('type')
+
+        if job_type == 'stats':
+            self.write({'id': job_id, 'ok': True, 'result': self.stats()})
+            return
+        if job_type == 'invalidate':
+            # Sent when a model is retrained; results of the new version get new keys anyway
+            model_key = job.get('payload', {}).get('model_key')
+            removed = self.prediction_cache.invalidate(model_key) if self.prediction_cache is not None else 0
+            self.write({'id': job_id, 'ok': True, 'result': {'model_key': model_key, 'invalidated': removed}})
+            return
+        if job_type == 'stop':
+            target = job.get('payload', {}).get('job_id')
+            event = self._stop_events.get(target)
+            if event is not None:
+                event.set()
+            self.write({'id': job_id, 'ok': True, 'result': {'job_id': target, 'stopping': event is not None}})
+            return
+        if job_type not in JOB_HANDLERS:
+            self.write({'id': job_id, 'ok': False, 'error': f"Unsupported job type: {job_type}"})
+            return
+
+        start_time = time.perf_counter()
+        cache_key = self._prediction_cache_key(job.get('payload', {})) if job_type == 'predict' else None
+        if cache_key is not None and self._answer_from_cache(job_id, cache_key, start_time):
+            return
+        if job_type == 'predict' and self.batcher is not None:
+            # Counted as pending once its window is sent to a worker (see _dispatch_batch)
+            payload = job.get('payload', {})
+            future = self.batcher.submit(_batch_key(payload), (payload, cache_key))
+            future.add_done_callback(
+                lambda done: self._finish(job_id, job_type, start_time, None, done, cache_key, counted=False))
+            return
+
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.write({'id': job_id, 'ok': False, 'error': "Worker pool queue is full", 'error_code': 'queue_full'})
+                return
+            self._pending += 1
+
+        payload = job.get('payload', {})
+        if cache_key is not None:
+            # The worker computes the aligned row hash the result is cached under
+            payload = {**payload, 'return_row_hash': True}
+        stop_event = self._stop_event(job_id) if _is_progressive(job_type, payload) else None
+        executor, future = self._run(job_type, payload, job_id, stop_event)
+        future.add_done_callback(lambda done: self._finish(job_id, job_type, start_time, executor, done, cache_key))
+
+    def _run(self, job_type, payload, job_id=None, stop_event=None):
+        executor = self._executor
+        try:
+            future = executor.submit(run_job, job_type, payload, job_id, stop_event)
+        except BrokenProcessPool:
+            self._restart(executor)
+            executor = self._executor
+            future = executor.submit(run_job, job_type, payload, job_id, stop_event)
+        self._count_job(executor)
+        return executor, future
+
+    def _dispatch_batch(self, key, batch):
+        """Send one micro-batch window of predict jobs, [((payload, cache_key), future)], as one job."""
+        with self._lock:
+            full = self._pending >= self.max_workers + self.max_queue
+            if not full:
+                self._pending += 1
+        if full:
+            for _, future in batch:
+                future.set_exception(QueueFullError("Worker pool queue is full"))
+            return
+
+        payloads = [payload for (payload, _), _ in batch]
+        # Any request of the window that sent the model file lets the worker load it
+        model = next((payload for payload in payloads if payload.get('model_path')), payloads[0])
+        job = {field: model[field] for field in ('model_path', 'model_key', 'model_version') if field in model}
+        job['rows'] = [payload['feature_data'] for payload in payloads]
+        job['return_row_hash'] = any(cache_key is not None for (_, cache_key), _ in batch)
+        try:
+            executor, future = self._run('predict_rows', job)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        futures = [future for _, future in batch]
+        future.add_done_callback(lambda done: self._resolve_batch(executor, done, futures))
+
+    def _resolve_batch(self, executor, done, futures):
+        with self._lock:
+            self._pending -= 1
+        try:
+            results = done.result()['results']
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                threading.Thread(target=self._restart, args=(executor,), daemon=True).start()
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if 'error' in result:
+                future.set_exception(ValueError(result['error']))
+            else:
+                future.set_result(result)
+
+    def _finish(self, job_id, job_type, start_time, executor, future, cache_key=None, counted=True):
+        elapsed_ms = (time.perf_counter() - start_time) * 1000
+        payload = b''
+        try:
+            result = future.result()
+            if isinstance(result, FramedResult):
+                result, payload = result.header, result.payload
+            if job_type == 'predict' and 'row_hash' in result:
+                # Internal field: a batch computes it for every row once any of them is cacheable
+                result = dict(result)
+                row_hash = result.pop('row_hash')
+                if cache_key is not None:
+                    self.prediction_cache.put(cache_key, row_hash, dict(result))
+            if cache_key is not None:
+                result = {**result, 'result_cache': 'miss'}
+            message = {'id': job_id, 'ok': True, 'result': result, 'elapsed_ms': elapsed_ms}
+        except BrokenProcessPool as e:
+            # A worker died (for example killed for memory); later jobs get a fresh pool
+            logger.error(f"Worker process died while running {job_type} job {job_id}")
+            message = {'id': job_id, 'ok': False, 'error': f"Worker process died: {str(e)}", 'error_code': 'worker_died'}
+            if executor is not None:
+                threading.Thread(target=self._restart, args=(executor,), daemon=True).start()
+        except ModelNotLoadedError as e:
+            # The caller resends the request with model_path
+            message = {'id': job_id, 'ok': False, 'error': str(e), 'error_code': 'model_not_loaded',
+                       'elapsed_ms': elapsed_ms}
+        except QueueFullError as e:
+            message = {'id': job_id, 'ok': False, 'error': str(e), 'error_code': 'queue_full'}
+        except Exception as e:
+            logger.error(f"{job_type} job {job_id} failed: {str(e)}")
+            message = {'id': job_id, 'ok': False, 'error': str(e), 'elapsed_ms': elapsed_ms}
+
+        with self._lock:
+            if counted:
+                self._pending -= 1
+            self._stop_events.pop(job_id, None)
+            if message['ok']:
+                self._completed += 1
+            else:
+                self._failed += 1
+        self.write(message, payload)
+
+    def _restart(self, broken):
+        with self._lock:
+            # Several jobs can fail with the same broken pool; only replace it once
+            if self._executor is not broken:
+                return
+            self._executor = self._start_executor()
+            self._executor_jobs = 0
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+        if self._manager is not None:
+            self._manager.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked worker pool for server jobs")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PYTHON_POOL_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--max-queue', type=int, default=int(os.environ.get('PYTHON_POOL_QUEUE', 64)))
+    parser.add_argument('--max-jobs-per-worker', type=int,
+                        default=int(os.environ.get('PYTHON_POOL_JOBS_PER_WORKER', 50)))
+    parser.add_argument('--cache-mb', type=float, default=float(os.environ.get('PREDICT_CACHE_MB', 256)))
+    parser.add_argument('--prediction-cache-entries', type=int,
+                        default=int(os.environ.get('PREDICTION_CACHE_ENTRIES', 10000)),
+                        help="Prediction results kept for repeated inputs; 0 disables the cache")
+    parser.add_argument('--prediction-cache-ttl', type=float,
+                        default=float(os.environ.get('PREDICTION_CACHE_TTL_S', 300)),
+                        help="Seconds a cached prediction result stays valid")
+    parser.add_argument('--batch-window-ms', type=float,
+                        default=float(os.environ.get('PREDICT_BATCH_WINDOW_MS', 2)),
+                        help="Micro-batching window for concurrent predict jobs; 0 disables batching")
+    parser.add_argument('--max-batch-rows', type=int, default=int(os.environ.get('PREDICT_MAX_BATCH_ROWS', 256)))
+    parser.add_argument('--log-level', default=os.environ.get('PYTHON_POOL_LOG_LEVEL', 'INFO'))
+    args = parser.parse_args()
+
+    # The job modules configure DEBUG logging on import; per-job debug output is too costly here
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    prediction_cache = None
+    if args.prediction_cache_entries > 0:
+        prediction_cache = PredictionCache(args.prediction_cache_entries, args.prediction_cache_ttl)
+    pool = WorkerPool(args.workers, args.max_queue, args.max_jobs_per_worker,
+                      int(args.cache_mb * 1024 * 1024), args.log_level.upper(), prediction_cache,
+                      args.batch_window_ms, args.max_batch_rows)
+    logger.info(f"Worker pool ready with {args.workers} workers")
+    pool.write({'id': None, 'ok': True, 'result': {'ready': True, **pool.stats()}})
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            job = json.loads(line)
+        except json.JSONDecodeError as e:
+            pool.write({'id': None, 'ok': False, 'error': f"Invalid JSON job: {str(e)}"})
+            continue
+        pool.submit(job)
+
+    # stdin closed: let running jobs finish before exiting
+    pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,16 +13,21 @@ import {
   PyTorchGenerator,
   TensorFlowGenerator,
 } from "../core/codeGeneration/modelGenerator";
-import { runInPythonSandbox } from "../core/pythonSandbox/run";
+import {
+  ingestDataset,
+  runPythonJob,
+  PythonJobError,
+} from "../core/pythonSandbox/run";
 import { getSupabaseClient } from "../lib/supabase";
 
 import fs from "fs";
 import path from "path";
 import os from "os";
-import Papa from "papaparse";
 
 export default async function workbookController(fastify: FastifyInstance) {
   const supa = getSupabaseClient();
+  // Running progressive training jobs by project, so /stop_training can end them early
+  const runningTrainings = new Map<string, AbortController>();
   // POST /
   fastify.post(
     "/code_gen",
@@ -109,8 +114,8 @@ export default async function workbookController(fastify: FastifyInstance) {
         console.log("6. Extracted bucket name:", bucketName);
         console.log("7. Extracted file path:", filePath);
 
-        // Fetch the file content from Supabase storage
-        let fileContent;
+        // Fetch the file from Supabase storage and ingest it into the dataset store
+        let datasetKey;
         try {
           const { data, error } = await supa.storage
             .from(bucketName!)
@@ -126,64 +131,22 @@ export default async function workbookController(fastify: FastifyInstance) {
             throw new Error("No data received from Supabase storage");
           }
 
-          // Convert the file data to text
-          fileContent = await data.text();
-          console.log("10. File content fetched successfully");
+          datasetKey = await ingestDataset(data);
+          console.log("10. File ingested as dataset", datasetKey);
         } catch (error) {
           console.error("11. Error in fetching file content:", error);
           throw error;
         }
 
-        const input = JSON.stringify({
-          fileContent,
+        const input = {
+          datasetKey,
           taskType,
           targetColumn,
-        });
-
-        // Specify the path to your Python script
-        const scriptPath = "../packages/python/analyze_file.py";
-
-        console.log("12. Running Python script");
-        // Run the Python script in the sandbox
-        const result: any = await new Promise((resolve, reject) => {
-          let stdout = "";
-          let stderr = "";
-
-          runInPythonSandbox({
-            input,
-            files: [],
-            scriptPath,
-            onData: (data: string) => {
-              stdout += data;
-            },
-            onError: (error: string) => {
-              stderr += error;
-            },
-            onClose: (code: number) => {
-              if (code !== 0) {
-                console.error("13. Python script error:", stderr);
-                reject(
-                  new Error(
-                    `Python script exited with code ${code}. Stderr: ${stderr}`,
-                  ),
-                );
-              } else {
-                try {
-                  const jsonResult = JSON.parse(stdout);
-                  console.log("14. Python script executed successfully");
-                  resolve(jsonResult);
-                } catch (error) {
-                  console.error("15. Failed to parse JSON result:", error);
-                  reject(
-                    new Error(
-                      `Failed to parse JSON result. Stdout: ${stdout}, Stderr: ${stderr}`,
-                    ),
-                  );
-                }
-              }
-            },
-          });
-        });
+        };
+
+        console.log("12. Running analysis job");
+        const result: any = await runPythonJob("analyze", input);
+        console.log("14. Analysis job executed successfully");
 
         console.log("16. Fetching existing workbook data from Supabase");
         // Fetch existing workbook data from Supabase
@@ -336,8 +299,8 @@ export default async function workbookController(fastify: FastifyInstance) {
         console.log("6. Extracted bucket name:", bucketName);
         console.log("7. Extracted file path:", filePath);
 
-        // Fetch the file content from Supabase storage
-        let fileContent;
+        // Fetch the file from Supabase storage and ingest it into the dataset store
+        let datasetKey;
         try {
           const { data, error } = await supa.storage
             .from(bucketName!)
@@ -353,72 +316,23 @@ export default async function workbookController(fastify: FastifyInstance) {
             throw new Error("No data received from Supabase storage");
           }
 
-          // Convert the file data to text
-          fileContent = await data.text();
-          console.log("10. File content fetched successfully");
+          datasetKey = await ingestDataset(data);
+          console.log("10. File ingested as dataset", datasetKey);
         } catch (error) {
           console.error("11. Error in fetching file content:", error);
           throw error;
         }
 
-        // Create a temporary file
-        const tempDir = os.tmpdir();
-        let tempFilePath = path.join(tempDir, `temp_${Date.now()}.csv`);
-        fs.writeFileSync(tempFilePath, fileContent);
-
-        console.log("11. Temporary file created:", tempFilePath);
-
-        const input = JSON.stringify({
-          filePath: tempFilePath,
+        const input = {
+          datasetKey,
           taskType,
           targetColumn,
           preProcessingConfig,
-        });
-
-        // Specify the path to your Python script
-        const scriptPath = "../packages/python/preprocessing.py";
-
-        console.log("12. Running Python script");
-        // Run the Python script in the sandbox
-        const result: any = await new Promise((resolve, reject) => {
-          let stdout = "";
-          let stderr = "";
-
-          runInPythonSandbox({
-            input,
-            files: [tempFilePath], // Include the temporary file
-            scriptPath,
-            onData: (data: string) => {
-              stdout += data;
-            },
-            onError: (error: string) => {
-              stderr += error;
-            },
-            onClose: (code: number) => {
-              if (code !== 0) {
-                console.error("13. Python script error:", stderr);
-                reject(
-                  new Error(
-                    `Python script exited with code ${code}. Stderr: ${stderr}`,
-                  ),
-                );
-              } else {
-                try {
-                  const jsonResult = JSON.parse(stdout);
-                  console.log("14. Python script executed successfully");
-                  resolve(jsonResult);
-                } catch (error) {
-                  console.error("15. Failed to parse JSON result:", error);
-                  reject(
-                    new Error(
-                      `Failed to parse JSON result. Stdout: ${stdout}, Stderr: ${stderr}`,
-                    ),
-                  );
-                }
-              }
-            },
-          });
-        });
+        };
+
+        console.log("12. Running preprocessing job");
+        const result: any = await runPythonJob("preprocess", input);
+        console.log("14. Preprocessing job executed successfully");
 
         console.log("16. Uploading preprocessed file to storage");
         // Upload the preprocessed file to storage
@@ -428,10 +342,17 @@ export default async function workbookController(fastify: FastifyInstance) {
         );
         const preprocessedFilePath = `${userId}/project-${projectId}/${preprocessedFileName}`;
 
+        // The job leaves the preprocessed table on disk and only returns its path
+        // plus a bounded preview, so the data never passes through the job protocol
+        const preprocessedData = await fs.promises.readFile(
+          result.preprocessed_file,
+        );
+        fs.unlinkSync(result.preprocessed_file);
+
         try {
           const { error } = await supa.storage
             .from(bucketName!)
-            .upload(preprocessedFilePath, result.preprocessed_data, {
+            .upload(preprocessedFilePath, preprocessedData, {
               contentType: "text/csv",
               upsert: true,
             });
@@ -450,11 +371,7 @@ export default async function workbookController(fastify: FastifyInstance) {
 
           console.log("20. Got public URL for preprocessed file:", publicUrl);
 
-          // Parse the first 15 lines of the preprocessed CSV
-          const parsedData = Papa.parse(result.preprocessed_data, {
-            header: true,
-          });
-          const previewData = parsedData.data.slice(0, 15);
+          const previewData = result.table.preview;
 
           // Fetch the current files array
           const { data: currentData, error: fetchError } = await supa
@@ -576,17 +493,14 @@ export default async function workbookController(fastify: FastifyInstance) {
           throw fileError;
         }
 
-        // Create a temporary file
-        const tempDir = os.tmpdir();
-        const tempFilePath = path.join(tempDir, `temp_${Date.now()}.csv`);
-        fs.writeFileSync(tempFilePath, await fileData.text());
+        const datasetKey = await ingestDataset(fileData);
 
-        console.log("4. Temporary file created:", tempFilePath);
+        console.log("4. File ingested as dataset", datasetKey);
 
         // Prepare input for the Python script
         const taskType = modelConfig.taskType || workbookData.config.taskType;
-        const input = JSON.stringify({
-          filePath: tempFilePath,
+        const input = {
+          datasetKey,
           params: {
             ...modelConfig,
             task: taskType, // Changed from taskType to task to match Python script
@@ -597,119 +511,105 @@ export default async function workbookController(fastify: FastifyInstance) {
             X_columns: "all", // Use all columns for features
             preprocessing_config: workbookData.config.preProcessingConfig,
           },
-        });
+        };
 
         console.log("5. Input prepared:", input);
 
-        // Run the Python script
-        const scriptPath = "../packages/python/create_model.py";
-        console.log("6. Running Python script");
-
-        const result: any = await new Promise((resolve, reject) => {
-          let stdout = "";
-          let stderr = "";
-
-          runInPythonSandbox({
-            input,
-            files: [tempFilePath],
-            scriptPath,
-            onData: (data: string) => {
-              stdout += data;
-            },
-            onError: (error: string) => {
-              stderr += error;
-            },
-            onClose: (code: number) => {
-              if (code !== 0) {
-                console.error("7. Python script error:", stderr);
-                try {
-                  const errorDetails = JSON.parse(stderr);
-                  console.error("Error details:", errorDetails);
-                  reject(
-                    new Error(
-                      `Python script error: ${errorDetails.error}\nAvailable columns: ${errorDetails.available_columns}`,
-                    ),
-                  );
-                } catch {
-                  reject(
-                    new Error(
-                      `Python script exited with code ${code}. Stderr: ${stderr}`,
-                    ),
-                  );
-                }
-              } else {
-                try {
-                  const jsonResult = JSON.parse(stdout);
-                  console.log("8. Python script executed");
-                  if (jsonResult.success) {
-                    resolve(jsonResult.results);
-                  } else {
-                    console.error(
-                      "Python script returned an error:",
-                      jsonResult.error,
-                      jsonResult.available_columns,
-                    );
-                    reject(new Error(jsonResult.error));
-                  }
-                } catch (error) {
-                  console.error("9. Failed to parse JSON result:", error);
-                  reject(
-                    new Error(
-                      `Failed to parse JSON result. Stdout: ${stdout}, Stderr: ${stderr}`,
-                    ),
-                  );
-                }
+        console.log("6. Running training job");
+        let jobResult: any;
+        if (modelConfig.progressive) {
+          // Each stage's learning curve is stored on the workbook as it arrives, so the
+          // client can show early metrics while the larger samples are still training
+          const abort = new AbortController();
+          runningTrainings.set(projectId, abort);
+          let progressWrite = Promise.resolve();
+          const onProgress = (progress: any) => {
+            const stage =
+              progress.learning_curve[progress.learning_curve.length - 1];
+            console.log(
+              `7. Progressive stage ${stage.stage} on ${stage.rows} rows:`,
+              stage.metrics[progress.primary_metric],
+            );
+            progressWrite = progressWrite.then(async () => {
+              const { error } = await supa
+                .from("workbook_data")
+                .update({
+                  config: {
+                    ...workbookData.config,
+                    trainingProgress: progress,
+                  },
+                })
+                .eq("id", workbookData.id);
+              if (error) {
+                console.error("Error storing training progress:", error);
               }
-            },
-          });
-        });
-
-        // Clean up the temporary CSV file
-        fs.unlinkSync(tempFilePath);
+            });
+          };
+          try {
+            jobResult = await runPythonJob("train", input, {
+              onProgress,
+              signal: abort.signal,
+            });
+          } finally {
+            runningTrainings.delete(projectId);
+            // The final config update below must not be overwritten by a late progress write
+            await progressWrite;
+          }
+        } else {
+          jobResult = await runPythonJob("train", input);
+        }
+        console.log("8. Training job executed");
+        if (!jobResult.success) {
+          console.error(
+            "Python script returned an error:",
+            jobResult.error,
+            jobResult.available_columns,
+          );
+          throw new Error(jobResult.error);
+        }
+        const result: any = jobResult.results;
 
-        // Create a temporary file for the pickle
-        const tempPicklePath = path.join(tempDir, `model_${Date.now()}.pkl`);
-        fs.writeFileSync(
-          tempPicklePath,
-          Buffer.from(result.model_pickle, "base64"),
-        );
+        // The Python script writes the model artifact to disk and only reports its path
+        const tempArtifactPath: string = result.model_artifact;
 
-        console.log("10. Temporary pickle file created:", tempPicklePath);
+        console.log("10. Model artifact written:", tempArtifactPath);
 
-        // Upload the pickle file to Supabase storage
-        const pickleFileName = `model_${workbookData.id}.pkl`;
-        const pickleFilePath = `${workbookData.created_by}/project-${projectId}/${pickleFileName}`;
+        // Upload the model artifact to Supabase storage
+        const artifactFileName = `model_${workbookData.id}.skmodel`;
+        const artifactFilePath = `${workbookData.created_by}/project-${projectId}/${artifactFileName}`;
 
         try {
           const { error: uploadError } = await supa.storage
             .from("workbook-files")
-            .upload(pickleFilePath, fs.readFileSync(tempPicklePath), {
+            .upload(artifactFilePath, fs.readFileSync(tempArtifactPath), {
               contentType: "application/octet-stream",
               upsert: true,
             });
 
           if (uploadError) {
-            console.error("11. Error uploading pickle file:", uploadError);
+            console.error("11. Error uploading model artifact:", uploadError);
             throw uploadError;
           }
 
-          console.log("12. Pickle file uploaded successfully");
+          console.log("12. Model artifact uploaded successfully");
 
-          // Get the public URL of the uploaded pickle file
+          // Get the public URL of the uploaded model artifact
           const {
             data: { publicUrl },
-          } = supa.storage.from("workbook-files").getPublicUrl(pickleFilePath);
+          } = supa.storage
+            .from("workbook-files")
+            .getPublicUrl(artifactFilePath);
 
-          console.log("13. Got public URL for pickle file:", publicUrl);
+          console.log("13. Got public URL for model artifact:", publicUrl);
 
-          // Clean up the temporary pickle file
-          fs.unlinkSync(tempPicklePath);
+          // Clean up the temporary model artifact
+          fs.unlinkSync(tempArtifactPath);
 
           // Update the result object with the model URL
           result.model_url = publicUrl;
-          delete result.model_pickle; // Remove the base64 pickle data from the result
+          delete result.model_artifact; // Remove the local artifact path from the result
         } catch (error) {
-          console.error("14. Error in uploading pickle file:", error);
+          console.error("14. Error in uploading model artifact:", error);
           throw error;
         }
 
@@ -731,6 +631,9 @@ export default async function workbookController(fastify: FastifyInstance) {
 
         console.log("16. Workbook data updated with model results");
 
+        // The retrained model is uploaded under the same URL; drop predictions of the old one
+        await runPythonJob("invalidate", { model_key: result.model_url });
+
         reply
           .header("Content-Type", "application/json; charset=utf-8")
           .send(result);
@@ -752,6 +655,22 @@ export default async function workbookController(fastify: FastifyInstance) {
     },
   );
 
+  // POST /stop_training
+  fastify.post(
+    "/stop_training",
+    async function (_request: FastifyRequest, reply: FastifyReply) {
+      const { projectId } = _request.body as { projectId: string };
+
+      // The job finishes its current stage and /create_model returns that model
+      const training = runningTrainings.get(projectId);
+      training?.abort();
+
+      reply
+        .header("Content-Type", "application/json; charset=utf-8")
+        .send({ projectId, stopping: training !== undefined });
+    },
+  );
+
   // POST /predict
   fastify.post(
     "/predict",
@@ -789,82 +708,43 @@ export default async function workbookController(fastify: FastifyInstance) {
 
         const modelUrl = workbookData.config.modelResults.model_url;
 
-        // Download the model file
-        const { data: modelData, error: modelError } = await supa.storage
-          .from(modelUrl.split("/")[7])
-          .download(modelUrl.split("/").slice(8).join("/"));
-
-        if (modelError) {
-          console.error("3. Error downloading model:", modelError);
-          throw modelError;
-        }
-
-        // Create a temporary file for the model
-        const tempDir = os.tmpdir();
-        const tempModelPath = path.join(tempDir, `model_${Date.now()}.pkl`);
-
-        // Convert Blob to Buffer and write to file
-        const modelBuffer = await blobToBuffer(modelData);
-        fs.writeFileSync(tempModelPath, modelBuffer);
-
-        console.log("4. Temporary model file created:", tempModelPath);
-
-        // Prepare input for the Python script
-        const input = JSON.stringify({
-          model_path: tempModelPath,
+        // Prepare input for the Python script. The worker answers from the pipeline it
+        // already loaded for this model version; the model is only downloaded when it has not
+        const input = {
+          model_key: modelUrl,
+          // Repeated inputs to this model version are answered from the prediction cache
+          model_version: workbookData.config.modelResults.artifact_id,
           feature_data: {
             inputData: inputData,
           },
-        });
+        };
 
         console.log("5. Input prepared:", input);
 
-        // Run the Python script
-        const scriptPath = "../packages/python/predict.py";
-        console.log("6. Running Python script");
-
-        const result: any = await new Promise((resolve, reject) => {
-          let stdout = "";
-          let stderr = "";
-
-          runInPythonSandbox({
-            input,
-            files: [tempModelPath],
-            scriptPath,
-            onData: (data: string) => {
-              stdout += data;
-            },
-            onError: (error: string) => {
-              stderr += error;
-            },
-            onClose: (code: number) => {
-              if (code !== 0) {
-                console.error("7. Python script error:", stderr);
-                reject(
-                  new Error(
-                    `Python script exited with code ${code}. Stderr: ${stderr}`,
-                  ),
-                );
-              } else {
-                try {
-                  const jsonResult = JSON.parse(stdout);
-                  console.log("8. Python script executed successfully");
-                  resolve(jsonResult);
-                } catch (error) {
-                  console.error("9. Failed to parse JSON result:", error);
-                  reject(
-                    new Error(
-                      `Failed to parse JSON result. Stdout: ${stdout}, Stderr: ${stderr}`,
-                    ),
-                  );
-                }
-              }
-            },
-          });
-        });
-
-        // Clean up the temporary model file
-        fs.unlinkSync(tempModelPath);
+        console.log("6. Running prediction job");
+        let result: any;
+        try {
+          result = await runPythonJob("predict", input);
+        } catch (error) {
+          if (
+            !(error instanceof PythonJobError) ||
+            error.code !== "model_not_loaded"
+          ) {
+            throw error;
+          }
+          const tempModelPath = await downloadModel(modelUrl);
+          console.log("7. Model not loaded, downloaded to:", tempModelPath);
+          try {
+            result = await runPythonJob("predict", {
+              ...input,
+              model_path: tempModelPath,
+            });
+          } finally {
+            // Clean up the temporary model file
+            fs.unlinkSync(tempModelPath);
+          }
+        }
+        console.log("8. Prediction job executed successfully");
 
         reply
           .header("Content-Type", "application/json; charset=utf-8")
@@ -880,6 +760,25 @@ export default async function workbookController(fastify: FastifyInstance) {
     },
   );
 
+  // Downloads a model artifact to a temporary file and returns its path
+  async function downloadModel(modelUrl: string): Promise<string> {
+    const { data: modelData, error: modelError } = await supa.storage
+      .from(modelUrl.split("/")[7])
+      .download(modelUrl.split("/").slice(8).join("/"));
+
+    if (modelError) {
+      console.error("Error downloading model:", modelError);
+      throw modelError;
+    }
+
+    const tempModelPath = path.join(
+      os.tmpdir(),
+      `model_${Date.now()}${path.extname(modelUrl) || ".pkl"}`,
+    );
+    fs.writeFileSync(tempModelPath, await blobToBuffer(modelData));
+    return tempModelPath;
+  }
+
   // Helper function to convert Blob to Buffer
   async function blobToBuffer(blob: Blob): Promise<Buffer> {
     const arrayBuffer = await blob.arrayBuffer();
@@ -1,36 +1,236 @@
 const { spawn } = require("child_process");
 
-type RunInPythonSandboxArgs = {
-  input: string;
-  files: string[];
-  scriptPath: string;
-  onData: (data: string) => void;
-  onError: (error: string) => void;
-  onClose: (code: number) => void;
+import type { ChildProcess } from "child_process";
+import { randomUUID } from "crypto";
+import fs from "fs";
+import os from "os";
+import path from "path";
+
+// Long-lived Python entry point that preloads pandas/sklearn and runs jobs on a
+// bounded pool of forked workers (see packages/python/worker_pool.py)
+const WORKER_POOL_SCRIPT = "../packages/python/worker_pool.py";
+
+export type PythonJobType =
+  | "ingest"
+  | "analyze"
+  | "preprocess"
+  | "train"
+  | "predict"
+  | "invalidate";
+
+export type PythonJobOptions = {
+  // Called with each progress frame, e.g. the learning curve of a progressive train job
+  onProgress?: (progress: any) => void;
+  // Aborting asks the job to stop early; a progressive train job then returns the model fit so far
+  signal?: AbortSignal;
+};
+
+type WorkerMessage = {
+  id: string | null;
+  ok: boolean;
+  result?: any;
+  progress?: any;
+  error?: string;
+  error_code?: string;
 };
 
-export function runInPythonSandbox({
-  input,
-  files,
-  scriptPath,
-  onData,
-  onError,
-  onClose,
-}: RunInPythonSandboxArgs) {
-  const pythonProcess = spawn("python3", [scriptPath]);
-  console.log(files);
-  pythonProcess.stdout.on("data", (data: Buffer) => {
-    onData(data.toString());
-  });
-
-  pythonProcess.stderr.on("data", (data: Buffer) => {
-    onError(data.toString());
-  });
-
-  pythonProcess.on("close", (code: number) => {
-    onClose(code);
-  });
-
-  pythonProcess.stdin.write(input);
-  pythonProcess.stdin.end();
+// Every response is a frame: header length (uint32 BE), payload length (uint64 BE),
+// JSON header, binary payload (see packages/python/result_protocol.py)
+const FRAME_PREFIX_BYTES = 12;
+
+class FrameReader {
+  private chunks: Buffer[] = [];
+  private buffered = 0;
+
+  constructor(
+    private onFrame: (header: WorkerMessage, payload: Buffer) => void,
+  ) {}
+
+  push(chunk: Buffer) {
+    this.chunks.push(chunk);
+    this.buffered += chunk.length;
+
+    while (this.buffered >= FRAME_PREFIX_BYTES) {
+      const prefix = this.peek(FRAME_PREFIX_BYTES);
+      const headerLength = prefix.readUInt32BE(0);
+      const payloadLength = Number(prefix.readBigUInt64BE(4));
+      const frameLength = FRAME_PREFIX_BYTES + headerLength + payloadLength;
+      // Wait for the rest of the frame without copying what has arrived so far
+      if (this.buffered < frameLength) {
+        return;
+      }
+
+      const frame = this.take(frameLength);
+      const header = JSON.parse(
+        frame
+          .subarray(FRAME_PREFIX_BYTES, FRAME_PREFIX_BYTES + headerLength)
+          .toString("utf8"),
+      );
+      this.onFrame(header, frame.subarray(FRAME_PREFIX_BYTES + headerLength));
+    }
+  }
+
+  private peek(length: number): Buffer {
+    if (this.chunks[0].length < length) {
+      this.chunks = [Buffer.concat(this.chunks)];
+    }
+    return this.chunks[0].subarray(0, length);
+  }
+
+  private take(length: number): Buffer {
+    const all =
+      this.chunks.length === 1 ? this.chunks[0] : Buffer.concat(this.chunks);
+    const rest = all.subarray(length);
+    this.chunks = rest.length ? [rest] : [];
+    this.buffered = rest.length;
+    return all.subarray(0, length);
+  }
+}
+
+type PendingJob = {
+  resolve: (result: any) => void;
+  reject: (error: Error) => void;
+  onProgress?: (progress: any) => void;
+};
+
+export class PythonJobError extends Error {
+  code?: string;
+
+  constructor(message: string, code?: string) {
+    super(message);
+    this.name = "PythonJobError";
+    this.code = code;
+  }
+}
+
+class PythonWorkerPool {
+  private process: ChildProcess | null = null;
+  private pending = new Map<string, PendingJob>();
+  private nextId = 0;
+  private stderrTail = "";
+
+  private start(): ChildProcess {
+    const args = [WORKER_POOL_SCRIPT];
+    if (process.env.PYTHON_POOL_WORKERS) {
+      args.push("--workers", process.env.PYTHON_POOL_WORKERS);
+    }
+    const child: ChildProcess = spawn("python3", args, {
+      stdio: ["pipe", "pipe", "pipe"],
+    });
+
+    const reader = new FrameReader((header, payload) =>
+      this.handleFrame(header, payload),
+    );
+    child.stdout!.on("data", (chunk: Buffer) => reader.push(chunk));
+
+    child.stderr!.on("data", (data: Buffer) => {
+      // Keep the last few KB of worker logs for error messages
+      this.stderrTail = (this.stderrTail + data.toString()).slice(-4096);
+    });
+
+    child.on("close", (code: number) => {
+      console.error(`Python worker pool exited with code ${code}`);
+      if (this.process === child) {
+        this.process = null;
+      }
+      const error = new PythonJobError(
+        `Python worker pool exited with code ${code}. Stderr: ${this.stderrTail}`,
+        "pool_exited",
+      );
+      this.pending.forEach((job) => job.reject(error));
+      this.pending.clear();
+    });
+
+    return child;
+  }
+
+  private handleFrame(message: WorkerMessage, payload: Buffer) {
+    // The pool announces itself with an id-less ready message
+    if (message.id === null) {
+      if (!message.ok) {
+        console.error("Python worker pool error:", message.error);
+      }
+      return;
+    }
+
+    // Progress frames of a finished job can trail its result and are dropped here
+    const job = this.pending.get(message.id);
+    if (!job) {
+      return;
+    }
+    if (message.progress !== undefined) {
+      job.onProgress?.(message.progress);
+      return;
+    }
+    this.pending.delete(message.id);
+
+    if (message.ok) {
+      // Binary payloads (for example Arrow IPC tables) are handed over as Buffers
+      job.resolve(
+        payload.length ? { ...message.result, payload } : message.result,
+      );
+    } else {
+      job.reject(
+        new PythonJobError(message.error || "Unknown error", message.error_code),
+      );
+    }
+  }
+
+  run(
+    type: PythonJobType,
+    payload: unknown,
+    options: PythonJobOptions = {},
+  ): Promise<any> {
+    if (!this.process) {
+      this.process = this.start();
+    }
+    const id = String(this.nextId++);
+    options.signal?.addEventListener(
+      "abort",
+      () => {
+        // The stop acknowledgement has no pending job and is ignored
+        if (this.pending.has(id)) {
+          this.process?.stdin?.write(
+            JSON.stringify({
+              id: `${id}-stop`,
+              type: "stop",
+              payload: { job_id: id },
+            }) + "\n",
+          );
+        }
+      },
+      { once: true },
+    );
+    return new Promise((resolve, reject) => {
+      this.pending.set(id, { resolve, reject, onProgress: options.onProgress });
+      this.process!.stdin!.write(JSON.stringify({ id, type, payload }) + "\n");
+    });
+  }
+}
+
+const workerPool = new PythonWorkerPool();
+
+// Parses an uploaded CSV once into the Python dataset store (keyed by content hash)
+// and returns the key that analyze, preprocess and train jobs accept as datasetKey.
+// Identical content is found in the store and not parsed again.
+export async function ingestDataset(data: Blob): Promise<string> {
+  const tempFilePath = path.join(os.tmpdir(), `upload_${randomUUID()}.csv`);
+  await fs.promises.writeFile(
+    tempFilePath,
+    Buffer.from(await data.arrayBuffer()),
+  );
+  try {
+    const result = await runPythonJob("ingest", { filePath: tempFilePath });
+    return result.dataset_key;
+  } finally {
+    await fs.promises.unlink(tempFilePath);
+  }
+}
+
+export function runPythonJob(
+  type: PythonJobType,
+  payload: unknown,
+  options?: PythonJobOptions,
+): Promise<any> {
+  return workerPool.run(type, payload, options);
 }